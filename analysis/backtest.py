@@ -0,0 +1,358 @@
+"""
+Replays archived PrizePicks boards against what the players actually did, to
+tell whether the hit-rate scoring of hit_rates.py would have made money.
+
+Boards are board CSVs as the scraper writes them (players_projections.csv),
+dated by a date column or a YYYY-MM-DD in the file name, or the Parquet line
+history of line_history.py, where the last line seen each day (US Eastern)
+counts. Outcomes and histories come from a Parquet export of the database
+(db_manager/parquet_dump.py), so the backtest runs fully offline.
+
+Each season is a task for a process pool. A worker memory-maps that season's
+and the previous season's player_game, finds every projection's game and the
+player's games before it, and scores all projections of the season at once
+with hit_rates.hit_rates over every lookback window. The parent then sweeps
+the grid of windows and minimum probabilities over all picks:
+
+- picks: per prop type, payout tier, window and threshold, the bets placed
+  (the likelier side, over only for demons and goblins), the hit rate and the
+  ROI at the per-leg multiplier of a --legs pick Power Play.
+- calibration: per prop type, payout tier, window and probability bin, the
+  mean predicted probability against the observed hit rate; and per type,
+  tier and window, the Brier score and expected calibration error.
+- entries: per window, threshold and entry size, the ROI of playing the day's
+  best picks (distinct players) as one Power Play.
+
+Pushes and players who did not play are voided, as PrizePicks does. To run
+this script, execute one of the following commands from the analysis directory:
+python backtest.py --dataset ../db_manager/data/parquet --boards '../data/boards/*.csv'
+python backtest.py --dataset ../db_manager/data/parquet --history ../data/line_history --output backtest
+python backtest.py --dataset ../db_manager/data/parquet --synthetic 300 --seasons 2015 2016 2017
+"""
+
+import argparse
+import glob
+import os
+import re
+import time
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import pandas as pd
+import pyarrow.parquet as pq
+from hit_rates import STATS, TYPES, TYPE_WEIGHTS, WEIGHTS, hit_rates
+from name_index import NameIndex
+from parlay import OVER_ONLY, PAYOUT_FACTORS, POWER_PAYOUTS
+
+# Lookback windows, in games played
+WINDOWS = (5, 10, 20, 50)
+
+# Smallest probability of the chosen side for a pick to be played
+THRESHOLDS = (0.5, 0.55, 0.6, 0.65, 0.7)
+
+# Width of the calibration bins
+BIN_WIDTH = 0.05
+
+# Projections scored at once, bounding the (projections x games x stats) history array
+CHUNK = 20000
+
+DATE_PATTERN = re.compile(r'\d{4}-\d{2}-\d{2}')
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Backtest board scoring against actual outcomes")
+    parser.add_argument('--dataset', default=os.path.join('..', 'db_manager', 'data', 'parquet'), help='Parquet export of the database')
+    boards = parser.add_mutually_exclusive_group(required=True)
+    boards.add_argument('--boards', nargs='+', help='Board CSVs (globs allowed), dated by a date column or their file name')
+    boards.add_argument('--history', help='Directory of the Parquet line history')
+    boards.add_argument('--synthetic', type=int, help='Generate this many projections per game date from the dataset')
+    parser.add_argument('--seasons', type=int, nargs='+', help='Only these seasons')
+    parser.add_argument('--windows', type=int, nargs='+', default=list(WINDOWS), help='Lookback windows to compare')
+    parser.add_argument('--thresholds', type=float, nargs='+', default=list(THRESHOLDS), help='Minimum probabilities to compare')
+    parser.add_argument('--legs', type=int, default=2, choices=sorted(POWER_PAYOUTS), help='Power Play size the pick ROI is priced at')
+    parser.add_argument('--workers', type=int, default=os.cpu_count(), help='Processes, one season at a time each')
+    parser.add_argument('--output', help='Write picks, calibration, brier and entries CSVs with this prefix')
+    return parser.parse_args()
+
+def season_of(dates):
+    # Seasons start in the fall
+    return np.where(dates.dt.month >= 9, dates.dt.year, dates.dt.year - 1)
+
+def load_board_files(patterns):
+    frames = []
+    for path in sorted(path for pattern in patterns for path in glob.glob(pattern)):
+        board = pd.read_csv(path)
+        if 'date' not in board:
+            match = DATE_PATTERN.search(os.path.basename(path))
+            if match is None:
+                print(f"Skipping {path}: no date column or date in the file name.")
+                continue
+            board['date'] = match.group()
+        frames.append(board)
+    return pd.concat(frames, ignore_index=True) if frames else pd.DataFrame()
+
+def load_history(directory):
+    # The last line of each projection seen on each day; removed lines are dropped
+    history = pd.read_parquet(directory)
+    history['date'] = history['observed_at'].dt.tz_convert('America/New_York').dt.date.astype(str)
+    for column in ('Name', 'Type', 'Payout', 'Team', 'Opponent'):
+        history[column] = history[column].astype(object)
+    history = history.sort_values('observed_at', kind='stable')
+    history = history.drop_duplicates(['date', 'Name', 'Type', 'Payout'], keep='last')
+    return history[history['Prop'].notna()].drop(columns=['observed_at'])
+
+def season_paths(dataset, season):
+    return glob.glob(os.path.join(dataset, 'player_game', f'season={season}', '*.parquet'))
+
+def read_games(dataset, seasons):
+    """
+    Every game played in these seasons.
+
+    Returns:
+        tuple: (keys sorted ascending, player ids, stats as float32 (games, len(STATS))),
+        where a game's key is player_id * 100000 + days since 1970-01-01.
+    """
+    tables = [pq.read_table(path, columns=['player_id', 'game_date', 'min'] + list(STATS), memory_map=True)
+              for season in seasons for path in season_paths(dataset, season)]
+    if not tables:
+        return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64), np.zeros((0, len(STATS)), dtype=np.float32)
+    player_ids = np.concatenate([table['player_id'].to_numpy().astype(np.int64) for table in tables])
+    days = np.concatenate([table['game_date'].to_numpy().astype('datetime64[D]').astype(np.int64) for table in tables])
+    minutes = np.concatenate([table['min'].to_numpy(zero_copy_only=False) for table in tables])
+    stats = np.column_stack([np.concatenate([table[stat].to_numpy(zero_copy_only=False) for table in tables])
+                             for stat in STATS]).astype(np.float32)
+    played = minutes > 0
+    keys = player_ids[played] * 100000 + days[played]
+    order = np.argsort(keys, kind='stable')
+    return keys[order], player_ids[played][order], stats[played][order]
+
+def evaluate_season(dataset, season, board, windows):
+    """
+    Scores one season's projections and settles them. Runs in a worker process.
+
+    Args:
+        dataset (str): The Parquet export.
+        season (int): The season the board rows belong to.
+        board (pd.DataFrame): player_id, date, Type, Prop, Payout of the projections.
+        windows (list): Lookback windows.
+
+    Returns:
+        pd.DataFrame: One row per projection and window with p_over, p_under,
+        games, actual (NaN if the player did not play) and the board columns.
+    """
+    keys, player_ids, stats = read_games(dataset, (season - 1, season))
+    days = pd.to_datetime(board['date']).to_numpy().astype('datetime64[D]').astype(np.int64)
+    board_keys = board['player_id'].to_numpy(dtype=np.int64) * 100000 + days
+    index = np.searchsorted(keys, board_keys)
+    played = index < len(keys)
+    played[played] = keys[index[played]] == board_keys[played]
+    # Games of the same player before the board date
+    first = np.searchsorted(keys, board['player_id'].to_numpy(dtype=np.int64) * 100000)
+    before = index - first
+
+    type_rows = np.array([TYPES.index(name) for name in board['Type']], dtype=np.int64)
+    lines = board['Prop'].to_numpy(dtype=np.float32)
+    actual = np.full(len(board), np.nan, dtype=np.float32)
+    actual[played] = np.einsum('ps,ps->p', stats[index[played]], WEIGHTS[type_rows[played]])
+
+    depth = max(windows)
+    results = {window: (np.zeros(len(board)), np.zeros(len(board)), np.zeros(len(board))) for window in windows}
+    offsets = np.arange(1, depth + 1)
+    for start in range(0, len(board), CHUNK):
+        rows = slice(start, start + CHUNK)
+        # (projections, depth) indices of the previous games, newest first
+        history = index[rows, None] - offsets
+        valid = offsets <= before[rows, None]
+        chunk_stats = stats[np.where(valid, history, 0)] if len(stats) else np.zeros(valid.shape + (len(STATS),), np.float32)
+        chunk = hit_rates(np.arange(len(history)), type_rows[rows], lines[rows], chunk_stats, valid, windows)
+        for window, (p_over, p_under, games) in chunk.items():
+            for total, part in zip(results[window], (p_over, p_under, games)):
+                total[rows] = part
+
+    frames = []
+    for window, (p_over, p_under, games) in results.items():
+        frame = board[['date', 'player_id', 'Type', 'Payout', 'Prop']].copy()
+        frame['season'] = season
+        frame['window'] = window
+        frame['p_over'], frame['p_under'], frame['games'] = p_over, p_under, games
+        frame['actual'] = actual
+        frames.append(frame)
+    return pd.concat(frames, ignore_index=True)
+
+def settle(scored, legs):
+    """
+    Chooses each projection's side and settles it.
+
+    Returns:
+        pd.DataFrame: The playable picks with p (the chosen side's probability),
+        hit (bool), factor (the payout tier's), payout (per-leg multiplier)
+        and q (p x factor).
+    """
+    over_only = scored['Payout'].isin(OVER_ONLY).to_numpy()
+    p_over = scored['p_over'].to_numpy()
+    p_under = scored['p_under'].to_numpy()
+    over = over_only | (p_over >= p_under)
+    actual = scored['actual'].to_numpy()
+    lines = scored['Prop'].to_numpy()
+    picks = scored.assign(side=np.where(over, 'over', 'under'), p=np.where(over, p_over, p_under),
+                          hit=np.where(over, actual > lines, actual < lines))
+    # Voided: no history, did not play, or landed on the line
+    picks = picks[picks['p'].notna() & scored['actual'].notna() & (actual != lines)]
+    factor = picks['Payout'].map(PAYOUT_FACTORS).fillna(1.0)
+    picks = picks.assign(factor=factor, payout=POWER_PAYOUTS[legs] ** (1 / legs) * factor, q=picks['p'] * factor)
+    return picks.reset_index(drop=True)
+
+def pick_summary(picks, thresholds):
+    # Hit rate and ROI per type, payout tier, window and threshold
+    frames = []
+    for threshold in thresholds:
+        played = picks[picks['p'] >= threshold]
+        played = played.assign(threshold=threshold, profit=np.where(played['hit'], played['payout'], 0.0) - 1)
+        frames.append(played.groupby(['Type', 'Payout', 'window', 'threshold'])
+                      .agg(bets=('hit', 'size'), hit_rate=('hit', 'mean'), mean_p=('p', 'mean'), roi=('profit', 'mean'))
+                      .reset_index())
+    return pd.concat(frames, ignore_index=True)
+
+def calibration(picks):
+    """
+    Predicted against observed probabilities per prop type, payout tier and window.
+
+    Returns:
+        tuple: (bins, scores). bins has picks, predicted and observed per
+        probability bin of each group; scores has picks, brier and ece
+        (the pick-weighted gap between predicted and observed over the bins)
+        per group.
+    """
+    groups = ['Type', 'Payout', 'window']
+    bins = np.minimum(np.floor(picks['p'] / BIN_WIDTH) * BIN_WIDTH, 1 - BIN_WIDTH).round(2)
+    picks = picks.assign(bin=bins, squared_error=(picks['p'] - picks['hit']) ** 2)
+    table = (picks.groupby(groups + ['bin'])
+             .agg(picks=('hit', 'size'), predicted=('p', 'mean'), observed=('hit', 'mean'))
+             .reset_index())
+    gaps = table.assign(gap=(table['predicted'] - table['observed']).abs() * table['picks']).groupby(groups)['gap'].sum()
+    scores = picks.groupby(groups).agg(picks=('hit', 'size'), brier=('squared_error', 'mean'))
+    scores['ece'] = gaps / scores['picks']
+    return table, scores.reset_index()
+
+def entry_summary(picks, thresholds, sizes=tuple(POWER_PAYOUTS)):
+    """
+    Plays the day's best picks (highest q, one per player) as one Power Play
+    of each size.
+
+    Returns:
+        pd.DataFrame: Per window, threshold and size, the entries played, the
+        share that hit and the ROI.
+    """
+    ranked = picks.sort_values(['window', 'date', 'q'], ascending=[True, True, False], kind='stable')
+    ranked = ranked.drop_duplicates(['window', 'date', 'player_id'])
+    rows = []
+    for threshold in thresholds:
+        eligible = ranked[ranked['p'] >= threshold]
+        rank = eligible.groupby(['window', 'date']).cumcount()
+        for size in sizes:
+            legs = eligible[rank < size]
+            days = legs.groupby(['window', 'date']).agg(
+                legs=('hit', 'size'), hit=('hit', 'all'), factor=('factor', 'prod'))
+            days = days[days['legs'] == size]
+            profit = np.where(days['hit'], POWER_PAYOUTS[size] * days['factor'], 0.0) - 1
+            for window, group in days.assign(profit=profit).groupby(level='window'):
+                rows.append({'window': window, 'threshold': threshold, 'size': size, 'entries': len(group),
+                             'hit_rate': group['hit'].mean(), 'roi': group['profit'].mean()})
+    return pd.DataFrame(rows, columns=['window', 'threshold', 'size', 'entries', 'hit_rate', 'roi'])
+
+def synthetic_boards(dataset, seasons, per_date, seed=0):
+    # Projections for players who played each date, with the line at the
+    # player's season mean of the stat, rounded to the half point below
+    rng = np.random.default_rng(seed)
+    frames = []
+    for season in seasons:
+        keys, player_ids, stats = read_games(dataset, (season,))
+        if not len(keys):
+            continue
+        days = keys % 100000
+        type_rows = rng.integers(0, len(TYPES), len(keys))
+        values = np.einsum('gs,gs->g', stats, WEIGHTS[type_rows])
+        frame = pd.DataFrame({'player_id': player_ids, 'day': days, 'type_row': type_rows, 'value': values})
+        means = frame.groupby(['player_id', 'type_row'])['value'].transform('mean')
+        frame['Prop'] = np.floor(means) + 0.5
+        frame = frame.sample(frac=1, random_state=seed).groupby('day').head(per_date)
+        frames.append(pd.DataFrame({
+            'player_id': frame['player_id'].to_numpy(),
+            'date': (frame['day'].to_numpy().astype('datetime64[D]')).astype(str),
+            'Type': np.array(TYPES)[frame['type_row'].to_numpy()],
+            'Prop': frame['Prop'].to_numpy(),
+            'Payout': rng.choice(['Standard', 'Standard', 'Standard', 'Demon', 'Goblin'], len(frame)),
+        }))
+    return pd.concat(frames, ignore_index=True) if frames else pd.DataFrame()
+
+def load_boards(args):
+    """
+    The boards to replay, with player ids, dates and seasons, restricted to
+    known projection types and --seasons.
+    """
+    if args.synthetic:
+        seasons = args.seasons or sorted(int(path.split('=')[1]) for path in
+                                         glob.glob(os.path.join(args.dataset, 'player_game', 'season=*')))
+        boards = synthetic_boards(args.dataset, seasons, args.synthetic)
+    else:
+        boards = load_history(args.history) if args.history else load_board_files(args.boards)
+        index = NameIndex.from_parquet(args.dataset)
+        boards = index.resolve_board(boards)
+        index.save_aliases()
+        unresolved = boards['player_id'].isna()
+        if unresolved.any():
+            print(f"{boards.loc[unresolved, 'Name'].nunique()} names could not be resolved; their projections are skipped.")
+        boards = boards[~unresolved]
+    if boards.empty:
+        return boards
+    boards = boards[boards['Type'].isin(TYPE_WEIGHTS)].copy()
+    boards['player_id'] = boards['player_id'].astype(np.int64)
+    boards['season'] = season_of(pd.to_datetime(boards['date']))
+    if args.seasons:
+        boards = boards[boards['season'].isin(args.seasons)]
+    return boards.reset_index(drop=True)
+
+def run(boards, dataset, windows, workers):
+    # One task per season; a season's history only needs its own and the previous season's games
+    with ProcessPoolExecutor(workers) as pool:
+        tasks = [pool.submit(evaluate_season, dataset, season, board.reset_index(drop=True), windows)
+                 for season, board in boards.groupby('season')]
+        return pd.concat([task.result() for task in tasks], ignore_index=True)
+
+def main():
+    args = parse_args()
+    start = time.perf_counter()
+    boards = load_boards(args)
+    if boards.empty:
+        print("No projections to replay.")
+        return
+    loaded = time.perf_counter()
+    scored = run(boards, args.dataset, args.windows, args.workers)
+    evaluated = time.perf_counter()
+    picks = settle(scored, args.legs)
+    summary = pick_summary(picks, args.thresholds)
+    calibrated, scores = calibration(picks)
+    entries = entry_summary(picks, args.thresholds)
+    done = time.perf_counter()
+
+    print(f"{len(boards)} projections over {boards['season'].nunique()} seasons: loaded in {loaded - start:.1f}s, "
+          f"scored in {evaluated - loaded:.1f}s, settled in {done - evaluated:.1f}s.")
+    totals = summary.assign(hits=summary['hit_rate'] * summary['bets'], profit=summary['roi'] * summary['bets'])
+    overall = totals.groupby(['window', 'threshold'])[['bets', 'hits', 'profit']].sum()
+    overall = overall.assign(hit_rate=overall['hits'] / overall['bets'], roi=overall['profit'] / overall['bets'])
+    print("\nPicks, all types:")
+    print(overall[['bets', 'hit_rate', 'roi']].reset_index().to_string(index=False, float_format='{:.3f}'.format))
+    print("\nBrier score, by window:")
+    errors = scores.assign(error=scores['brier'] * scores['picks']).groupby('window')[['error', 'picks']].sum()
+    print((errors['error'] / errors['picks']).rename('brier').to_string(float_format='{:.4f}'.format))
+    print("\nLeast calibrated types and tiers:")
+    print(scores[scores['picks'] >= 30].sort_values('ece', ascending=False).head(10)
+          .to_string(index=False, float_format='{:.4f}'.format))
+    print("\nBest entries:")
+    print(entries.sort_values('roi', ascending=False).head(10).to_string(index=False, float_format='{:.3f}'.format))
+    if args.output:
+        summary.to_csv(f"{args.output}_picks.csv", index=False)
+        calibrated.to_csv(f"{args.output}_calibration.csv", index=False)
+        scores.to_csv(f"{args.output}_brier.csv", index=False)
+        entries.to_csv(f"{args.output}_entries.csv", index=False)
+
+if __name__ == '__main__':
+    main()
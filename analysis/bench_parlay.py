@@ -0,0 +1,59 @@
+"""
+Time to the top-K entries of parlay.top_entries as the board grows, in one
+process and across a process pool.
+
+Boards are synthetic: props_per_player projections per player, players
+spread over 30 teams in 15 games, and over probabilities drawn around 0.5 as
+on a real board. No database is needed. To run this script, execute the
+following command from the analysis directory:
+python bench_parlay.py --sizes 50 100 200 400 --top 20
+"""
+
+import argparse
+import os
+import time
+import numpy as np
+import pandas as pd
+from parlay import build_picks, top_entries
+
+TYPES = ('Points', 'Rebounds', 'Assists', 'Pts+Rebs', 'Pts+Asts', 'Rebs+Asts', 'Pts+Rebs+Asts')
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Parlay search benchmark")
+    parser.add_argument('--sizes', type=int, nargs='+', default=[50, 100, 200, 400], help='Projections on the board')
+    parser.add_argument('--top', type=int, default=20, help='Entries to find')
+    parser.add_argument('--props_per_player', type=int, default=5, help='Projections per player')
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, os.cpu_count()], help='Process counts to compare')
+    parser.add_argument('--seed', type=int, default=0, help='Random seed of the synthetic boards')
+    return parser.parse_args()
+
+def synthetic_board(size, props_per_player, rng):
+    # A scored board shaped like hit_rates.score_board output, window 10
+    players = np.arange(size) // props_per_player
+    teams = rng.integers(0, 30, players.max() + 1)[players]
+    p_over = np.clip(rng.normal(0.5, 0.12, size), 0.05, 0.95)
+    return pd.DataFrame({
+        'Name': [f'Player {player}' for player in players],
+        'Type': [TYPES[i % len(TYPES)] for i in range(size)],
+        'Prop': 10.5,
+        'Payout': rng.choice(['Standard', 'Standard', 'Standard', 'Demon', 'Goblin'], size),
+        'Team': [f'T{team}' for team in teams],
+        'Opponent': [f'T{team ^ 1}' for team in teams],
+        'p_over_10': p_over,
+        'p_under_10': 1 - p_over,
+    })
+
+def main():
+    args = parse_args()
+    rng = np.random.default_rng(args.seed)
+    print(f"{'board':>6} {'picks':>6} {'workers':>7} {'seconds':>8} {'nodes':>10} {'best EV':>8}")
+    for size in args.sizes:
+        picks = build_picks(synthetic_board(size, args.props_per_player, rng))
+        for workers in sorted(set(args.workers)):
+            start = time.perf_counter()
+            entries, nodes = top_entries(picks, args.top, workers, max_per_game=3)
+            elapsed = time.perf_counter() - start
+            print(f"{size:>6} {len(picks):>6} {workers:>7} {elapsed:>8.2f} {nodes:>10} {entries[0][0]:>8.3f}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,421 @@
+"""
+Materializes player-game feature matrices for the models, so training jobs read
+memory-mapped files instead of re-running joins over player_game and game.
+
+Every game a player played is one row, in date order, of three matrices:
+
+- keys (int32): player_id, game_id, team_id, opponent_id, season, day (days since 1970-01-01).
+- features (float32), all known before tip-off: home, rest days, means of every
+  stat over the player's previous 5 and 10 games, the advanced fields of
+  data/sample_data.json derivable from box scores (shooting efficiency,
+  usage, rebound and assist shares, pace, ratings) over the previous 10
+  games, and what the opponent allowed over its previous 10 games.
+- targets (float32): the player's stats in the game itself.
+
+Each matrix is a raw row-major file next to a manifest.json holding the
+schema, the row count and each season's row range, so a season or a run of
+seasons is a zero-copy slice of np.memmap. Builds are incremental: only dates
+after the last one stored are read, and the last games of every player and
+team are kept with the store so their rolling windows carry on. The manifest
+also keeps how many ingest_checkpoint dates there were up to its last date.
+Parallel ingest commits dates out of order, so a build that finds more of them
+than that rebuilds the store from scratch.
+
+To run this script, execute one of the following commands from the analysis directory:
+python feature_store.py build
+python feature_store.py load --seasons 2021 2022 2023
+"""
+
+import argparse
+import datetime
+import io
+import json
+import os
+import time
+from types import SimpleNamespace
+import numpy as np
+import psycopg2
+import pyarrow.csv as pa_csv
+from name_index import conn_str
+
+FEATURE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'data', 'features')
+MANIFEST = 'manifest.json'
+
+# Bumped whenever the features change, so an old store is rebuilt rather than appended to
+VERSION = 1
+
+# Lookback windows, in games played
+WINDOWS = (5, 10)
+WINDOW = max(WINDOWS)
+
+STATS = ('min', 'pts', 'reb', 'ast', 'stl', 'blk', 'turnover', 'fg3m', 'fg3a', 'fgm', 'fga', 'ftm', 'fta',
+         'oreb', 'dreb', 'pf')
+
+KEYS = ('player_id', 'game_id', 'team_id', 'opponent_id', 'season', 'day')
+
+# Advanced fields as (numerator, denominator) over the previous WINDOW games.
+# t_ is the player's team in the game, o_ the opponent; t_min / 5 is the game length.
+ADVANCED = {
+    'true_shooting_percentage': lambda c: (c.pts, 2 * (c.fga + 0.44 * c.fta)),
+    'effective_field_goal_percentage': lambda c: (c.fgm + 0.5 * c.fg3m, c.fga),
+    'assist_to_turnover': lambda c: (c.ast, c.turnover),
+    'usage_percentage': lambda c: ((c.fga + 0.44 * c.fta + c.turnover) * c.t_min / 5,
+                                   c.min * (c.t_fga + 0.44 * c.t_fta + c.t_turnover)),
+    'offensive_rebound_percentage': lambda c: (c.oreb * c.t_min / 5, c.min * (c.t_oreb + c.o_dreb)),
+    'defensive_rebound_percentage': lambda c: (c.dreb * c.t_min / 5, c.min * (c.t_dreb + c.o_oreb)),
+    'rebound_percentage': lambda c: (c.reb * c.t_min / 5, c.min * (c.t_reb + c.o_reb)),
+    'assist_percentage': lambda c: (c.ast, c.min / (c.t_min / 5) * c.t_fgm - c.fgm),
+    'pace': lambda c: (24 * (c.t_poss + c.o_poss), c.t_min / 5),
+    'offensive_rating': lambda c: (100 * c.t_pts, c.t_poss),
+    'defensive_rating': lambda c: (100 * c.o_pts, c.o_poss),
+}
+
+# What a team's opponents scored against it, averaged over its previous WINDOW games
+ALLOWED = ('pts', 'reb', 'ast', 'fg3m', 'poss')
+
+FEATURES = (['home', 'rest_days', 'games'] +
+            [f'{stat}_avg{window}' for window in WINDOWS for stat in STATS] +
+            list(ADVANCED) +
+            [f'opp_{stat}_allowed' for stat in ALLOWED if stat != 'poss'] + ['opp_defensive_rating'])
+
+TARGETS = STATS
+
+# Every game a player played on a completed (checkpointed) date, in storage order.
+# A player traded between the two teams of a game is counted with the home team.
+rows_query = f"""
+SELECT pg.player_id, pg.game_id,
+       CASE WHEN EXISTS (SELECT 1 FROM player_team pt WHERE pt.player_id = pg.player_id AND pt.team_id = g.home_team_id)
+            THEN g.home_team_id ELSE g.visitor_team_id END AS team_id,
+       g.home_team_id, g.visitor_team_id, pg.season, pg.game_date - DATE '1970-01-01' AS day,
+       {', '.join(f'pg.{stat}' for stat in STATS)}
+FROM player_game pg
+JOIN game g ON g.game_id = pg.game_id
+WHERE pg.min > 0 AND pg.game_date > %(since)s
+  AND pg.game_date <= (SELECT max(date) FROM ingest_checkpoint)
+ORDER BY pg.game_date, pg.game_id, pg.player_id
+"""
+
+# Completed dates up to the store's last date. Any beyond the count in the
+# manifest were committed after the build that stored later dates, and skipped.
+checkpoints_query = """
+SELECT count(*) FROM ingest_checkpoint WHERE date <= %(through)s;
+"""
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Memory-mapped player-game feature store")
+    parser.add_argument('command', choices=['build', 'load'], help='Append new games to the store, or time loading it')
+    parser.add_argument('--dir', default=FEATURE_DIR, help='The feature store directory')
+    parser.add_argument('--rebuild', action='store_true', help='Discard the store and build it from the first game')
+    parser.add_argument('--seasons', type=int, nargs='+', help='Seasons to load (default: all)')
+    return parser.parse_args()
+
+def day_date(day):
+    return datetime.date(1970, 1, 1) + datetime.timedelta(days=day)
+
+def read_rows(cursor, since):
+    # Streams the new rows out of Postgres as CSV into one float64 array
+    buffer = io.BytesIO()
+    query = cursor.mogrify(rows_query, {'since': since}).decode()
+    cursor.copy_expert(f"COPY ({query}) TO STDOUT WITH (FORMAT csv)", buffer)
+    buffer.seek(0)
+    names = ['player_id', 'game_id', 'team_id', 'home_team_id', 'visitor_team_id', 'season', 'day'] + list(STATS)
+    if not buffer.getbuffer().nbytes:
+        return {name: np.zeros(0) for name in names}
+    table = pa_csv.read_csv(buffer, read_options=pa_csv.ReadOptions(column_names=names))
+    return {name: table[name].to_numpy().astype(np.float64) for name in names}
+
+def ratio(numerator, denominator):
+    with np.errstate(invalid='ignore', divide='ignore'):
+        result = numerator / denominator
+    result[~np.isfinite(result)] = np.nan
+    return result
+
+def group_positions(groups):
+    # Index of each row within its run of equal group ids
+    starts = np.r_[0, np.flatnonzero(groups[1:] != groups[:-1]) + 1]
+    return np.arange(len(groups)) - np.repeat(starts, np.diff(np.r_[starts, len(groups)]))
+
+def prior_sums(values, position, window):
+    """
+    Sums of each row's previous `window` rows in its group.
+
+    Args:
+        values (np.ndarray): (rows, columns), sorted by group then time.
+        position (np.ndarray): Each row's index within its group.
+
+    Returns:
+        tuple: (sums of shape (rows, columns), the number of rows summed).
+    """
+    cumulative = np.vstack([np.zeros((1, values.shape[1])), np.cumsum(values, axis=0)])
+    rows = np.arange(len(values))
+    count = np.minimum(position, window)
+    return cumulative[rows] - cumulative[rows - count], count
+
+def team_games(rows):
+    """
+    Totals of every team in every game of the new rows.
+
+    Returns:
+        tuple: (the team-game of each row, the opponent team-game of each
+        team-game or -1, dict of totals per team-game with t_ names).
+    """
+    pairs = np.column_stack((rows['game_id'], rows['team_id']))
+    unique, inverse = np.unique(pairs, axis=0, return_inverse=True)
+    inverse = inverse.ravel()
+    totals = {f't_{stat}': np.bincount(inverse, weights=rows[stat], minlength=len(unique)) for stat in STATS}
+    totals['t_poss'] = totals['t_fga'] + 0.44 * totals['t_fta'] - totals['t_oreb'] + totals['t_turnover']
+    totals['game_id'], totals['team_id'] = unique[:, 0], unique[:, 1]
+    totals['day'] = np.zeros(len(unique))
+    totals['day'][inverse] = rows['day']
+
+    # Sorted by game, so the two teams of a game are neighbours
+    opponent = np.full(len(unique), -1)
+    same = np.flatnonzero(unique[1:, 0] == unique[:-1, 0])
+    opponent[same], opponent[same + 1] = same + 1, same
+    return inverse, opponent, totals
+
+def with_tail(tail, group, day, values):
+    # Prepends the stored last games to the new ones and sorts by group then
+    # time; returns the order, the new rows' places in it, and the combined arrays
+    group = np.r_[tail['group'], group]
+    day = np.r_[tail['day'], day]
+    values = np.vstack([tail['values'], values])
+    order = np.lexsort((np.arange(len(group)), day, group))
+    places = np.empty(len(group), dtype=np.int64)
+    places[order] = np.arange(len(group))
+    return group[order], day[order], values[order], places[len(tail['group']):]
+
+def last_games(group, day, values):
+    # The last WINDOW rows of every group, to carry the windows into the next build
+    from_end = group_positions(group[::-1])[::-1]
+    keep = from_end < WINDOW
+    return {'group': group[keep], 'day': day[keep], 'values': values[keep]}
+
+def empty_tail(columns):
+    return {'group': np.zeros(0), 'day': np.zeros(0), 'values': np.zeros((0, columns))}
+
+def compute(rows, player_tail, team_tail):
+    """
+    Features and targets of the new rows.
+
+    Returns:
+        tuple: (keys, features, targets, new player tail, new team tail).
+    """
+    inverse, opponent, totals = team_games(rows)
+    # Opponent totals of each team-game; a game missing a side gets NaN
+    opponent_totals = {name.replace('t_', 'o_', 1): np.r_[column, np.nan][opponent]
+                       for name, column in totals.items() if name.startswith('t_')}
+
+    # The team's defence: what its opponents made, over its previous games
+    allowed = np.column_stack([opponent_totals[f'o_{stat}'] for stat in ALLOWED])
+    team_group, team_day, team_values, team_places = with_tail(team_tail, totals['team_id'], totals['day'], allowed)
+    sums, count = prior_sums(np.nan_to_num(team_values), group_positions(team_group), WINDOW)
+    sums = sums[team_places]
+    count = count[team_places]
+    defence = {f'opp_{stat}_allowed': ratio(sums[:, i], count) for i, stat in enumerate(ALLOWED) if stat != 'poss'}
+    defence['opp_defensive_rating'] = ratio(100 * sums[:, ALLOWED.index('pts')], sums[:, ALLOWED.index('poss')])
+    team_tail = last_games(team_group, team_day, team_values)
+
+    # The player's own previous games
+    columns = dict(rows)
+    columns.update({name: column[inverse] for name, column in totals.items() if name.startswith('t_')})
+    columns.update({name: column[inverse] for name, column in opponent_totals.items()})
+    namespace = SimpleNamespace(**columns)
+    advanced = [part for fields in ADVANCED.values() for part in fields(namespace)]
+    values = np.column_stack([rows[stat] for stat in STATS] + advanced)
+    group, day, combined, places = with_tail(player_tail, rows['player_id'], rows['day'], values)
+    position = group_positions(group)
+    rest = np.r_[np.nan, np.diff(day)]
+    rest[position == 0] = np.nan
+    features = {'home': (rows['team_id'] == rows['home_team_id']).astype(np.float64),
+                'rest_days': rest[places],
+                'games': np.minimum(position, WINDOW)[places].astype(np.float64)}
+    clean = np.nan_to_num(combined)
+    for window in WINDOWS:
+        sums, count = prior_sums(clean[:, :len(STATS)], position, window)
+        for i, stat in enumerate(STATS):
+            features[f'{stat}_avg{window}'] = ratio(sums[places, i], count[places])
+    sums, _ = prior_sums(clean[:, len(STATS):], position, WINDOW)
+    for i, name in enumerate(ADVANCED):
+        features[name] = ratio(sums[places, 2 * i], sums[places, 2 * i + 1])
+    for name, column in defence.items():
+        # The opponent's team-game is the row's own team-game's opponent
+        features[name] = np.r_[column, np.nan][opponent[inverse]]
+    player_tail = last_games(group, day, combined)
+
+    opponent_id = np.where(rows['team_id'] == rows['home_team_id'], rows['visitor_team_id'], rows['home_team_id'])
+    keys = np.column_stack([rows['player_id'], rows['game_id'], rows['team_id'], opponent_id, rows['season'],
+                            rows['day']]).astype(np.int32)
+    return (keys, np.column_stack([features[name] for name in FEATURES]).astype(np.float32),
+            np.column_stack([rows[stat] for stat in TARGETS]).astype(np.float32), player_tail, team_tail)
+
+class FeatureStore:
+    """
+    The feature matrices of one directory, opened as memory maps.
+    """
+
+    dtypes = {'keys': np.int32, 'features': np.float32, 'targets': np.float32}
+
+    def __init__(self, directory=FEATURE_DIR):
+        self.directory = directory
+        self.manifest = self.read_manifest()
+
+    def read_manifest(self):
+        path = os.path.join(self.directory, MANIFEST)
+        if not os.path.exists(path):
+            return {'version': VERSION, 'rows': 0, 'last_day': None, 'seasons': {}, 'tail': None, 'checkpoints': 0,
+                    'columns': {'keys': list(KEYS), 'features': FEATURES, 'targets': list(TARGETS)}}
+        with open(path) as f:
+            return json.load(f)
+
+    def path(self, name):
+        return os.path.join(self.directory, f"{name}.bin")
+
+    def columns(self, name):
+        return self.manifest['columns'][name]
+
+    def matrix(self, name):
+        """
+        Returns:
+            np.ndarray: The whole matrix, memory-mapped read-only.
+        """
+        shape = (self.manifest['rows'], len(self.columns(name)))
+        if not shape[0]:
+            return np.zeros(shape, dtype=self.dtypes[name])
+        return np.memmap(self.path(name), dtype=self.dtypes[name], mode='r', shape=shape)
+
+    def rows(self, seasons=None):
+        # The row range holding these seasons; rows are in date order, so it is contiguous
+        if seasons is None:
+            return slice(0, self.manifest['rows'])
+        ranges = [self.manifest['seasons'][str(season)] for season in seasons if str(season) in self.manifest['seasons']]
+        if not ranges:
+            return slice(0, 0)
+        return slice(min(start for start, _ in ranges), max(stop for _, stop in ranges))
+
+    def load(self, seasons=None):
+        """
+        Zero-copy views of the store.
+
+        Args:
+            seasons (list): Seasons to load, None for all. Seasons in between
+                those asked for are included.
+
+        Returns:
+            dict: 'keys', 'features' and 'targets' arrays with the same rows.
+            Column names are in self.columns(name).
+        """
+        rows = self.rows(seasons)
+        return {name: self.matrix(name)[rows] for name in self.dtypes}
+
+    def read_tail(self):
+        if not self.manifest['tail']:
+            return empty_tail(len(STATS) + 2 * len(ADVANCED)), empty_tail(len(ALLOWED))
+        with np.load(os.path.join(self.directory, self.manifest['tail'])) as saved:
+            return ({'group': saved['player_group'], 'day': saved['player_day'], 'values': saved['player_values']},
+                    {'group': saved['team_group'], 'day': saved['team_day'], 'values': saved['team_values']})
+
+    def write_manifest(self):
+        path = os.path.join(self.directory, MANIFEST)
+        with open(f"{path}.tmp", 'w') as f:
+            json.dump(self.manifest, f, indent=2)
+        os.replace(f"{path}.tmp", path)
+
+    def append(self, keys, features, targets, seasons, player_tail, team_tail, checkpoints):
+        """
+        Appends rows and records them in the manifest, which is replaced last,
+        so a build that dies midway leaves the store as it was.
+
+        Args:
+            checkpoints (int): The number of completed dates up to the last one appended.
+        """
+        rows = self.manifest['rows']
+        for name, data in (('keys', keys), ('features', features), ('targets', targets)):
+            row_bytes = len(self.columns(name)) * np.dtype(self.dtypes[name]).itemsize
+            with open(self.path(name), 'ab') as f:
+                # Drops whatever an interrupted build wrote past the manifest's rows
+                f.truncate(rows * row_bytes)
+                f.write(np.ascontiguousarray(data).tobytes())
+                f.flush()
+                os.fsync(f.fileno())
+
+        for season in np.unique(seasons).tolist():
+            where = np.flatnonzero(seasons == season)
+            start, stop = rows + int(where[0]), rows + int(where[-1]) + 1
+            old = self.manifest['seasons'].get(str(season))
+            self.manifest['seasons'][str(season)] = [old[0] if old else start, stop]
+
+        old_tail = self.manifest['tail']
+        tail = f"tail-{rows + len(keys)}.npz"
+        np.savez(os.path.join(self.directory, tail),
+                 player_group=player_tail['group'], player_day=player_tail['day'], player_values=player_tail['values'],
+                 team_group=team_tail['group'], team_day=team_tail['day'], team_values=team_tail['values'])
+        self.manifest.update(rows=rows + len(keys), last_day=int(keys[:, KEYS.index('day')].max()), tail=tail,
+                             checkpoints=checkpoints, built_at=datetime.datetime.now().isoformat(timespec='seconds'))
+        self.write_manifest()
+        if old_tail and old_tail != tail:
+            os.remove(os.path.join(self.directory, old_tail))
+
+def build(directory, rebuild=False):
+    """
+    Appends the games played after the last date in the store.
+
+    Returns:
+        int: The number of rows appended.
+    """
+    os.makedirs(directory, exist_ok=True)
+    store = FeatureStore(directory)
+    current = {'keys': list(KEYS), 'features': FEATURES, 'targets': list(TARGETS)}
+    rebuild = rebuild or store.manifest.get('version') != VERSION or store.manifest['columns'] != current
+
+    # One snapshot, so the rows read and the checkpoints counted agree
+    conn = psycopg2.connect(conn_str)
+    conn.set_session(isolation_level='REPEATABLE READ', readonly=True)
+    with conn.cursor() as cursor:
+        last_day = store.manifest['last_day']
+        if not rebuild and last_day is not None:
+            cursor.execute(checkpoints_query, {'through': day_date(last_day)})
+            checkpoints = cursor.fetchone()[0]
+            if checkpoints != store.manifest.get('checkpoints'):
+                print(f"{checkpoints - (store.manifest.get('checkpoints') or 0)} dates up to {day_date(last_day)} "
+                      "were committed after the last build; rebuilding the store.")
+                rebuild = True
+        if rebuild:
+            for name in os.listdir(directory):
+                os.remove(os.path.join(directory, name))
+            store = FeatureStore(directory)
+        last_day = store.manifest['last_day']
+        rows = read_rows(cursor, day_date(last_day) if last_day is not None else datetime.date.min)
+        if len(rows['player_id']):
+            cursor.execute(checkpoints_query, {'through': day_date(int(rows['day'].max()))})
+            checkpoints = cursor.fetchone()[0]
+    conn.close()
+    if not len(rows['player_id']):
+        return 0
+
+    player_tail, team_tail = store.read_tail()
+    keys, features, targets, player_tail, team_tail = compute(rows, player_tail, team_tail)
+    store.append(keys, features, targets, keys[:, KEYS.index('season')], player_tail, team_tail, checkpoints)
+    return len(keys)
+
+def main():
+    args = parse_args()
+    if args.command == 'build':
+        start = time.perf_counter()
+        added = build(args.dir, args.rebuild)
+        store = FeatureStore(args.dir)
+        print(f"Appended {added} rows in {time.perf_counter() - start:.1f}s; "
+              f"the store holds {store.manifest['rows']} rows over {len(store.manifest['seasons'])} seasons.")
+    else:
+        start = time.perf_counter()
+        store = FeatureStore(args.dir)
+        data = store.load(args.seasons)
+        opened = time.perf_counter() - start
+        means = np.nanmean(data['features'], axis=0)
+        print(f"{len(data['features'])} rows x {len(store.columns('features'))} features opened in "
+              f"{opened * 1000:.1f} ms, read in {(time.perf_counter() - start) * 1000:.1f} ms.")
+        for name, mean in zip(store.columns('features'), means):
+            print(f"{name:<32} {mean:>10.3f}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,181 @@
+"""
+Empirical over/under probabilities for every projection on a PrizePicks board.
+
+Each projection's Type (Points, Pts+Rebs+Asts, Fantasy Score, ...) is a row of
+weights over the player_game stat columns. The histories of every player on
+the board are loaded with one query into a (players x games x stats) array,
+newest game first, so the stat combination of every projection over every
+game is a single matrix product and the hit rates over all lookback windows
+come from one cumulative sum.
+
+To run this script, execute the following command from the analysis directory:
+python hit_rates.py --projections ../players_projections.csv --output ../hit_rates.csv
+"""
+
+import argparse
+import time
+import numpy as np
+import pandas as pd
+import psycopg2
+from name_index import NameIndex, conn_str
+
+# Lookback windows, in games played
+WINDOWS = (5, 10, 20, 50)
+
+STATS = ('pts', 'reb', 'ast', 'stl', 'blk', 'turnover', 'fg3m', 'fg3a', 'fgm', 'fga', 'ftm', 'fta',
+         'oreb', 'dreb', 'pf')
+
+# PrizePicks projection types as weights over STATS
+TYPE_WEIGHTS = {
+    'Points': {'pts': 1},
+    'Rebounds': {'reb': 1},
+    'Assists': {'ast': 1},
+    'Steals': {'stl': 1},
+    'Blocked Shots': {'blk': 1},
+    'Turnovers': {'turnover': 1},
+    '3-PT Made': {'fg3m': 1},
+    '3-PT Attempted': {'fg3a': 1},
+    'FG Made': {'fgm': 1},
+    'FG Attempted': {'fga': 1},
+    'Two Pointers Made': {'fgm': 1, 'fg3m': -1},
+    'Two Pointers Attempted': {'fga': 1, 'fg3a': -1},
+    'Free Throws Made': {'ftm': 1},
+    'Free Throws Attempted': {'fta': 1},
+    'Offensive Rebounds': {'oreb': 1},
+    'Defensive Rebounds': {'dreb': 1},
+    'Personal Fouls': {'pf': 1},
+    'Pts+Rebs': {'pts': 1, 'reb': 1},
+    'Pts+Asts': {'pts': 1, 'ast': 1},
+    'Rebs+Asts': {'reb': 1, 'ast': 1},
+    'Pts+Rebs+Asts': {'pts': 1, 'reb': 1, 'ast': 1},
+    'Blks+Stls': {'blk': 1, 'stl': 1},
+    'Fantasy Score': {'pts': 1, 'reb': 1.2, 'ast': 1.5, 'stl': 3, 'blk': 3, 'turnover': -1},
+}
+
+TYPES = list(TYPE_WEIGHTS)
+WEIGHTS = np.array([[TYPE_WEIGHTS[name].get(stat, 0) for stat in STATS] for name in TYPES], dtype=np.float32)
+
+# The latest `games` games each player actually played, newest first
+history_query = f"""
+SELECT p.player_id, {', '.join(f'h.{stat}' for stat in STATS)}
+FROM unnest(%(players)s::INT[]) AS p(player_id)
+CROSS JOIN LATERAL (
+    SELECT pg.season, pg.game_date, {', '.join(f'pg.{stat}' for stat in STATS)}
+    FROM player_game pg
+    WHERE pg.player_id = p.player_id AND pg.min > 0
+    ORDER BY pg.season DESC, pg.game_date DESC
+    LIMIT %(games)s
+) h
+ORDER BY p.player_id, h.season DESC, h.game_date DESC;
+"""
+
+def load_histories(cursor, player_ids, games=max(WINDOWS)):
+    """
+    Loads the recent games of a set of players in one query.
+
+    Args:
+        cursor: An open cursor.
+        player_ids (list): The players to load.
+        games (int): Games kept per player.
+
+    Returns:
+        tuple: (player ids in row order as np.ndarray, stats as a float32 array of shape
+        (players, games, len(STATS)), played as a bool array of shape (players, games)).
+        Players with fewer games are padded with zeros and played=False.
+    """
+    cursor.execute(history_query, {'players': sorted(set(player_ids)), 'games': games})
+    rows = cursor.fetchall()
+    # Ids are kept as int64: float32 is exact only up to 2^24, below many balldontlie ids
+    ids = np.fromiter((row[0] for row in rows), dtype=np.int64, count=len(rows))
+    values = np.array([row[1:] for row in rows], dtype=np.float32).reshape(-1, len(STATS))
+    players, starts, inverse = np.unique(ids, return_index=True, return_inverse=True)
+    position = np.arange(len(rows)) - starts[inverse]
+    stats = np.zeros((len(players), games, len(STATS)), dtype=np.float32)
+    played = np.zeros((len(players), games), dtype=bool)
+    stats[inverse, position] = values
+    played[inverse, position] = True
+    return players, stats, played
+
+def hit_rates(player_rows, type_rows, lines, stats, played, windows=WINDOWS):
+    """
+    Over and under hit rates of many projections over several windows at once.
+
+    Args:
+        player_rows (np.ndarray): Each projection's row in the history arrays.
+        type_rows (np.ndarray): Each projection's row in WEIGHTS.
+        lines (np.ndarray): Each projection's line.
+        stats (np.ndarray): Histories from load_histories.
+        played (np.ndarray): Played mask from load_histories.
+        windows (tuple): Lookback windows in games.
+
+    Returns:
+        dict: window -> (p_over, p_under, games) arrays, one entry per projection.
+        Probabilities are NaN for projections without games.
+    """
+    # (projections, games): the projection's stat combination in each game
+    values = np.einsum('pgs,ps->pg', stats[player_rows], WEIGHTS[type_rows])
+    valid = played[player_rows]
+    overs = np.cumsum((values > lines[:, None]) & valid, axis=1)
+    unders = np.cumsum((values < lines[:, None]) & valid, axis=1)
+    counts = np.cumsum(valid, axis=1)
+    results = {}
+    with np.errstate(invalid='ignore', divide='ignore'):
+        for window in windows:
+            column = min(window, values.shape[1]) - 1
+            games = counts[:, column]
+            results[window] = (overs[:, column] / games, unders[:, column] / games, games)
+    return results
+
+def score_board(board, cursor, windows=WINDOWS):
+    """
+    Adds p_over_<w>, p_under_<w> and games_<w> columns for every window to a
+    board that already has a player_id column (see NameIndex.resolve_board).
+    Projections of unknown players or types get NaN.
+    """
+    result = board.copy()
+    known = result['player_id'].notna().to_numpy() & result['Type'].isin(TYPE_WEIGHTS).to_numpy()
+    player_ids = result.loc[known, 'player_id'].astype(np.int64).to_numpy()
+    players, stats, played = load_histories(cursor, player_ids.tolist(), max(windows))
+
+    # Players with no games at all are missing from the arrays; point them at an empty row
+    stats = np.concatenate([stats, np.zeros((1,) + stats.shape[1:], dtype=np.float32)])
+    played = np.concatenate([played, np.zeros((1, played.shape[1]), dtype=bool)])
+    row_of = {player_id: row for row, player_id in enumerate(players.tolist())}
+    player_rows = np.array([row_of.get(player_id, len(players)) for player_id in player_ids.tolist()], dtype=np.int64)
+
+    type_rows = np.array([TYPES.index(name) for name in result.loc[known, 'Type']], dtype=np.int64)
+    lines = result.loc[known, 'Prop'].to_numpy(dtype=np.float32)
+    rates = hit_rates(player_rows, type_rows, lines, stats, played, windows)
+    for window, (p_over, p_under, games) in rates.items():
+        for name, values in ((f'p_over_{window}', p_over), (f'p_under_{window}', p_under), (f'games_{window}', games)):
+            result[name] = np.nan
+            result.loc[known, name] = values
+    return result
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Board-wide over/under hit rates")
+    parser.add_argument('--projections', default='../players_projections.csv', help='A scraped board')
+    parser.add_argument('--output', help='Write the scored board to this CSV')
+    return parser.parse_args()
+
+def main():
+    args = parse_args()
+    board = pd.read_csv(args.projections)
+    index = NameIndex.from_database()
+    start = time.perf_counter()
+    board = index.resolve_board(board)
+    conn = psycopg2.connect(conn_str)
+    with conn.cursor() as cursor:
+        scored = score_board(board, cursor)
+    conn.close()
+    elapsed = time.perf_counter() - start
+    index.save_aliases()
+
+    print(f"Scored {len(scored)} projections in {elapsed * 1000:.1f} ms.")
+    columns = ['Name', 'Type', 'Prop'] + [f'p_over_{window}' for window in WINDOWS]
+    print(scored.dropna(subset=[f'p_over_{WINDOWS[0]}'])[columns].head(20).to_string(index=False))
+    if args.output:
+        scored.to_csv(args.output, index=False)
+
+if __name__ == '__main__':
+    main()
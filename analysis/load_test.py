@@ -0,0 +1,118 @@
+"""
+Load test for serve.py: a pool of client threads, each on its own keep-alive
+connection, sends a mix of requests over random players and reports the
+latency percentiles per endpoint and overall.
+
+With --revalidate, each client sends back the ETag it last saw for a URL, so
+unchanged results come back as bodiless 304s. With --no_cache, every request
+bypasses the server's result cache, which gives the uncached baseline.
+
+To run this script, start serve.py and execute the following command from the analysis directory:
+python load_test.py --requests 5000 --concurrency 16
+python load_test.py --requests 2000 --concurrency 16 --no_cache
+"""
+
+import argparse
+import http.client
+import random
+import time
+from collections import Counter, defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlparse
+import numpy as np
+import orjson
+
+# (endpoint name, relative weight)
+MIX = (('games', 40), ('rolling', 40), ('season_averages', 10), ('board', 10))
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Load test the read API")
+    parser.add_argument('--url', default='http://127.0.0.1:8080', help='Where serve.py listens')
+    parser.add_argument('--requests', type=int, default=5000, help='Requests to send in total')
+    parser.add_argument('--concurrency', type=int, default=16, help='Client threads')
+    parser.add_argument('--players', type=int, default=200, help='Distinct players requested')
+    parser.add_argument('--revalidate', action='store_true', help='Send If-None-Match with the last ETag seen')
+    parser.add_argument('--no_cache', action='store_true', help='Bypass the server cache')
+    parser.add_argument('--seed', type=int, default=0, help='Seed of the request mix')
+    return parser.parse_args()
+
+def request_path(endpoint, player_id, rng):
+    if endpoint == 'games':
+        return f"/players/{player_id}/games?limit={rng.choice((10, 20, 50))}"
+    if endpoint == 'rolling':
+        return f"/players/{player_id}/rolling?window={rng.choice((5, 10, 0))}"
+    if endpoint == 'season_averages':
+        return "/seasons/averages"
+    return "/board"
+
+def run_client(url, plan, revalidate, no_cache):
+    """
+    Sends one client's requests in order on one connection.
+
+    Args:
+        url (urllib.parse.ParseResult): The service.
+        plan (list): (endpoint, path) pairs.
+
+    Returns:
+        list: (endpoint, status, seconds) per request.
+    """
+    conn = http.client.HTTPConnection(url.hostname, url.port, timeout=60)
+    etags = {}
+    results = []
+    for endpoint, path in plan:
+        headers = {}
+        if no_cache:
+            headers['Cache-Control'] = 'no-cache'
+        if revalidate and path in etags:
+            headers['If-None-Match'] = etags[path]
+        start = time.perf_counter()
+        conn.request('GET', path, headers=headers)
+        response = conn.getresponse()
+        response.read()
+        results.append((endpoint, response.status, time.perf_counter() - start))
+        if response.getheader('ETag'):
+            etags[path] = response.getheader('ETag')
+    conn.close()
+    return results
+
+def percentiles(seconds):
+    milliseconds = np.array(seconds) * 1000
+    return {'requests': len(milliseconds), 'p50_ms': np.percentile(milliseconds, 50),
+            'p99_ms': np.percentile(milliseconds, 99), 'mean_ms': milliseconds.mean()}
+
+def main():
+    args = parse_args()
+    url = urlparse(args.url)
+    conn = http.client.HTTPConnection(url.hostname, url.port, timeout=60)
+    conn.request('GET', '/players')
+    players = sorted({player['player_id'] for player in orjson.loads(conn.getresponse().read())})
+    conn.close()
+
+    rng = random.Random(args.seed)
+    players = rng.sample(players, min(args.players, len(players)))
+    endpoints, weights = zip(*MIX)
+    plan = [(endpoint, request_path(endpoint, rng.choice(players), rng))
+            for endpoint in rng.choices(endpoints, weights, k=args.requests)]
+    plans = [plan[client::args.concurrency] for client in range(args.concurrency)]
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(args.concurrency) as executor:
+        results = [result for client in executor.map(lambda part: run_client(url, part, args.revalidate, args.no_cache),
+                                                      plans)
+                   for result in client]
+    elapsed = time.perf_counter() - start
+
+    by_endpoint = defaultdict(list)
+    for endpoint, _, seconds in results:
+        by_endpoint[endpoint].append(seconds)
+    statuses = Counter(status for _, status, _ in results)
+    print(f"{len(results)} requests in {elapsed:.2f}s ({len(results) / elapsed:.0f}/s) "
+          f"with {args.concurrency} clients; statuses {dict(sorted(statuses.items()))}")
+    print(f"{'endpoint':<16} {'requests':>8} {'p50 ms':>8} {'p99 ms':>8} {'mean ms':>8}")
+    rows = [(endpoint, percentiles(by_endpoint[endpoint])) for endpoint in endpoints if by_endpoint[endpoint]]
+    rows.append(('all', percentiles([seconds for _, _, seconds in results])))
+    for endpoint, row in rows:
+        print(f"{endpoint:<16} {row['requests']:>8} {row['p50_ms']:>8.2f} {row['p99_ms']:>8.2f} {row['mean_ms']:>8.2f}")
+
+if __name__ == '__main__':
+    main()
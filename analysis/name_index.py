@@ -0,0 +1,275 @@
+"""
+Resolves the player names PrizePicks shows on its board (players_projections.csv)
+to balldontlie player ids in the box_scores database.
+
+Names are reduced to a normalized key (accents, punctuation and suffixes such
+as Jr. or III removed, common nicknames mapped to one given name), then looked
+up first among the players of the projection's team and then league-wide.
+Names that only a fuzzy match could place are remembered in an alias file, so
+the next run resolves them with a single lookup.
+
+To run this script, execute the following command from the analysis directory:
+python name_index.py --projections ../players_projections.csv
+"""
+
+import argparse
+import difflib
+import glob
+import json
+import os
+import re
+import time
+import unicodedata
+import pandas as pd
+import psycopg2
+import pyarrow.parquet as pq
+from dotenv import load_dotenv
+
+# Load environment variables from .env
+load_dotenv()
+
+# PostgreSQL connection details
+conn_str = (f"dbname=box_scores user={os.getenv('DB_USER')} " +
+            f"password={os.getenv('DB_PASSWORD')} host={os.getenv('DB_HOST')} " +
+            f"port={os.getenv('DB_PORT')}")
+
+ALIASES_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'data', 'name_aliases.json')
+
+# Generational suffixes dropped from names
+SUFFIXES = {'jr', 'sr', 'ii', 'iii', 'iv', 'v'}
+
+# Short given names mapped to the form balldontlie uses, or vice versa
+NICKNAMES = {
+    'nic': 'nicolas', 'nick': 'nicolas', 'nicholas': 'nicolas',
+    'cam': 'cameron', 'mo': 'mohamed', 'moe': 'maurice',
+    'herb': 'herbert', 'alex': 'alexander', 'chris': 'christopher',
+    'mike': 'michael', 'matt': 'matthew', 'will': 'william', 'bill': 'william',
+    'jim': 'james', 'jimmy': 'james', 'jon': 'jonathan', 'tim': 'timothy',
+    'greg': 'gregory', 'gg': 'gregory', 'kj': 'kenyon', 'og': 'ogugua',
+    'sasha': 'aleksandar', 'santi': 'santiago',
+}
+
+# PrizePicks abbreviations that differ from balldontlie's
+TEAM_ALIASES = {'NO': 'NOP', 'NY': 'NYK', 'GS': 'GSW', 'SA': 'SAS', 'UTAH': 'UTA', 'WSH': 'WAS', 'PHO': 'PHX'}
+
+# Fuzzy matches below this similarity are not trusted
+FUZZY_CUTOFF = 0.85
+
+players_query = """
+SELECT p.player_id, p.first_name, p.last_name, t.abbreviation,
+       (SELECT MAX(pg.season) FROM player_game pg WHERE pg.player_id = p.player_id)
+FROM player p
+LEFT JOIN player_team pt ON pt.player_id = p.player_id
+LEFT JOIN team t ON t.team_id = pt.team_id;
+"""
+
+def normalize(name):
+    """
+    Reduces a display name to its lookup key.
+
+    Args:
+        name (str): A name such as 'Jaren Jackson Jr.' or 'Dennis Schröder'.
+
+    Returns:
+        str: The key, e.g. 'jaren jackson' or 'dennis schroder'.
+    """
+    text = unicodedata.normalize('NFKD', name).encode('ascii', 'ignore').decode().lower()
+    tokens = [token for token in re.sub(r"[^a-z' ]", ' ', text.replace('.', '')).replace("'", '').split()
+              if token not in SUFFIXES]
+    return ' '.join(tokens)
+
+def canonical(key):
+    # The key with its given name replaced by the nickname table's form
+    first, _, rest = key.partition(' ')
+    return f"{NICKNAMES.get(first, first)} {rest}" if rest else key
+
+def team_code(team):
+    if team is None:
+        return None
+    team = str(team).upper()
+    return TEAM_ALIASES.get(team, team)
+
+class NameIndex:
+    """
+    An in-memory index from normalized player names (per team and league-wide)
+    to player ids, with learned aliases persisted between runs.
+    """
+
+    def __init__(self, players, aliases_path=ALIASES_PATH):
+        """
+        Args:
+            players (list): (player_id, first_name, last_name, team abbreviation, last season) rows,
+                one per player and team.
+            aliases_path (str): JSON file of learned aliases, read now and written by save_aliases.
+        """
+        self.aliases_path = aliases_path
+        self.names = {}
+        self.by_team = {}
+        self.by_key = {}
+        recency = {}
+        for player_id, first_name, last_name, team, last_season in players:
+            name = f"{first_name or ''} {last_name or ''}".strip()
+            self.names[player_id] = name
+            recency[player_id] = max(recency.get(player_id, -1), last_season or -1)
+            for key in {normalize(name), canonical(normalize(name))}:
+                self.by_key.setdefault(key, set()).add(player_id)
+                if team:
+                    self.by_team.setdefault(team_code(team), {}).setdefault(key, set()).add(player_id)
+        # Ambiguous keys resolve to the player who played most recently
+        self.recency = recency
+        self.team_keys = {team: list(keys) for team, keys in self.by_team.items()}
+        self.all_keys = list(self.by_key)
+        self.aliases = {}
+        if aliases_path and os.path.exists(aliases_path):
+            with open(aliases_path) as f:
+                self.aliases = json.load(f)
+        self.learned = False
+
+    @classmethod
+    def from_database(cls, aliases_path=ALIASES_PATH):
+        """
+        Builds the index from the player, player_team and team tables.
+        """
+        conn = psycopg2.connect(conn_str)
+        with conn.cursor() as cursor:
+            cursor.execute(players_query)
+            players = cursor.fetchall()
+        conn.close()
+        return cls(players, aliases_path)
+
+    @classmethod
+    def from_parquet(cls, directory, aliases_path=ALIASES_PATH):
+        """
+        Builds the index from a Parquet export (db_manager/parquet_dump.py),
+        so no database is needed.
+        """
+        players = pd.read_parquet(os.path.join(directory, 'player.parquet'),
+                                  columns=['player_id', 'first_name', 'last_name'])
+        teams = pd.read_parquet(os.path.join(directory, 'team.parquet'), columns=['team_id', 'abbreviation'])
+        player_teams = pd.read_parquet(os.path.join(directory, 'player_team.parquet')).merge(teams, on='team_id')
+        seasons = [pd.DataFrame({'player_id': pq.read_table(path, columns=['player_id'])['player_id'].to_numpy(),
+                                 'season': int(path.split('season=')[1].split(os.sep)[0])})
+                   for path in glob.glob(os.path.join(directory, 'player_game', 'season=*', '*.parquet'))]
+        last_season = (pd.concat(seasons).groupby('player_id')['season'].max() if seasons
+                       else pd.Series(dtype='int64', name='season'))
+        rows = (players.merge(player_teams[['player_id', 'abbreviation']], on='player_id', how='left')
+                .merge(last_season, left_on='player_id', right_index=True, how='left'))
+        rows = rows.astype(object).where(rows.notna(), None)
+        return cls(list(rows[['player_id', 'first_name', 'last_name', 'abbreviation', 'season']].itertuples(index=False)),
+                   aliases_path)
+
+    def pick(self, player_ids):
+        return max(player_ids, key=lambda player_id: self.recency.get(player_id, -1))
+
+    def lookup(self, key, team):
+        # Exact key within the team, then league-wide
+        for table in (self.by_team.get(team, {}), self.by_key):
+            for candidate in (key, canonical(key)):
+                if candidate in table:
+                    return self.pick(table[candidate])
+        return None
+
+    def fuzzy(self, key, team):
+        # Closest key within the team, then league-wide
+        for keys, table in ((self.team_keys.get(team, []), self.by_team.get(team, {})), (self.all_keys, self.by_key)):
+            match = difflib.get_close_matches(canonical(key), keys, n=1, cutoff=FUZZY_CUTOFF)
+            if match:
+                return self.pick(table[match[0]])
+        return None
+
+    def resolve(self, name, team=None):
+        """
+        Finds the player id for a board name.
+
+        Args:
+            name (str): The name as PrizePicks shows it.
+            team (str): The team abbreviation shown with it, if any.
+
+        Returns:
+            int: The player id, or None if no player is close enough.
+        """
+        team = team_code(team)
+        alias = self.aliases.get(f"{team}|{name}", self.aliases.get(name))
+        if alias is not None:
+            return alias
+        key = normalize(name)
+        player_id = self.lookup(key, team)
+        if player_id is None:
+            player_id = self.fuzzy(key, team)
+            if player_id is not None:
+                self.learn(name, team, player_id)
+        return player_id
+
+    def resolve_board(self, projections):
+        """
+        Adds a player_id column to a board of projections.
+
+        Args:
+            projections (pd.DataFrame): Rows with 'Name' and 'Team' columns.
+
+        Returns:
+            pd.DataFrame: A copy with player_id (nullable Int64) added.
+        """
+        # Each player appears once per prop type, so resolve unique pairs only
+        pairs = projections[['Name', 'Team']].drop_duplicates()
+        resolved = {(name, team): self.resolve(name, team) for name, team in pairs.itertuples(index=False)}
+        result = projections.copy()
+        result['player_id'] = pd.array([resolved[pair] for pair in zip(projections['Name'], projections['Team'])],
+                                       dtype='Int64')
+        return result
+
+    def learn(self, name, team, player_id):
+        """
+        Remembers that a board name (on a team) is this player.
+        """
+        self.aliases[f"{team_code(team)}|{name}"] = player_id
+        self.learned = True
+
+    def save_aliases(self):
+        # Writes the alias file if anything new was learned
+        if not self.learned or not self.aliases_path:
+            return
+        os.makedirs(os.path.dirname(self.aliases_path), exist_ok=True)
+        tmp = f"{self.aliases_path}.tmp"
+        with open(tmp, 'w') as f:
+            json.dump(self.aliases, f, indent=2, sort_keys=True)
+        os.replace(tmp, self.aliases_path)
+        self.learned = False
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Resolve PrizePicks names to player ids")
+    parser.add_argument('--projections', default=os.path.join('..', 'players_projections.csv'), help='A scraped board')
+    parser.add_argument('--aliases', default=ALIASES_PATH, help='The learned alias file')
+    parser.add_argument('--learn', nargs=3, metavar=('NAME', 'TEAM', 'PLAYER_ID'), help='Record an alias by hand')
+    parser.add_argument('--output', help='Write the board with player ids to this CSV')
+    return parser.parse_args()
+
+def main():
+    args = parse_args()
+    start = time.perf_counter()
+    index = NameIndex.from_database(args.aliases)
+    built = time.perf_counter() - start
+
+    if args.learn:
+        name, team, player_id = args.learn
+        index.learn(name, team, int(player_id))
+        index.save_aliases()
+        print(f"Learned {name} ({team}) -> {player_id}.")
+        return
+
+    board = pd.read_csv(args.projections)
+    start = time.perf_counter()
+    resolved = index.resolve_board(board)
+    elapsed = time.perf_counter() - start
+    index.save_aliases()
+
+    missing = resolved[resolved['player_id'].isna()][['Name', 'Team']].drop_duplicates()
+    print(f"Index of {len(index.names)} players built in {built * 1000:.0f} ms.")
+    print(f"Resolved {len(board) - resolved['player_id'].isna().sum()}/{len(board)} projections in {elapsed * 1000:.1f} ms.")
+    for name, team in missing.itertuples(index=False):
+        print(f"Unresolved: {name} ({team})")
+    if args.output:
+        resolved.to_csv(args.output, index=False)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,247 @@
+"""
+Finds the highest expected-value PrizePicks entries on a scored board.
+
+A pick is one side (over/under) of one projection, with the hit probability
+from hit_rates.py. An entry of n picks pays POWER_PAYOUTS[n] times the stake,
+scaled per pick by its Payout type, and is assumed to hit when every pick
+hits, so with q = probability x payout factor its expected value per unit
+staked is POWER_PAYOUTS[n] * product(q) - 1.
+
+Picks are sorted by q, best first, and entries are grown in that order. The
+best any extension of a partial entry can do is to add the next best picks,
+so once that bound cannot beat the K-th best entry found so far the rest of
+the branch is skipped. The first pick of each entry is a separate task for a
+process pool; the pool shares the best K-th value found so far, so every
+worker prunes against the best known threshold.
+
+To run this script, execute the following command from the analysis directory:
+python parlay.py --scored ../hit_rates.csv --window 10 --top 20
+"""
+
+import argparse
+import heapq
+import math
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import pandas as pd
+
+# Power Play multipliers by number of picks
+POWER_PAYOUTS = {2: 3.0, 3: 5.0, 4: 10.0, 5: 20.0, 6: 37.5}
+
+# How each pick's Payout type scales the entry's multiplier. Demons raise the
+# payout and goblins lower it; both are over-only.
+PAYOUT_FACTORS = {'Standard': 1.0, 'Demon': 1.5, 'Goblin': 0.75}
+OVER_ONLY = {'Demon', 'Goblin'}
+
+# Set in every worker by init_worker
+search = None
+
+class ParlaySearch:
+    """
+    Branch-and-bound search for the top-K entries over a set of picks.
+    """
+
+    def __init__(self, q, players, teams, games, top_k=10, min_picks=2, max_picks=6,
+                 max_per_team=None, max_per_game=None, min_teams=2, shared=None):
+        """
+        Args:
+            q (np.ndarray): Probability x payout factor of each pick, sorted descending.
+            players, teams, games (np.ndarray): Small integer codes of each pick's player,
+                team and game.
+            top_k (int): Entries to keep.
+            min_picks, max_picks (int): Entry sizes considered.
+            max_per_team (int): Most picks allowed from one team, None for no limit.
+            max_per_game (int): Most picks allowed from one game, None for no limit.
+            min_teams (int): Fewest distinct teams an entry must have.
+            shared: A (RawValue, Lock) pair holding the best K-th expected value
+                found by any worker.
+        """
+        self.q = q.tolist()
+        self.players = players.tolist()
+        self.teams = teams.tolist()
+        self.games = games.tolist()
+        self.top_k = top_k
+        self.min_picks = max(min_picks, min(POWER_PAYOUTS))
+        self.max_picks = min(max_picks, max(POWER_PAYOUTS))
+        self.max_per_team = max_per_team or self.max_picks
+        self.max_per_game = max_per_game or self.max_picks
+        self.min_teams = min_teams
+        self.shared = shared
+        # tail[i][r]: product of q[i+1 .. i+r], the best r picks after pick i
+        n = len(self.q)
+        self.tail = [[1.0] + [math.prod(self.q[i + 1:i + 1 + r]) if i + r < n else 0.0
+                              for r in range(1, self.max_picks + 1)] for i in range(n)]
+        self.nodes = 0
+
+    def bound(self, i, size, product):
+        # Best expected value of any entry that extends this one with picks after i
+        best = -1.0
+        for total in range(max(size, self.min_picks), self.max_picks + 1):
+            best = max(best, POWER_PAYOUTS[total] * product * self.tail[i][total - size] - 1)
+        return best
+
+    def threshold(self, heap):
+        local = heap[0][0] if len(heap) >= self.top_k else -math.inf
+        if self.shared is None:
+            return local
+        value, lock = self.shared
+        if local > value.value:
+            with lock:
+                if local > value.value:
+                    value.value = local
+        return max(local, value.value)
+
+    def run(self, root):
+        """
+        Searches every entry whose best pick is `root`.
+
+        Returns:
+            list: Up to top_k (expected value, pick indices) pairs.
+        """
+        heap = []
+        if self.bound(root, 1, self.q[root]) <= self.threshold(heap):
+            return heap
+        chosen = [root]
+        player_set = {self.players[root]}
+        team_counts = {self.teams[root]: 1}
+        game_counts = {self.games[root]: 1}
+
+        def extend(last, product):
+            size = len(chosen)
+            for j in range(last + 1, len(self.q)):
+                new_product = product * self.q[j]
+                # q only decreases from here on, so neither can any later bound
+                if self.bound(j, size + 1, new_product) <= self.threshold(heap):
+                    return
+                team, game = self.teams[j], self.games[j]
+                if (self.players[j] in player_set or team_counts.get(team, 0) >= self.max_per_team
+                        or game_counts.get(game, 0) >= self.max_per_game):
+                    continue
+                self.nodes += 1
+                chosen.append(j)
+                player_set.add(self.players[j])
+                team_counts[team] = team_counts.get(team, 0) + 1
+                game_counts[game] = game_counts.get(game, 0) + 1
+
+                if size + 1 >= self.min_picks and len(team_counts) >= self.min_teams:
+                    ev = POWER_PAYOUTS[size + 1] * new_product - 1
+                    if ev > self.threshold(heap):
+                        entry = (ev, tuple(chosen))
+                        if len(heap) < self.top_k:
+                            heapq.heappush(heap, entry)
+                        else:
+                            heapq.heapreplace(heap, entry)
+                if size + 1 < self.max_picks:
+                    extend(j, new_product)
+
+                chosen.pop()
+                player_set.discard(self.players[j])
+                team_counts[team] -= 1
+                if not team_counts[team]:
+                    del team_counts[team]
+                game_counts[game] -= 1
+                if not game_counts[game]:
+                    del game_counts[game]
+
+        extend(root, self.q[root])
+        return heap
+
+def init_worker(q, players, teams, games, options, value, lock):
+    global search
+    search = ParlaySearch(q, players, teams, games, shared=(value, lock), **options)
+
+def run_root(root):
+    # The root's entries and how many search nodes it took
+    before = search.nodes
+    heap = search.run(root)
+    return heap, search.nodes - before
+
+def build_picks(scored, window=10):
+    """
+    Turns a board scored by hit_rates.score_board into picks, one per side of
+    every projection with a probability, sorted by q descending.
+
+    Returns:
+        pd.DataFrame: Name, Type, Prop, Payout, Team, Opponent, side, p and q columns.
+    """
+    sides = []
+    for side in ('over', 'under'):
+        picks = scored.dropna(subset=[f'p_{side}_{window}']).copy()
+        if side == 'under':
+            picks = picks[~picks['Payout'].isin(OVER_ONLY)]
+        picks['side'] = side
+        picks['p'] = picks[f'p_{side}_{window}']
+        sides.append(picks)
+    picks = pd.concat(sides, ignore_index=True)
+    picks['q'] = picks['p'] * picks['Payout'].map(PAYOUT_FACTORS).fillna(1.0)
+    picks = picks[picks['q'] > 0]
+    return picks.sort_values('q', ascending=False, kind='stable').reset_index(drop=True)
+
+def encode(picks):
+    # Integer codes of player, team and game for the search
+    players = pd.factorize(picks['Name'])[0]
+    teams = pd.factorize(picks['Team'])[0]
+    matchups = [tuple(sorted(pair)) for pair in zip(picks['Team'], picks['Opponent'])]
+    games = pd.factorize(pd.Series(matchups, dtype=object))[0]
+    return picks['q'].to_numpy(dtype=np.float64), players, teams, games
+
+def top_entries(picks, top_k=10, workers=None, **options):
+    """
+    The top_k expected-value entries over a set of picks.
+
+    Args:
+        picks (pd.DataFrame): From build_picks (sorted by q, with Name, Team, Opponent).
+        top_k (int): Entries to return.
+        workers (int): Processes to search with; 1 searches in this process.
+        **options: min_picks, max_picks, max_per_team, max_per_game and min_teams,
+            as for ParlaySearch.
+
+    Returns:
+        tuple: ([(expected value, [pick row indices])] best first, search nodes visited).
+    """
+    q, players, teams, games = encode(picks)
+    options = dict(options, top_k=top_k)
+    roots = range(len(q))
+    workers = workers or os.cpu_count()
+    value = multiprocessing.RawValue('d', -math.inf)
+    lock = multiprocessing.Lock()
+    if workers == 1:
+        searcher = ParlaySearch(q, players, teams, games, shared=(value, lock), **options)
+        results = [searcher.run(root) for root in roots]
+        nodes = searcher.nodes
+    else:
+        with ProcessPoolExecutor(workers, initializer=init_worker,
+                                 initargs=(q, players, teams, games, options, value, lock)) as pool:
+            # Later roots are pruned almost at once, so hand them out in chunks
+            outputs = list(pool.map(run_root, roots, chunksize=max(1, len(q) // (workers * 8))))
+        results = [heap for heap, _ in outputs]
+        nodes = sum(count for _, count in outputs)
+    best = heapq.nlargest(top_k, (entry for heap in results for entry in heap))
+    return [(ev, list(indices)) for ev, indices in best], nodes
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Top expected-value PrizePicks entries")
+    parser.add_argument('--scored', default='../hit_rates.csv', help='A board scored by hit_rates.py')
+    parser.add_argument('--window', type=int, default=10, help='Which lookback window to use')
+    parser.add_argument('--top', type=int, default=10, help='Entries to show')
+    parser.add_argument('--min_picks', type=int, default=2, help='Smallest entry')
+    parser.add_argument('--max_picks', type=int, default=6, help='Largest entry')
+    parser.add_argument('--max_per_team', type=int, help='Most picks from one team')
+    parser.add_argument('--max_per_game', type=int, help='Most picks from one game')
+    parser.add_argument('--workers', type=int, help='Search processes (default: all cores)')
+    return parser.parse_args()
+
+def main():
+    args = parse_args()
+    picks = build_picks(pd.read_csv(args.scored), args.window)
+    entries, _ = top_entries(picks, args.top, args.workers, min_picks=args.min_picks, max_picks=args.max_picks,
+                             max_per_team=args.max_per_team, max_per_game=args.max_per_game)
+    for ev, rows in entries:
+        legs = ', '.join(f"{picks.at[row, 'Name']} {picks.at[row, 'side']} {picks.at[row, 'Prop']} "
+                         f"{picks.at[row, 'Type']}" for row in rows)
+        print(f"EV {ev:+.3f} ({len(rows)} picks): {legs}")
+
+if __name__ == '__main__':
+    main()
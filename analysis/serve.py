@@ -0,0 +1,444 @@
+"""
+A local, read-only HTTP/JSON service over the box_scores database, for the
+planned front-end and anything else that would otherwise open its own
+connection and re-run the same aggregates.
+
+GET  /players                          every player with the teams they have played for
+GET  /players/<id>/games?limit=20      a player's latest games played
+GET  /players/<id>/rolling?window=10   a player's row of player_rolling_avg (5, 10, or 0 for the season)
+GET  /seasons/averages                 db_manager/query.sql, per season
+GET  /board                            the --projections board scored by hit_rates.score_board
+POST /board                            the same for a board sent as a JSON list of projections
+GET  /stats                            cache counters
+
+Queries run on a pool of read-only connections. Results are kept as encoded
+JSON in an LRU cache whose entries expire after --ttl seconds, and the whole
+cache is dropped as soon as ingest commits new dates: a thread polls the
+count and latest committed_at of ingest_checkpoint every --poll seconds. Every response
+carries an ETag; a GET whose If-None-Match matches gets a 304 without a body.
+A request with Cache-Control: no-cache bypasses the cache.
+
+To run this script, execute the following command from the analysis directory:
+python serve.py --port 8080 --pool_size 8
+"""
+
+import argparse
+import hashlib
+import os
+import re
+import time
+from collections import Counter, OrderedDict
+from contextlib import contextmanager
+from threading import BoundedSemaphore, Event, Lock, Thread
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+import orjson
+import pandas as pd
+from psycopg2 import pool
+from hit_rates import STATS, WINDOWS, score_board
+from name_index import NameIndex, conn_str, players_query as index_query
+
+QUERY_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'db_manager', 'query.sql')
+PROJECTIONS = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'players_projections.csv')
+
+# Results kept, and seconds each stays valid
+CACHE_SIZE = 1024
+CACHE_TTL = 300
+
+# Seconds between checks for newly ingested dates
+POLL_INTERVAL = 5
+
+# Largest accepted POST body, in bytes
+MAX_BODY = 1 << 20
+
+# Changes whenever a date is committed: a new date raises the count, a
+# re-ingested one its committed_at, which is stamped in commit order
+version_query = """
+SELECT count(*), max(committed_at) FROM ingest_checkpoint;
+"""
+
+player_list_query = """
+SELECT p.player_id, p.first_name, p.last_name, p.position,
+       COALESCE(array_agg(t.abbreviation ORDER BY t.abbreviation) FILTER (WHERE t.team_id IS NOT NULL), '{}') AS teams
+FROM player p
+LEFT JOIN player_team pt ON pt.player_id = p.player_id
+LEFT JOIN team t ON t.team_id = pt.team_id
+GROUP BY p.player_id
+ORDER BY p.player_id;
+"""
+
+games_query = f"""
+SELECT game_id, season, game_date, min, {', '.join(STATS)}
+FROM player_game
+WHERE player_id = %(player)s AND min > 0
+ORDER BY season DESC, game_date DESC
+LIMIT %(limit)s;
+"""
+
+rolling_query = """
+SELECT * FROM player_rolling_avg WHERE player_id = %(player)s AND window_size = %(window)s;
+"""
+
+class NotFound(Exception):
+    pass
+
+class BadRequest(Exception):
+    pass
+
+class ResultCache:
+    """
+    Encoded responses by key, least recently used first out, each valid for
+    ttl seconds and only while the data version it was computed at is current.
+    Concurrent misses on one key wait for a single computation.
+    """
+
+    def __init__(self, size=CACHE_SIZE, ttl=CACHE_TTL):
+        self.size = size
+        self.ttl = ttl
+        self.entries = OrderedDict()
+        self.version = None
+        self.lock = Lock()
+        # Key -> Event set once the request computing it has finished
+        self.pending = {}
+        self.counts = Counter()
+
+    def lookup(self, key):
+        # (body, etag), or None; call with the lock held
+        entry = self.entries.get(key)
+        if entry is not None and entry[2] < time.monotonic():
+            del self.entries[key]
+            self.counts['expired'] += 1
+            entry = None
+        if entry is not None:
+            self.entries.move_to_end(key)
+        return entry and entry[:2]
+
+    def get_or_compute(self, key, compute):
+        """
+        Args:
+            key: Identifies the result.
+            compute (function): Takes the data version, returns (body, etag).
+
+        Returns:
+            tuple: (body, etag, 'HIT' or 'MISS'). Exceptions of compute propagate.
+        """
+        while True:
+            with self.lock:
+                entry = self.lookup(key)
+                if entry is not None:
+                    self.counts['hits'] += 1
+                    return entry + ('HIT',)
+                done = self.pending.get(key)
+                if done is None:
+                    done = self.pending[key] = Event()
+                    version = self.version
+                    self.counts['misses'] += 1
+                    break
+                self.counts['coalesced'] += 1
+            # Another request is computing it; if that failed, try again ourselves
+            done.wait()
+        try:
+            body, etag = compute(version)
+            self.put(key, body, etag, version)
+            return body, etag, 'MISS'
+        finally:
+            with self.lock:
+                del self.pending[key]
+            done.set()
+
+    def put(self, key, body, etag, version):
+        with self.lock:
+            # Computed before the data changed under it
+            if version != self.version:
+                return
+            self.entries[key] = (body, etag, time.monotonic() + self.ttl)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.size:
+                self.entries.popitem(last=False)
+                self.counts['evicted'] += 1
+
+    def set_version(self, version):
+        # Drops everything when ingest has committed since the last check
+        with self.lock:
+            if version != self.version:
+                if self.version is not None:
+                    self.counts['invalidations'] += 1
+                self.entries.clear()
+                self.version = version
+
+    def stats(self):
+        with self.lock:
+            return dict(self.counts, entries=len(self.entries), version=self.version)
+
+class ReadService:
+    """
+    The queries behind the endpoints, on a pool of read-only connections.
+    """
+
+    def __init__(self, pool_size=8, cache_size=CACHE_SIZE, ttl=CACHE_TTL, poll=POLL_INTERVAL, projections=PROJECTIONS):
+        self.pool = pool.ThreadedConnectionPool(1, pool_size, conn_str)
+        # The pool raises when empty; requests beyond pool_size wait here instead
+        self.slots = BoundedSemaphore(pool_size)
+        self.cache = ResultCache(cache_size, ttl)
+        self.poll = poll
+        self.projections = projections
+        with open(QUERY_FILE) as f:
+            self.season_averages_query = f.read()
+        # Rebuilt when the data version changes, since ingest may add players
+        self.index = None
+        self.index_version = None
+        self.index_lock = Lock()
+        self.cache.set_version(self.data_version())
+        self.stop_event = Event()
+        self.poller = Thread(target=self.watch, daemon=True)
+        self.poller.start()
+
+    @contextmanager
+    def connection(self):
+        # A read-only, autocommit connection from the pool, blocking while all are in use
+        with self.slots:
+            conn = self.pool.getconn()
+            try:
+                if not conn.readonly:
+                    conn.set_session(readonly=True, autocommit=True)
+                yield conn
+            except Exception:
+                # A broken connection is closed rather than handed out again
+                self.pool.putconn(conn, close=conn.closed != 0)
+                raise
+            self.pool.putconn(conn)
+
+    def query(self, query, params=None):
+        """
+        Runs one query on a pooled connection.
+
+        Returns:
+            tuple: (column names, rows).
+        """
+        with self.connection() as conn, conn.cursor() as cur:
+            cur.execute(query, params)
+            return [column.name for column in cur.description], cur.fetchall()
+
+    def records(self, query, params=None):
+        names, rows = self.query(query, params)
+        return [dict(zip(names, row)) for row in rows]
+
+    def data_version(self):
+        count, committed = self.query(version_query)[1][0]
+        return f"{count}:{committed.isoformat()}" if committed is not None else None
+
+    def watch(self):
+        while not self.stop_event.wait(self.poll):
+            try:
+                self.cache.set_version(self.data_version())
+            except Exception as e:
+                print(f"Error checking for new data: {e}")
+
+    def close(self):
+        self.stop_event.set()
+        self.poller.join()
+        self.pool.closeall()
+
+    def name_index(self, version):
+        with self.index_lock:
+            if self.index is None or self.index_version != version:
+                _, rows = self.query(index_query)
+                self.index = NameIndex(rows)
+                self.index_version = version
+            return self.index
+
+    def players(self):
+        return self.records(player_list_query)
+
+    def games(self, player_id, limit=20):
+        if not 0 < limit <= 1000:
+            raise BadRequest("limit must be between 1 and 1000")
+        games = self.records(games_query, {'player': player_id, 'limit': limit})
+        if not games and not self.records("SELECT 1 FROM player WHERE player_id = %(player)s", {'player': player_id}):
+            raise NotFound(f"No player {player_id}")
+        return games
+
+    def rolling(self, player_id, window=10):
+        if window not in (5, 10, 0):
+            raise BadRequest("window must be 5, 10 or 0")
+        rows = self.records(rolling_query, {'player': player_id, 'window': window})
+        if not rows:
+            raise NotFound(f"No rolling averages for player {player_id}")
+        return rows[0]
+
+    def season_averages(self):
+        return self.records(self.season_averages_query)
+
+    def score(self, board, version):
+        """
+        Scores a board (Name, Team, Type, Prop, ...) like hit_rates.py does.
+
+        Returns:
+            list: The projections with player_id and p_over_<w>, p_under_<w>, games_<w>.
+        """
+        missing = {'Name', 'Type', 'Prop'} - set(board.columns)
+        if missing:
+            raise BadRequest(f"Projections need {', '.join(sorted(missing))}")
+        props = pd.to_numeric(board['Prop'], errors='coerce')
+        if props.isna().any():
+            raise BadRequest("Every Prop must be a number")
+        # Team only narrows name resolution
+        board = board.assign(Prop=props, Team=board['Team'] if 'Team' in board else None)
+        index = self.name_index(version)
+        # NameIndex learns aliases as it resolves, so one board at a time
+        with self.index_lock:
+            board = index.resolve_board(board)
+        with self.connection() as conn, conn.cursor() as cursor:
+            scored = score_board(board, cursor, WINDOWS)
+        scored = scored.astype(object).where(scored.notna(), None)
+        return scored.to_dict(orient='records')
+
+    def board(self, version):
+        return self.score(pd.read_csv(self.projections), version)
+
+def encode(payload):
+    # orjson turns dates into ISO strings and NaN into null; AVG() returns Decimals
+    body = orjson.dumps(payload, default=float, option=orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS)
+    return body, f'"{hashlib.blake2b(body, digest_size=12).hexdigest()}"'
+
+def integer(query, name, default):
+    # A query-string integer; anything else is the client's mistake
+    value = query.get(name)
+    if value is None:
+        return default
+    try:
+        return int(value)
+    except ValueError:
+        raise BadRequest(f"{name} must be an integer") from None
+
+def board_frame(body):
+    # A POSTed board: a JSON list of projection objects
+    try:
+        projections = orjson.loads(body)
+    except orjson.JSONDecodeError as e:
+        raise BadRequest(f"Invalid JSON: {e}") from None
+    if not isinstance(projections, list) or not all(isinstance(item, dict) for item in projections):
+        raise BadRequest("The board must be a JSON list of projections")
+    return pd.DataFrame(projections)
+
+# (method, path pattern, handler); handlers take the service, the data version,
+# the path groups, the query string and the request body, and return the payload
+ROUTES = [
+    ('GET', r'/players', lambda service, version, groups, query, body: service.players()),
+    ('GET', r'/players/(\d+)/games',
+     lambda service, version, groups, query, body: service.games(int(groups[0]), integer(query, 'limit', 20))),
+    ('GET', r'/players/(\d+)/rolling',
+     lambda service, version, groups, query, body: service.rolling(int(groups[0]), integer(query, 'window', 10))),
+    ('GET', r'/seasons/averages', lambda service, version, groups, query, body: service.season_averages()),
+    ('GET', r'/board', lambda service, version, groups, query, body: service.board(version)),
+    ('POST', r'/board',
+     lambda service, version, groups, query, body: service.score(board_frame(body), version)),
+]
+ROUTES = [(method, re.compile(pattern + '/?'), handler) for method, pattern, handler in ROUTES]
+
+def make_handler(service):
+    class ReadHandler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+        # Headers and body are separate writes; with Nagle a keep-alive client waits out a delayed ACK
+        disable_nagle_algorithm = True
+
+        def respond(self, status, body=b'', etag=None, cache=None):
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            if etag:
+                self.send_header('ETag', etag)
+                self.send_header('Cache-Control', 'max-age=0, must-revalidate')
+            if cache:
+                self.send_header('X-Cache', cache)
+            self.end_headers()
+            if body and self.command != 'HEAD':
+                self.wfile.write(body)
+
+        def dispatch(self, method):
+            url = urlparse(self.path)
+            query = {name: values[-1] for name, values in parse_qs(url.query).items()}
+            length = int(self.headers.get('Content-Length') or 0)
+            if length > MAX_BODY:
+                self.respond(413, orjson.dumps({'error': 'Request body too large'}))
+                return
+            body = self.rfile.read(length) if length else b''
+
+            if method == 'GET' and url.path.rstrip('/') == '/stats':
+                self.respond(200, orjson.dumps(service.cache.stats()))
+                return
+            for route_method, pattern, handler in ROUTES:
+                match = pattern.fullmatch(url.path)
+                if match and route_method == method:
+                    break
+            else:
+                self.respond(404, orjson.dumps({'error': f"No route for {method} {url.path}"}))
+                return
+
+            # A POSTed board is keyed by its content
+            key = (method, url.path.rstrip('/'), tuple(sorted(query.items())),
+                   hashlib.blake2b(body, digest_size=16).digest() if body else None)
+            def compute(version):
+                return encode(handler(service, version, match.groups(), query, body))
+
+            try:
+                if 'no-cache' in self.headers.get('Cache-Control', ''):
+                    body, etag, status = *compute(service.cache.version), 'BYPASS'
+                else:
+                    body, etag, status = service.cache.get_or_compute(key, compute)
+            except BadRequest as e:
+                self.respond(400, orjson.dumps({'error': str(e)}))
+                return
+            except NotFound as e:
+                self.respond(404, orjson.dumps({'error': str(e)}))
+                return
+            except Exception as e:
+                print(f"Error serving {method} {self.path}: {e}")
+                self.respond(500, orjson.dumps({'error': 'Internal error'}))
+                return
+            if method == 'GET' and etag in self.headers.get('If-None-Match', ''):
+                self.respond(304, etag=etag, cache=status)
+            else:
+                self.respond(200, body, etag, status)
+
+        def do_GET(self):
+            self.dispatch('GET')
+
+        def do_HEAD(self):
+            self.dispatch('GET')
+
+        def do_POST(self):
+            self.dispatch('POST')
+
+        def log_message(self, format, *args):
+            pass
+
+    return ReadHandler
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Cached read API over the box_scores database")
+    parser.add_argument('--host', default='127.0.0.1', help='The address to listen on')
+    parser.add_argument('--port', type=int, default=8080, help='The port to listen on')
+    parser.add_argument('--pool_size', type=int, default=8, help='Database connections')
+    parser.add_argument('--cache_size', type=int, default=CACHE_SIZE, help='Results kept in the cache')
+    parser.add_argument('--ttl', type=float, default=CACHE_TTL, help='Seconds a cached result stays valid')
+    parser.add_argument('--poll', type=float, default=POLL_INTERVAL, help='Seconds between checks for new ingest')
+    parser.add_argument('--projections', default=PROJECTIONS, help='The board GET /board scores')
+    return parser.parse_args()
+
+def main():
+    args = parse_args()
+    service = ReadService(args.pool_size, args.cache_size, args.ttl, args.poll, args.projections)
+    server = ThreadingHTTPServer((args.host, args.port), make_handler(service))
+    server.daemon_threads = True
+    print(f"Serving on http://{args.host}:{server.server_address[1]}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        service.close()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,160 @@
+"""
+Compares the HTML parser backends of prizepicks_parse.py on saved board pages:
+projections extracted per second, and peak memory while parsing.
+
+Snapshots are the page sources the scraper saves with --snapshots (one file per
+stat category). Without any, boards are generated from players_projections.csv
+with the same markup as data/board_fixture.html plus the wrapper elements the
+real page puts around each field.
+
+Each backend runs in a fresh process, so its resident memory is its own.
+Python allocations are traced with tracemalloc, but lxml and selectolax
+allocate most of their trees in C, which only the resident figures show. A
+thread samples the resident set size while the backend warms up and runs its
+timed passes; the report has the highest sample, and how far it rose above
+the process's size before the backend parsed anything. ru_maxrss cannot give
+the latter: it never falls, so it keeps whatever peak the process reached
+before (e.g. while receiving the pages). Sampling reads /proc, so Linux only.
+
+To run this script, execute one of the following commands in your terminal:
+python bench_parse.py --snapshots data/board_snapshots
+python bench_parse.py --copies 10 --repeat 5
+"""
+
+import argparse
+import glob
+import html
+import os
+import threading
+import time
+import tracemalloc
+from concurrent.futures import ProcessPoolExecutor
+import pandas as pd
+from prizepicks_parse import PARSERS, parse_board
+
+PROJECTION_TEMPLATE = (
+    '<li id="test-projection-li" class="relative flex flex-col rounded-lg bg-soClean-20 p-3">'
+    '<div class="flex items-start justify-between"><div class="flex flex-col">'
+    '<div class="relative h-16 w-16"><img alt="{name}" src="/players/{index}.webp" class="rounded-full"></div>'
+    '<h3 id="test-player-name" class="text-sm font-bold">{name}</h3>'
+    '<div id="test-team-position" class="text-xs text-soClean-140">{team} - G</div>'
+    '<time class="text-soClean-140 text-xs">vs {opponent} Thu 7:00pm</time></div>{payout}</div>'
+    '<div class="mt-2 flex items-center"><div class="flex flex-1 items-center pr-2">{prop}</div>'
+    '<div class="text-soClean-140 max-w-[100px] self-center text-left text-xs leading-[14px]"> {type} </div></div>'
+    '<div class="mt-2 grid grid-cols-2 gap-2"><button class="rounded bg-soClean-40"><span>Less</span></button>'
+    '<button class="rounded bg-soClean-40"><span>More</span></button></div></li>'
+)
+PAYOUT_TEMPLATE = '<div class="absolute -right-4 left-1/2 top-12"><img alt="{payout}" src="/{payout}.svg"></div>'
+
+def synthetic_pages(projections, copies):
+    """
+    One page per Type, each holding that Type's projections `copies` times over.
+
+    Args:
+        projections (pd.DataFrame): A board such as players_projections.csv.
+        copies (int): How many times to repeat each projection.
+
+    Returns:
+        list: Page sources.
+    """
+    pages = []
+    for proj_type, group in projections.groupby('Type', sort=False):
+        items = []
+        for index, item in enumerate(group.itertuples(index=False)):
+            payout = '' if item.Payout == 'Standard' else PAYOUT_TEMPLATE.format(payout=item.Payout)
+            items.append(PROJECTION_TEMPLATE.format(name=html.escape(item.Name), index=index, team=item.Team,
+                                                    opponent=item.Opponent, payout=payout, prop=item.Prop,
+                                                    type=html.escape(proj_type)))
+        pages.append('<!DOCTYPE html><html><head><title>PrizePicks</title></head><body>'
+                     '<nav><div class="name">NBA</div></nav><div class="stat-container">'
+                     f'<div>{html.escape(proj_type)}</div></div><ul>{"".join(items) * copies}</ul></body></html>')
+    return pages
+
+def load_pages(args):
+    if args.snapshots:
+        pages = []
+        for path in sorted(glob.glob(os.path.join(args.snapshots, '*.html'))):
+            with open(path, encoding='utf-8') as f:
+                pages.append(f.read())
+        return pages
+    return synthetic_pages(pd.read_csv(args.projections), args.copies)
+
+# Seconds between resident set size samples
+SAMPLE_INTERVAL = 0.002
+
+def resident_mb():
+    # The current resident set size, C allocations included
+    with open('/proc/self/statm') as f:
+        return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / 2**20
+
+class ResidentPeak:
+    """
+    Samples the resident set size in a thread until stopped, keeping the highest.
+    """
+
+    def __init__(self):
+        self.peak = resident_mb()
+        self.done = threading.Event()
+        self.thread = threading.Thread(target=self.sample, daemon=True)
+        self.thread.start()
+
+    def sample(self):
+        while not self.done.wait(SAMPLE_INTERVAL):
+            self.peak = max(self.peak, resident_mb())
+
+    def stop(self):
+        self.done.set()
+        self.thread.join()
+        self.peak = max(self.peak, resident_mb())
+        return self.peak
+
+def run_backend(parser, pages, repeat):
+    # Runs in its own process: (projections, seconds per pass, Python peak MB, RSS peak MB, RSS growth MB)
+    baseline = resident_mb()
+    sampler = ResidentPeak()
+    parse_board(pages[0], parser)
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        count = sum(len(parse_board(page, parser)) for page in pages)
+        timings.append(time.perf_counter() - start)
+    rss_peak = sampler.stop()
+
+    tracemalloc.start()
+    for page in pages:
+        parse_board(page, parser)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return count, min(timings), peak / 2**20, rss_peak, rss_peak - baseline
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Benchmark the board HTML parsers")
+    parser.add_argument('--snapshots', help='Directory of saved board pages (*.html)')
+    parser.add_argument('--projections', default='players_projections.csv', help='Board to generate pages from')
+    parser.add_argument('--copies', type=int, default=10, help='Repeats of each projection on a generated page')
+    parser.add_argument('--repeat', type=int, default=5, help='Timed passes over the pages')
+    parser.add_argument('--parsers', nargs='+', default=list(PARSERS), help='Backends to compare')
+    return parser.parse_args()
+
+def main():
+    args = parse_args()
+    pages = load_pages(args)
+    size = sum(len(page) for page in pages) / 2**20
+    print(f"{len(pages)} pages, {size:.1f} MB of HTML")
+
+    expected = None
+    print(f"{'parser':<12} {'projections':>11} {'proj/s':>10} {'py peak MB':>10} {'rss peak MB':>11} {'rss +MB':>8}")
+    for parser in args.parsers:
+        with ProcessPoolExecutor(1) as pool:
+            count, seconds, peak, rss_peak, grown = pool.submit(run_backend, parser, pages, args.repeat).result()
+        print(f"{parser:<12} {count:>11} {count / seconds:>10.0f} {peak:>10.1f} {rss_peak:>11.1f} {grown:>8.1f}")
+
+        # Every backend must return the same board
+        rows = [row for page in pages for row in parse_board(page, parser)]
+        if expected is None:
+            expected = rows
+        elif rows != expected:
+            print(f"  {parser} rows differ from {args.parsers[0]}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,128 @@
+"""
+Shows the query plans and timings of the common reads on the old single-heap
+schema and on the current, season-partitioned and indexed one.
+
+The old layout is rebuilt from the current data in a `legacy` schema (only the
+primary keys, INT/FLOAT columns, no season or game_date on player_game) inside
+a transaction that is rolled back, so the database is left untouched.
+
+To run this script, execute the following command from db_manager:
+python bench_queries.py --repeat 20
+python bench_queries.py --plans
+"""
+
+import argparse
+import os
+import time
+import psycopg2
+from dotenv import load_dotenv
+
+# Load environment variables from .env
+load_dotenv()
+
+# PostgreSQL connection details
+conn_str = (f"dbname=box_scores user={os.getenv('DB_USER')} " +
+            f"password={os.getenv('DB_PASSWORD')} host={os.getenv('DB_HOST')} " +
+            f"port={os.getenv('DB_PORT')}")
+
+QUERY_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'query.sql')
+
+legacy_schema = [
+    "CREATE SCHEMA legacy;",
+    "CREATE TABLE legacy.game AS SELECT game_id, date, season::INT AS season, home_team_score::INT AS home_team_score, "
+    "visitor_team_score::INT AS visitor_team_score, home_team_id, visitor_team_id FROM public.game;",
+    "ALTER TABLE legacy.game ADD PRIMARY KEY (game_id);",
+    "CREATE TABLE legacy.player_game AS SELECT player_id, game_id, min::FLOAT AS min, "
+    "fgm::INT AS fgm, fga::INT AS fga, fg_pct::FLOAT AS fg_pct, fg3m::INT AS fg3m, fg3a::INT AS fg3a, "
+    "fg3_pct::FLOAT AS fg3_pct, ftm::INT AS ftm, fta::INT AS fta, ft_pct::FLOAT AS ft_pct, oreb::INT AS oreb, "
+    "dreb::INT AS dreb, reb::INT AS reb, ast::INT AS ast, stl::INT AS stl, blk::INT AS blk, "
+    "turnover::INT AS turnover, pf::INT AS pf, pts::INT AS pts FROM public.player_game;",
+    "ALTER TABLE legacy.player_game ADD PRIMARY KEY (player_id, game_id);",
+    "CREATE TABLE legacy.team_game AS SELECT * FROM public.team_game;",
+    "ALTER TABLE legacy.team_game ADD PRIMARY KEY (team_id, game_id);",
+    "ANALYZE legacy.game; ANALYZE legacy.player_game; ANALYZE legacy.team_game;",
+]
+
+# (name, query on the old layout, query on the current layout). Both return the same rows.
+def benchmark_queries():
+    with open(QUERY_FILE) as f:
+        season_averages = f.read()
+    return [
+        ('query.sql', season_averages, season_averages),
+        ('player history',
+         "SELECT g.date, pg.min, pg.pts, pg.reb, pg.ast FROM player_game pg JOIN game g ON g.game_id = pg.game_id "
+         "WHERE pg.player_id = %(player)s ORDER BY g.date DESC LIMIT 10",
+         "SELECT game_date, min, pts, reb, ast FROM player_game "
+         "WHERE player_id = %(player)s ORDER BY season DESC, game_date DESC LIMIT 10"),
+        ('player season',
+         "SELECT AVG(pg.pts), AVG(pg.reb), AVG(pg.ast) FROM player_game pg JOIN game g ON g.game_id = pg.game_id "
+         "WHERE pg.player_id = %(player)s AND g.season = %(season)s",
+         "SELECT AVG(pts), AVG(reb), AVG(ast) FROM player_game WHERE player_id = %(player)s AND season = %(season)s"),
+        ('games by date',
+         "SELECT * FROM game WHERE date = %(date)s",
+         "SELECT * FROM game WHERE date = %(date)s"),
+        ('game box score',
+         "SELECT player_id, pts, reb, ast FROM player_game WHERE game_id = %(game)s",
+         "SELECT player_id, pts, reb, ast FROM player_game WHERE game_id = %(game)s AND season = %(season)s"),
+        ('team games',
+         "SELECT g.game_id, g.date FROM game g JOIN team_game tg ON tg.game_id = g.game_id "
+         "WHERE g.season = %(season)s AND tg.team_id = %(team)s ORDER BY g.date",
+         "SELECT g.game_id, g.date FROM game g JOIN team_game tg ON tg.game_id = g.game_id "
+         "WHERE g.season = %(season)s AND tg.team_id = %(team)s ORDER BY g.date"),
+    ]
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Query plan benchmark, old schema vs current")
+    parser.add_argument('--repeat', type=int, default=20, help='Timed runs of each query')
+    parser.add_argument('--plans', action='store_true', help='Print EXPLAIN ANALYZE output for every query')
+    return parser.parse_args()
+
+def sample_params(cursor):
+    # The player with the most games, their latest season, and a game, date and team from it
+    cursor.execute("SELECT player_id FROM player_game GROUP BY player_id ORDER BY COUNT(*) DESC LIMIT 1;")
+    player = cursor.fetchone()[0]
+    cursor.execute("SELECT pg.game_id, g.date, g.season, g.home_team_id FROM player_game pg "
+                   "JOIN game g ON g.game_id = pg.game_id WHERE pg.player_id = %s ORDER BY g.date DESC LIMIT 1;",
+                   [player])
+    game, date, season, team = cursor.fetchone()
+    return {'player': player, 'game': game, 'date': date, 'season': season, 'team': team}
+
+def time_query(cursor, query, params, repeat):
+    # Median wall time in milliseconds
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        cursor.execute(query, params)
+        cursor.fetchall()
+        timings.append((time.perf_counter() - start) * 1000)
+    return sorted(timings)[len(timings) // 2]
+
+def explain(cursor, query, params):
+    cursor.execute(f"EXPLAIN (ANALYZE, BUFFERS, COSTS OFF) {query}", params)
+    return '\n'.join(row[0] for row in cursor.fetchall())
+
+def main():
+    args = parse_args()
+    conn = psycopg2.connect(conn_str)
+    cursor = conn.cursor()
+    params = sample_params(cursor)
+    for statement in legacy_schema:
+        cursor.execute(statement)
+
+    print(f"{'query':<16} {'old ms':>8} {'new ms':>8} {'speedup':>8}")
+    for name, old_query, new_query in benchmark_queries():
+        timings = []
+        for schema, query in (('legacy', old_query), ('public', new_query)):
+            cursor.execute(f"SET search_path TO {schema};")
+            timings.append(time_query(cursor, query, params, args.repeat))
+            if args.plans:
+                print(f"--- {name} ({'old' if schema == 'legacy' else 'new'}) ---")
+                print(explain(cursor, query, params))
+        print(f"{name:<16} {timings[0]:>8.2f} {timings[1]:>8.2f} {timings[0] / timings[1]:>7.1f}x")
+
+    conn.rollback()
+    cursor.close()
+    conn.close()
+
+if __name__ == '__main__':
+    main()
@@ -1,22 +1,36 @@
+import json
 import os
-import requests
 from dotenv import load_dotenv
-from tenacity import retry, wait_exponential, stop_after_attempt, retry_if_exception_type
+from response_cache import cache
+from metrics import metrics
+from flow import controller, RATE_LIMIT
 
 # Load environment variables from .env file
 load_dotenv()
 
 # API Configuration
 API_KEY = os.getenv("API_KEY")
-API_ENDPOINT = "https://api.balldontlie.io/v1/box_scores"
+API_BASE_URL = os.getenv("API_BASE_URL", "https://api.balldontlie.io/v1")
+API_ENDPOINT = f"{API_BASE_URL}/box_scores"
 
 # Set up the headers with the API key
 headers = {
     'Authorization': API_KEY
 }
 
-@retry(wait=wait_exponential(multiplier=1, min=4, max=10), stop=stop_after_attempt(5), retry=retry_if_exception_type(requests.exceptions.RequestException))
+def fetch(params):
+    # One attempt through the flow controller. A 429, 5xx or connection error
+    # raises flow.RetryLater, so the caller can reschedule the date.
+    return controller.get(API_ENDPOINT, headers, params, 'box_scores')
+
+def make_raw_request(params):
+    # Serves finalized dates from the on-disk cache so reruns use no API quota
+    body = cache.get(API_ENDPOINT, params)
+    metrics.inc('cache_requests_total', endpoint='box_scores', result='hit' if body is not None else 'miss')
+    if body is None:
+        body = fetch(params)
+        cache.put(API_ENDPOINT, params, body)
+    return body
+
 def make_request(params):
-    response = requests.get(API_ENDPOINT, headers=headers, params=params)
-    response.raise_for_status()  # Raise an exception for HTTP errors
-    return response.json()
+    return json.loads(make_raw_request(params))
@@ -0,0 +1,191 @@
+"""
+asyncio fetch engine for box scores.
+
+All requests share one aiohttp session (one connection pool) and go through
+flow.controller, so the API quota holds no matter how many requests are in
+flight, and a 429 slows every fetcher down at once.
+Parsing happens on the event loop between network waits and database
+flushes run in threads, so neither holds up the next request.
+Dates come from the same flow.RetryQueue as in thread mode: a date whose
+request or insert failed is rescheduled there with backoff and jitter, and
+only counts as done once its batch is committed.
+"""
+
+import asyncio
+import json
+import aiohttp
+from tqdm import tqdm
+from api import API_ENDPOINT, RATE_LIMIT, headers
+from flow import controller, RetryQueue, RetryLater, RETRY_STATUSES, retry_after
+from database import BulkLoader
+from process import parse_box_scores, add_to_loader, reschedule, FLUSH_AFTER
+import columnar
+import get_dates
+from response_cache import cache
+from metrics import metrics
+
+async def fetch_date(session, date):
+    # One /box_scores request through the shared flow controller. Cache hits
+    # skip the controller since they use no API quota.
+    params = {"date": date}
+    body = cache.get(API_ENDPOINT, params)
+    metrics.inc('cache_requests_total', endpoint='box_scores', result='hit' if body is not None else 'miss')
+    if body is not None:
+        return body
+    await controller.acquire_async()
+    status, response_headers = None, {}
+    try:
+        with metrics.timer('http_request_seconds', endpoint='box_scores'):
+            async with session.get(API_ENDPOINT, params=params) as response:
+                status, response_headers = response.status, response.headers
+                metrics.inc('http_responses_total', endpoint='box_scores', status=status)
+                if status in RETRY_STATUSES:
+                    raise RetryLater(f"box_scores: HTTP {status}", retry_after(response_headers))
+                response.raise_for_status()
+                body = await response.read()
+    except (aiohttp.ClientConnectionError, asyncio.TimeoutError) as e:
+        raise RetryLater(f"box_scores: {e}") from e
+    finally:
+        controller.release(status, response_headers)
+    metrics.inc('http_bytes_total', len(body), endpoint='box_scores')
+    cache.put(API_ENDPOINT, params, body)
+    return body
+
+async def feed(dates, queue, progress_bar):
+    # Drains the (possibly blocking) date iterator in a thread, handing each
+    # date to the fetchers as soon as it is discovered
+    loop = asyncio.get_running_loop()
+
+    def count():
+        progress_bar.total += 1
+        progress_bar.refresh()
+
+    def produce():
+        for date in dates:
+            queue.put(date)
+            loop.call_soon_threadsafe(count)
+
+    try:
+        await asyncio.to_thread(produce)
+    finally:
+        queue.close()
+
+def decode(body, decoder):
+    with metrics.timer('decode_seconds', decoder=decoder):
+        if decoder == 'columnar':
+            return columnar.decode(body)
+        return parse_box_scores(json.loads(body))
+
+async def fetcher(session, queue, results, decoder):
+    while True:
+        with metrics.timer('queue_wait_seconds', queue='dates'):
+            date = await queue.get_async()
+        if date is None:
+            return
+        try:
+            body = await fetch_date(session, date)
+            # Decoding looks up game ids; a date discovery has not fully listed
+            # is asked of /games in a thread so the lookup never blocks the loop
+            if date not in get_dates.complete_dates:
+                await asyncio.to_thread(get_dates.fetch_games_on, date)
+            records = decode(body, decoder)
+        except RetryLater as e:
+            reschedule(queue, date, e.delay)
+            queue.task_done([date])
+            continue
+        except Exception as e:
+            tqdm.write(f"Error processing date {date}: {e}")
+            reschedule(queue, date)
+            queue.task_done([date])
+            continue
+        await results.put((date, records))
+
+async def writer(queue, results, progress_bar, batch_size, method, decoder):
+    # Each writer owns a loader, so every flush gets its own pooled connection
+    loader = BulkLoader(batch_size, method)
+    pending = []
+
+    def finish(failed):
+        # Settles the dates of the batch that was just flushed
+        failed = set(failed)
+        for date in pending:
+            if date in failed:
+                reschedule(queue, date)
+            else:
+                progress_bar.update(1)
+                metrics.inc('dates_processed_total')
+        queue.task_done(pending)
+        pending.clear()
+
+    async def flush():
+        # A flush that raises fails its whole batch, like a rolled-back insert,
+        # so its dates are rescheduled rather than left unsettled
+        dates = list(loader.dates)
+        try:
+            return await asyncio.to_thread(loader.flush)
+        except Exception as e:
+            tqdm.write(f"Error flushing dates {dates}: {e}")
+            loader.reset()
+            return dates
+
+    while True:
+        try:
+            with metrics.timer('queue_wait_seconds', queue='results'):
+                item = await asyncio.wait_for(results.get(), FLUSH_AFTER if pending else None)
+        except asyncio.TimeoutError:
+            # Nothing arrived for a while: commit the partial batch
+            finish(await flush())
+            continue
+        if item is None:
+            return
+        date, records = item
+        # Dates without games are still added so that they get checkpointed
+        pending.append(date)
+        try:
+            failed = await asyncio.to_thread(add_to_loader, loader, date, records, decoder)
+        except Exception as e:
+            tqdm.write(f"Error in writer: {e}")
+            pending.remove(date)
+            reschedule(queue, date)
+            queue.task_done([date])
+            continue
+        # The add flushed the batch
+        if not loader.dates:
+            finish(failed)
+
+async def run(dates, concurrency=8, writers=2, batch_size=1, method='copy', rate_limit=RATE_LIMIT, decoder='tuples'):
+    """
+    Fetches, parses and loads every date. Dates given up on after their last
+    attempt end up in process.error_dates.
+
+    Args:
+        dates (iterable): The dates to ingest, e.g. the get_dates.iter_dates generator.
+        concurrency (int): The maximum number of requests in flight.
+        writers (int): The number of concurrent database writers.
+        batch_size (int): Dates per database flush.
+        method (str): 'copy' or 'executemany', see database.BulkLoader.
+        rate_limit (int): Requests per minute across the whole engine; concurrency
+            is the most the flow controller's window grows to.
+        decoder (str): 'tuples' (process.parse_box_scores) or 'columnar'.
+    """
+    controller.configure(rate_limit, concurrency)
+    queue = RetryQueue()
+    # Bounded so fetching cannot run far ahead of a slow database
+    results = asyncio.Queue(maxsize=writers * batch_size * 2)
+
+    connector = aiohttp.TCPConnector(limit=concurrency)
+    # requests drops headers set to None, aiohttp does not
+    session_headers = {key: value for key, value in headers.items() if value is not None}
+    async with aiohttp.ClientSession(headers=session_headers, connector=connector) as session:
+        with tqdm(total=0) as pbar:
+            fetchers = [asyncio.create_task(fetcher(session, queue, results, decoder)) for _ in range(concurrency)]
+            writer_tasks = [asyncio.create_task(writer(queue, results, pbar, batch_size, method, decoder))
+                            for _ in range(writers)]
+
+            await feed(dates, queue, pbar)
+            # The fetchers return once every date is committed or given up on,
+            # which needs the writers, so they are only stopped afterwards
+            await asyncio.gather(*fetchers)
+            for _ in writer_tasks:
+                await results.put(None)
+            await asyncio.gather(*writer_tasks)
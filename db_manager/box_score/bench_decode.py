@@ -0,0 +1,65 @@
+"""
+Compares the per-row tuple path (json + process.parse_box_scores) with the
+columnar decoder (columnar.decode) on the bundled response_2024-02-07.json,
+including the COPY text encoding each one feeds to database.BulkLoader.
+
+No database or network is needed. To run this script, execute the following
+command from db_manager/box_score:
+python bench_decode.py --repeat 200
+"""
+
+import argparse
+import json
+import os
+import time
+import columnar
+import get_dates
+from database import table_columns, records_to_copy
+from process import parse_box_scores
+
+FIXTURE = os.path.join(os.path.dirname(__file__), '..', '..', 'response_2024-02-07.json')
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Box score decoder benchmark")
+    parser.add_argument('--repeat', type=int, default=200, help='How many times to decode the fixture')
+    parser.add_argument('--fixture', default=FIXTURE, help='A saved /box_scores response')
+    return parser.parse_args()
+
+def tuple_path(body):
+    records = parse_box_scores(json.loads(body))
+    return [records_to_copy(table_records) for table_records in records]
+
+def columnar_path(body):
+    columns = columnar.decode(body)
+    return [columnar.copy_text(columns[table], names) for table, names in table_columns.items()]
+
+def time_path(path, body, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        path(body)
+    return time.perf_counter() - start
+
+def main():
+    args = parse_args()
+    with open(args.fixture, 'rb') as f:
+        body = f.read()
+
+    # Give the fixture's games ids so no lookup goes to the API
+    for i, game in enumerate(json.loads(body)['data']):
+        get_dates.game_ids[(game['date'], game['home_team']['id'])] = i + 1
+
+    # Both paths must produce the same rows before their speed means anything
+    records = parse_box_scores(json.loads(body))
+    columns = columnar.decode(body)
+    same = all(columnar.to_records(columns[table], names) == table_records
+               for (table, names), table_records in zip(table_columns.items(), records))
+    rows = sum(len(table_records) for table_records in records)
+    print(f"Rows per payload: {rows}, paths agree: {same}")
+
+    print(f"{'path':<10} {'ms/payload':>10} {'rows/sec':>10}")
+    for name, path in (('tuples', tuple_path), ('columnar', columnar_path)):
+        elapsed = time_path(path, body, args.repeat)
+        print(f"{name:<10} {elapsed / args.repeat * 1000:>10.2f} {rows * args.repeat / elapsed:>10.0f}")
+
+if __name__ == '__main__':
+    main()
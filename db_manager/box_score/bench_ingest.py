@@ -0,0 +1,225 @@
+"""
+Measures ingest throughput offline: fetch, parse and insert separately, then
+the whole pipeline, across worker counts and batch sizes.
+
+The bundled response_2024-02-07.json is served for every date of --seasons
+synthetic seasons (--days dates each) by mock_api.py, started in-process, so no
+API quota is spent. The fetch stage times api.make_raw_request with the
+response cache off; the parse stage times both decoders on the fetched bodies;
+the insert stage feeds the decoded dates through database.BulkLoader
+(copy_insert / batch_insert); the pipeline stage runs process.worker threads
+end to end. Every insert runs with database.dry_run set, so it goes through the
+real transactions and is rolled back: the database is left unchanged, apart from
+empty player_game partitions for the synthetic seasons. The team table must
+already be populated (team_scrape.py) because of the foreign keys.
+
+Results are printed and written as JSON; pass an earlier file as --baseline to
+see the change of every figure against it. To run this script, execute the
+following command from db_manager/box_score:
+python bench_ingest.py --workers 1 4 --batch_sizes 1 10 --output bench_ingest.json
+python bench_ingest.py --latency 0.05 --baseline bench_ingest.json
+"""
+
+import argparse
+import datetime
+import json
+import subprocess
+import time
+from concurrent.futures import ThreadPoolExecutor
+from threading import Thread
+import api
+import columnar
+import database
+import flow
+import get_dates
+import mock_api
+import process
+from response_cache import cache
+
+# The settings that identify a result, for matching it against a baseline
+SETTINGS = ('method', 'decoder', 'batch_size', 'workers')
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Offline ingest throughput benchmark")
+    parser.add_argument('--seasons', type=int, nargs='+', default=[1900, 1901], help='Synthetic seasons to replay')
+    parser.add_argument('--days', type=int, default=20, help='Game dates per season')
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 4], help='Worker counts to try')
+    parser.add_argument('--batch_sizes', type=int, nargs='+', default=[1, 10], help='Dates per insert transaction')
+    parser.add_argument('--methods', nargs='+', choices=['copy', 'executemany'], default=['copy', 'executemany'], help='Insert paths')
+    parser.add_argument('--decoder', choices=['tuples', 'columnar'], default='columnar', help='Decoder for the insert and pipeline stages')
+    parser.add_argument('--latency', type=float, default=0.0, help='Seconds the mock API waits before answering')
+    parser.add_argument('--fixture', default=mock_api.FIXTURE, help='A saved /box_scores response')
+    parser.add_argument('--output', help='Write the results to this JSON file')
+    parser.add_argument('--baseline', help='Results of an earlier run to compare against')
+    return parser.parse_args()
+
+def start_mock(fixture, latency, days):
+    # Serves the mock API on a free port and points api.py at it
+    server = mock_api.serve(0, fixture, latency, days)
+    Thread(target=server.serve_forever, daemon=True).start()
+    api.API_ENDPOINT = f"http://127.0.0.1:{server.server_address[1]}/v1/box_scores"
+    return server
+
+def synthetic_dates(fixture, seasons, days):
+    # The mock's game dates, with their game ids known as if /games had been paged
+    with open(fixture) as f:
+        payload = json.load(f)
+    dates = []
+    for season in seasons:
+        games = mock_api.season_games(payload, season, days)
+        get_dates.remember_games(games, complete=True)
+        dates.extend(sorted({game['date'] for game in games}))
+    return dates
+
+def rate(count, seconds):
+    return count / seconds if seconds else 0.0
+
+def fetch_stage(dates, workers):
+    # Raw bodies of every date, fetched by `workers` threads
+    start = time.perf_counter()
+    with ThreadPoolExecutor(workers) as pool:
+        bodies = list(pool.map(lambda date: api.make_raw_request({'date': date}), dates))
+    seconds = time.perf_counter() - start
+    size = sum(len(body) for body in bodies)
+    return bodies, {'workers': workers, 'seconds': seconds, 'requests_per_sec': rate(len(dates), seconds),
+                    'mb_per_sec': rate(size / 2**20, seconds)}
+
+def decode(body, decoder):
+    if decoder == 'columnar':
+        return columnar.decode(body)
+    return process.parse_box_scores(json.loads(body))
+
+def row_count(records, decoder):
+    if decoder == 'columnar':
+        return sum(len(next(iter(columns.values()))) for columns in records.values())
+    return sum(len(table_records) for table_records in records)
+
+def parse_stage(bodies, decoder):
+    start = time.perf_counter()
+    decoded = [decode(body, decoder) for body in bodies]
+    seconds = time.perf_counter() - start
+    rows = sum(row_count(records, decoder) for records in decoded)
+    return decoded, {'decoder': decoder, 'seconds': seconds, 'rows': rows, 'rows_per_sec': rate(rows, seconds)}
+
+def insert_stage(dates, decoded, decoder, workers, batch_size, method):
+    # Each thread loads every `workers`-th date through its own BulkLoader
+    failed = []
+
+    def load(shard):
+        loader = database.BulkLoader(batch_size, method)
+        for i in range(shard, len(dates), workers):
+            failed.extend(process.add_to_loader(loader, dates[i], decoded[i], decoder))
+        failed.extend(loader.flush())
+
+    start = time.perf_counter()
+    threads = [Thread(target=load, args=(shard,)) for shard in range(workers)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    seconds = time.perf_counter() - start
+    rows = sum(row_count(records, decoder) for records in decoded)
+    return {'method': method, 'workers': workers, 'batch_size': batch_size, 'seconds': seconds,
+            'rows_per_sec': rate(rows, seconds), 'failed_dates': len(failed)}
+
+def pipeline_stage(dates, decoder, workers, batch_size, method):
+    # process.worker threads end to end; the rate limit is lifted so the pacing is ~0
+    process.error_dates.clear()
+    flow.controller.configure(10 ** 9, workers)
+    queue = flow.RetryQueue()
+    for date in dates:
+        queue.put(date)
+    queue.close()
+
+    class Progress:
+        def update(self, n):
+            pass
+
+    start = time.perf_counter()
+    threads = [Thread(target=process.worker, args=(queue, Progress(), batch_size, method, decoder))
+               for _ in range(workers)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    seconds = time.perf_counter() - start
+    return {'method': method, 'workers': workers, 'batch_size': batch_size, 'seconds': seconds,
+            'dates_per_sec': rate(len(dates), seconds), 'failed_dates': len(process.error_dates)}
+
+def git_version():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def setting_key(entry):
+    return ' '.join(f"{name}={entry[name]}" for name in SETTINGS if name in entry)
+
+def compare(results, baseline):
+    """
+    Prints each throughput figure next to the same figure in a baseline run.
+    Entries are matched on their SETTINGS.
+    """
+    for stage, entries in results['stages'].items():
+        old_entries = {setting_key(entry): entry for entry in baseline['stages'].get(stage, [])}
+        for entry in entries:
+            old = old_entries.get(setting_key(entry))
+            if old is None:
+                continue
+            for name, value in entry.items():
+                if name.endswith('_per_sec') and old.get(name):
+                    print(f"{stage:<9} {setting_key(entry):<36} {name:<16} {old[name]:>10.1f} -> {value:>10.1f} "
+                          f"({value / old[name] - 1:+.1%})")
+
+def main():
+    args = parse_args()
+    cache.enabled = False
+    flow.controller.configure(10 ** 9, max(args.workers))
+    database.dry_run = True
+    database.init_pool(max(args.workers))
+    start_mock(args.fixture, args.latency, args.days)
+    dates = synthetic_dates(args.fixture, args.seasons, args.days)
+    print(f"{len(dates)} dates over seasons {', '.join(map(str, args.seasons))}")
+
+    stages = {'fetch': [], 'parse': [], 'insert': [], 'pipeline': []}
+    for workers in args.workers:
+        bodies, result = fetch_stage(dates, workers)
+        stages['fetch'].append(result)
+        print(f"fetch     workers={workers:<3} {result['requests_per_sec']:>9.1f} req/s {result['mb_per_sec']:>8.1f} MB/s")
+
+    for decoder in ('tuples', 'columnar'):
+        decoded, result = parse_stage(bodies, decoder)
+        stages['parse'].append(result)
+        print(f"parse     {decoder:<11} {result['rows_per_sec']:>9.0f} rows/s")
+    decoded, _ = parse_stage(bodies, args.decoder)
+
+    for method in args.methods:
+        for batch_size in args.batch_sizes:
+            for workers in args.workers:
+                result = insert_stage(dates, decoded, args.decoder, workers, batch_size, method)
+                stages['insert'].append(result)
+                print(f"insert    {method:<11} batch={batch_size:<3} workers={workers:<3} "
+                      f"{result['rows_per_sec']:>9.0f} rows/s")
+                result = pipeline_stage(dates, args.decoder, workers, batch_size, method)
+                stages['pipeline'].append(result)
+                print(f"pipeline  {method:<11} batch={batch_size:<3} workers={workers:<3} "
+                      f"{result['dates_per_sec']:>9.1f} dates/s")
+
+    results = {
+        'version': git_version(),
+        'run_at': datetime.datetime.now().isoformat(timespec='seconds'),
+        'settings': {'seasons': args.seasons, 'days': args.days, 'dates': len(dates), 'latency': args.latency,
+                     'decoder': args.decoder},
+        'stages': stages,
+    }
+    if args.baseline:
+        with open(args.baseline) as f:
+            compare(results, json.load(f))
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+    database.close_connection()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,77 @@
+"""
+Compares insert throughput of the executemany path against the COPY + staging
+merge path, using the bundled response_2024-02-07.json box scores replayed as
+many synthetic dates.
+
+Every run happens inside a transaction that is rolled back, so the benchmark
+leaves the database untouched. The team table must already be populated
+(team_scrape.py) because of the foreign keys.
+
+To run this script, execute the following command from db_manager/box_score:
+python bench_insert.py --days 30 --batch_sizes 1 10 30
+"""
+
+import argparse
+import copy
+import datetime
+import json
+import os
+import time
+import process
+import get_dates
+from database import get_connection, table_columns, copy_insert_records, executemany_records
+
+FIXTURE = os.path.join(os.path.dirname(__file__), '..', '..', 'response_2024-02-07.json')
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Box score insert benchmark")
+    parser.add_argument('--days', type=int, default=30, help='The number of synthetic dates to insert')
+    parser.add_argument('--batch_sizes', type=int, nargs='+', default=[1, 10, 30], help='Dates flushed per transaction')
+    parser.add_argument('--fixture', default=FIXTURE, help='A saved /box_scores response')
+    return parser.parse_args()
+
+def build_days(fixture, days):
+    # Replays the fixture through parse_box_scores as one synthetic date per
+    # day, with made-up game ids that stay clear of real ones
+    with open(fixture) as f:
+        payload = json.load(f)
+    start = datetime.date(1900, 1, 1)
+    records = []
+    for day in range(days):
+        date = (start + datetime.timedelta(days=day)).isoformat()
+        day_payload = copy.deepcopy(payload)
+        for i, game in enumerate(day_payload['data']):
+            game['date'] = date
+            get_dates.game_ids[(date, game['home_team']['id'])] = 10 ** 9 + day * 100 + i
+        records.append(process.parse_box_scores(day_payload))
+    return records
+
+def run(method, days, batch_size):
+    insert = copy_insert_records if method == 'copy' else executemany_records
+    with get_connection() as conn:
+        cur = conn.cursor()
+        rows = 0
+        start = time.perf_counter()
+        for i in range(0, len(days), batch_size):
+            records_by_table = {table: [] for table in table_columns}
+            for day in days[i:i + batch_size]:
+                for table, records in zip(table_columns, day):
+                    records_by_table[table].extend(records)
+            rows += sum(len(records) for records in records_by_table.values())
+            insert(cur, records_by_table)
+        elapsed = time.perf_counter() - start
+        conn.rollback()
+        cur.close()
+    return rows, elapsed
+
+def main():
+    args = parse_args()
+    days = build_days(args.fixture, args.days)
+    print(f"{'method':<12} {'batch':>5} {'rows':>8} {'seconds':>8} {'rows/sec':>10}")
+    for batch_size in args.batch_sizes:
+        for method in ('executemany', 'copy'):
+            rows, elapsed = run(method, days, batch_size)
+            print(f"{method:<12} {batch_size:>5} {rows:>8} {elapsed:>8.2f} {rows / elapsed:>10.0f}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,138 @@
+"""
+Columnar decoding of /box_scores payloads.
+
+Instead of building a 21-field tuple per player, decode() pulls each field of
+every player in the payload into one NumPy array, so null handling and the
+minutes conversion run once per column. copy_text() then encodes those
+columns straight into COPY text for database.BulkLoader.
+"""
+
+from operator import itemgetter
+import numpy as np
+from get_dates import lookup_game_id
+
+try:
+    import orjson as json_parser
+except ImportError:
+    import json as json_parser
+
+# Counting stats are stored as integers, everything else numeric as floats
+INT_STATS = ('fgm', 'fga', 'fg3m', 'fg3a', 'ftm', 'fta', 'oreb', 'dreb', 'reb', 'ast', 'stl', 'blk', 'turnover', 'pf', 'pts')
+FLOAT_STATS = ('fg_pct', 'fg3_pct', 'ft_pct')
+PLAYER_TEXT = ('first_name', 'last_name', 'position', 'height', 'weight', 'jersey_number', 'college', 'country')
+PLAYER_DRAFT = ('draft_year', 'draft_round', 'draft_number')
+
+# Characters COPY's text format needs escaped
+SPECIAL = ('\\', '\t', '\n', '\r')
+
+def numeric_column(values, dtype):
+    # None becomes NaN on the float conversion, then 0 like none_to_zero
+    column = np.array(values, dtype=np.float64)
+    np.nan_to_num(column, copy=False, nan=0.0)
+    return column.astype(dtype, copy=False)
+
+def numeric_block(rows, names, dtype):
+    # Several fields converted in one go: rows is one tuple per entry, with
+    # the fields in `names` order. Returns name -> column.
+    block = numeric_column(rows, dtype).reshape(len(rows), len(names))
+    return {name: block[:, i] for i, name in enumerate(names)}
+
+def minutes_column(values):
+    # 'mm', 'mm:ss', '' or None, converted for the whole column at once
+    if not values:
+        return np.zeros(0)
+    text = np.array([value or '0' for value in values], dtype=str)
+    parts = np.char.partition(text, ':')
+    minutes = parts[:, 0].astype(np.float64)
+    seconds = np.where(parts[:, 2] == '', '0', parts[:, 2]).astype(np.float64)
+    return minutes + seconds / 60
+
+def decode(body):
+    """
+    Decodes a raw /box_scores response into typed columns.
+
+    Args:
+        body (bytes): The response body.
+
+    Returns:
+        dict: table name -> {column name -> np.ndarray}, with the same tables
+        and columns as database.table_columns.
+    """
+    games = json_parser.loads(body)['data']
+
+    game_ids = np.array([lookup_game_id(game['date'], game['home_team']['id']) for game in games], dtype=np.int64)
+    home_ids = np.array([game['home_team']['id'] for game in games], dtype=np.int64)
+    visitor_ids = np.array([game['visitor_team']['id'] for game in games], dtype=np.int64)
+    dates = np.array([game['date'] for game in games], dtype=object)
+    seasons = np.array([game['season'] for game in games], dtype=np.int64)
+
+    # Players in payload order: home then visitors, game by game
+    rosters = [game[team]['players'] for game in games for team in ('home_team', 'visitor_team')]
+    players = [player for roster in rosters for player in roster]
+    info = [player['player'] for player in players]
+    roster_sizes = np.array([len(roster) for roster in rosters], dtype=np.int64)
+    roster_games = np.repeat(game_ids, 2)
+    roster_teams = np.column_stack((home_ids, visitor_ids)).ravel()
+
+    player_ids = np.array([entry['id'] for entry in info], dtype=np.int64)
+    player_games = np.repeat(roster_games, roster_sizes)
+
+    player = {'player_id': player_ids}
+    text = np.array(list(map(itemgetter(*PLAYER_TEXT), info)), dtype=object).reshape(len(info), len(PLAYER_TEXT))
+    for i, column in enumerate(PLAYER_TEXT):
+        player[column] = text[:, i]
+    player.update(numeric_block(list(map(itemgetter(*PLAYER_DRAFT), info)), PLAYER_DRAFT, np.int64))
+
+    player_game = {'player_id': player_ids, 'game_id': player_games,
+                   'min': minutes_column([entry['min'] for entry in players])}
+    player_game.update(numeric_block(list(map(itemgetter(*INT_STATS), players)), INT_STATS, np.int64))
+    player_game.update(numeric_block(list(map(itemgetter(*FLOAT_STATS), players)), FLOAT_STATS, np.float64))
+    # Copied from the game so player_game can be partitioned and read by season and date
+    player_game['season'] = np.repeat(np.repeat(seasons, 2), roster_sizes)
+    player_game['game_date'] = np.repeat(np.repeat(dates, 2), roster_sizes)
+
+    return {
+        'player': player,
+        'game': {
+            'game_id': game_ids,
+            'date': dates,
+            'season': seasons,
+            'home_team_score': numeric_column([game['home_team_score'] for game in games], np.int64),
+            'visitor_team_score': numeric_column([game['visitor_team_score'] for game in games], np.int64),
+            'home_team_id': home_ids,
+            'visitor_team_id': visitor_ids,
+        },
+        'player_game': player_game,
+        'player_team': {'player_id': player_ids, 'team_id': np.repeat(roster_teams, roster_sizes)},
+        'team_game': {'team_id': roster_teams, 'game_id': roster_games},
+    }
+
+def escape_text(value):
+    return (value.replace('\\', '\\\\').replace('\t', '\\t')
+            .replace('\n', '\\n').replace('\r', '\\r'))
+
+def text_column(column):
+    # Formats a whole column for COPY's text format: NULL marker for None and
+    # backslash escapes for text, same as database.copy_value
+    if column.dtype != object:
+        return column.astype(str).tolist()
+    # Escaping is rarely needed, so check the whole column once first
+    joined = ''.join(str(value) for value in column if value is not None)
+    if any(char in joined for char in SPECIAL):
+        return ['\\N' if value is None else escape_text(str(value)) for value in column]
+    return ['\\N' if value is None else str(value) for value in column]
+
+def copy_text(columns, names):
+    """
+    Encodes one table's columns as COPY text, in the given column order.
+    """
+    if not len(columns[names[0]]):
+        return ''
+    rows = zip(*(text_column(columns[name]) for name in names))
+    return '\n'.join(map('\t'.join, rows)) + '\n'
+
+def to_records(columns, names):
+    """
+    Converts one table's columns back to row tuples, for the executemany path.
+    """
+    return list(zip(*(columns[name].tolist() for name in names)))
@@ -1,7 +1,19 @@
+import io
 import os
+import re
+from collections import Counter
+from contextlib import contextmanager
+from threading import BoundedSemaphore, Lock
 import psycopg2
+from psycopg2 import pool
+from psycopg2.extras import execute_values
 from dotenv import load_dotenv
 from sqlalchemy import create_engine
+from response_cache import is_final_date
+import columnar
+import rolling
+from dimensions import dimensions
+from metrics import metrics
 
 # Load environment variables from .env file
 load_dotenv()
@@ -11,19 +23,79 @@ conn_str = (f"dbname=box_scores user={os.getenv('DB_USER')} " +
             f"password={os.getenv('DB_PASS')} host={os.getenv('DB_HOST')} " +
             f"port={os.getenv('DB_PORT')}")
 
-# Connect to PostgreSQL server
-conn = psycopg2.connect(conn_str)
-cursor = conn.cursor()
+# Connection pool shared by the worker threads, created by init_pool
+connection_pool = None
+pool_slots = None
+pool_lock = Lock()
+
+# When set, copy_insert and batch_insert roll back instead of committing, so a
+# run goes through every step of the load but leaves the database unchanged
+dry_run = False
 
 # Create an engine instance
 engine = create_engine(f'postgresql+psycopg2://{os.getenv("DB_USER")}:{os.getenv("DB_PASS")}@{os.getenv("DB_HOST")}:{os.getenv("DB_PORT")}/nba_stats')
 
+def init_pool(pool_size=4):
+    """
+    Creates the process-wide connection pool. Calling it again is a no-op.
+
+    Args:
+        pool_size (int): The maximum number of open connections.
+    """
+    global connection_pool, pool_slots
+    with pool_lock:
+        if connection_pool is None:
+            connection_pool = pool.ThreadedConnectionPool(1, pool_size, conn_str)
+            pool_slots = BoundedSemaphore(pool_size)
+    return connection_pool
+
+def is_healthy(conn):
+    # Cheap liveness probe run on every checkout
+    if conn.closed:
+        return False
+    try:
+        with conn.cursor() as cur:
+            cur.execute("SELECT 1;")
+        conn.rollback()
+        return True
+    except psycopg2.Error:
+        return False
+
+@contextmanager
+def get_connection():
+    """
+    Checks a healthy connection out of the pool, blocking while all of them
+    are in use. Broken connections are discarded and replaced.
+    """
+    if connection_pool is None:
+        init_pool()
+    with pool_slots:
+        conn = connection_pool.getconn()
+        while not is_healthy(conn):
+            connection_pool.putconn(conn, close=True)
+            conn = connection_pool.getconn()
+        try:
+            yield conn
+        finally:
+            connection_pool.putconn(conn, close=bool(conn.closed))
+
 # Insert queries
+# Players are updated when their details change (see dimensions.py)
 player_insert_query = """
 INSERT INTO player (
     player_id, first_name, last_name, position, height, weight, jersey_number, college, country, draft_year, draft_round, draft_number
 ) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
-ON CONFLICT (player_id) DO NOTHING;
+ON CONFLICT (player_id) DO UPDATE SET
+    first_name = EXCLUDED.first_name, last_name = EXCLUDED.last_name, position = EXCLUDED.position,
+    height = EXCLUDED.height, weight = EXCLUDED.weight, jersey_number = EXCLUDED.jersey_number,
+    college = EXCLUDED.college, country = EXCLUDED.country, draft_year = EXCLUDED.draft_year,
+    draft_round = EXCLUDED.draft_round, draft_number = EXCLUDED.draft_number
+WHERE (player.first_name, player.last_name, player.position, player.height, player.weight, player.jersey_number,
+       player.college, player.country, player.draft_year, player.draft_round, player.draft_number)
+    IS DISTINCT FROM
+      (EXCLUDED.first_name, EXCLUDED.last_name, EXCLUDED.position, EXCLUDED.height, EXCLUDED.weight,
+       EXCLUDED.jersey_number, EXCLUDED.college, EXCLUDED.country, EXCLUDED.draft_year, EXCLUDED.draft_round,
+       EXCLUDED.draft_number);
 """
 
 game_insert_query = """
@@ -35,9 +107,10 @@ ON CONFLICT (game_id) DO NOTHING;
 
 player_game_insert_query = """
 INSERT INTO player_game (
-    player_id, game_id, min, fgm, fga, fg_pct, fg3m, fg3a, fg3_pct, ftm, fta, ft_pct, oreb, dreb, reb, ast, stl, blk, turnover, pf, pts
-) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
-ON CONFLICT (player_id, game_id) DO NOTHING;
+    player_id, game_id, min, fgm, fga, fg_pct, fg3m, fg3a, fg3_pct, ftm, fta, ft_pct, oreb, dreb, reb, ast, stl, blk, turnover, pf, pts,
+    season, game_date
+) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
+ON CONFLICT (player_id, game_id, season) DO NOTHING;
 """
 
 player_team_insert_query = """
@@ -54,23 +127,368 @@ INSERT INTO team_game (
 ON CONFLICT (team_id, game_id) DO NOTHING;
 """
 
-def batch_insert(player_records, game_records, player_game_records, player_team_records, team_game_records):
-    try:
-        if player_records:
-            cursor.executemany(player_insert_query, player_records)
-        if game_records:
-            cursor.executemany(game_insert_query, game_records)
-        if player_game_records:
-            cursor.executemany(player_game_insert_query, player_game_records)
-        if player_team_records:
-            cursor.executemany(player_team_insert_query, player_team_records)
-        if team_game_records:
-            cursor.executemany(team_game_insert_query, team_game_records)
-        conn.commit()
-    except Exception as e:
-        print(f"Error during batch insert: {e}")
+# Dates whose records have been committed, written in the same transaction.
+# now() is when the transaction began, and ingest transactions queue on the
+# rolling-stats lock, so committed_at is the clock time once the lock is held:
+# stamps then follow commit order.
+checkpoint_insert_query = """
+INSERT INTO ingest_checkpoint (date, games, committed_at) VALUES %s
+ON CONFLICT (date) DO UPDATE SET games = EXCLUDED.games, committed_at = EXCLUDED.committed_at;
+"""
+
+checkpoint_template = '(%s, %s, clock_timestamp())'
+
+checkpoint_select_query = """
+SELECT date FROM ingest_checkpoint;
+"""
+
+# Column order of each record tuple produced by process.parse_box_scores, per table.
+# Tables are listed in foreign-key order, which is also the merge order.
+table_columns = {
+    'player': ('player_id', 'first_name', 'last_name', 'position', 'height', 'weight', 'jersey_number',
+               'college', 'country', 'draft_year', 'draft_round', 'draft_number'),
+    'game': ('game_id', 'date', 'season', 'home_team_score', 'visitor_team_score', 'home_team_id', 'visitor_team_id'),
+    'player_game': ('player_id', 'game_id', 'min', 'fgm', 'fga', 'fg_pct', 'fg3m', 'fg3a', 'fg3_pct', 'ftm', 'fta',
+                    'ft_pct', 'oreb', 'dreb', 'reb', 'ast', 'stl', 'blk', 'turnover', 'pf', 'pts', 'season', 'game_date'),
+    'player_team': ('player_id', 'team_id'),
+    'team_game': ('team_id', 'game_id'),
+}
+
+table_keys = {
+    'player': ('player_id',),
+    'game': ('game_id',),
+    'player_game': ('player_id', 'game_id', 'season'),
+    'player_team': ('player_id', 'team_id'),
+    'team_game': ('team_id', 'game_id'),
+}
+
+# player_game is range-partitioned by season, a decade per partition, named
+# after its first season (player_game_2020 holds 2020-2029), as in create_db.py
+SEASONS_PER_PARTITION = 10
+
+partition_select_query = """
+SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid
+WHERE i.inhparent = 'player_game'::regclass;
+"""
+
+partition_create_query = """
+CREATE TABLE IF NOT EXISTS player_game_{start} PARTITION OF player_game
+FOR VALUES FROM ({start}) TO ({end});
+"""
+
+# First seasons of the player_game partitions known to exist
+partition_starts = set()
+partition_lock = Lock()
+
+# Decade partitions are named by their first season; others (e.g. a default partition) are ignored
+partition_name = re.compile(r'player_game_(\d{4})')
+
+def ensure_partitions(seasons):
+    """
+    Creates the player_game partitions these seasons need but lack. Runs in
+    its own short transaction, before the batch's insert.
+    """
+    starts = {season - season % SEASONS_PER_PARTITION for season in seasons}
+    with partition_lock:
+        missing = starts - partition_starts
+        if not missing:
+            return
+        with get_connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute(partition_select_query)
+                partition_starts.update(int(match.group(1)) for match in
+                                        (partition_name.fullmatch(name) for (name,) in cur.fetchall()) if match)
+                for start in sorted(missing - partition_starts):
+                    cur.execute(partition_create_query.format(start=start, end=start + SEASONS_PER_PARTITION))
+            conn.commit()
+        partition_starts.update(missing)
+
+# Staging tables are session-local and emptied on commit, so every connection
+# gets its own and nothing has to be cleaned up after a batch.
+stage_create_query = """
+CREATE TEMP TABLE IF NOT EXISTS {table}_stage (LIKE {table} INCLUDING DEFAULTS) ON COMMIT DELETE ROWS;
+"""
+
+stage_copy_query = """
+COPY {table}_stage ({columns}) FROM STDIN;
+"""
+
+stage_merge_query = """
+INSERT INTO {table} ({columns})
+SELECT {columns} FROM {table}_stage
+ON CONFLICT ({keys}) DO NOTHING;
+"""
+
+# For the tables in upsert_tables: changed rows overwrite the stored ones. A
+# batch can hold a row twice, which one INSERT may not update twice.
+stage_upsert_query = """
+INSERT INTO {table} ({columns})
+SELECT DISTINCT ON ({keys}) {columns} FROM {table}_stage
+ON CONFLICT ({keys}) DO UPDATE SET {updates}
+WHERE ({stored}) IS DISTINCT FROM ({excluded});
+"""
+
+upsert_tables = {'player'}
+
+stage_truncate_query = """
+TRUNCATE {table}_stage;
+"""
+
+def copy_value(value):
+    # Encodes a value for COPY's text format: NULL marker plus backslash escapes
+    if value is None:
+        return '\\N'
+    return (str(value).replace('\\', '\\\\').replace('\t', '\\t')
+            .replace('\n', '\\n').replace('\r', '\\r'))
+
+def records_to_copy(records):
+    # Encodes record tuples as COPY text
+    return ''.join('\t'.join(copy_value(value) for value in record) + '\n' for record in records)
+
+def copy_records(cur, table, records):
+    # Streams one table's rows into its staging table. records is either a
+    # list of tuples or rows already encoded as COPY text.
+    text = records if isinstance(records, str) else records_to_copy(records)
+    buffer = io.StringIO(text)
+    columns = ', '.join(table_columns[table])
+    cur.execute(stage_create_query.format(table=table))
+    cur.copy_expert(stage_copy_query.format(table=table, columns=columns), buffer)
+
+def merge_staged(cur, table):
+    # One set-based upsert from the staging table into the real table
+    columns = table_columns[table]
+    keys = table_keys[table]
+    if table in upsert_tables:
+        values = [column for column in columns if column not in keys]
+        cur.execute(stage_upsert_query.format(
+            table=table,
+            columns=', '.join(columns),
+            keys=', '.join(keys),
+            updates=', '.join(f"{column} = EXCLUDED.{column}" for column in values),
+            stored=', '.join(f"{table}.{column}" for column in values),
+            excluded=', '.join(f"EXCLUDED.{column}" for column in values),
+        ))
+    else:
+        cur.execute(stage_merge_query.format(table=table, columns=', '.join(columns), keys=', '.join(keys)))
+    merged = cur.rowcount
+    cur.execute(stage_truncate_query.format(table=table))
+    return merged
+
+def copy_insert_records(cur, records_by_table):
+    # COPYs every table into staging first, then merges in foreign-key order.
+    # Does not commit; the caller owns the transaction. Returns the rows
+    # written per table.
+    written = {}
+    for table in table_columns:
+        if records_by_table.get(table):
+            copy_records(cur, table, records_by_table[table])
+    if records_by_table.get('player_game'):
+        rolling.stage_batch(cur)
+    for table in table_columns:
+        if records_by_table.get(table):
+            written[table] = merge_staged(cur, table)
+    rolling.update_rolling(cur)
+    return written
+
+def executemany_records(cur, records_by_table):
+    # The original row-at-a-time path. Does not commit.
+    queries = {
+        'player': player_insert_query,
+        'game': game_insert_query,
+        'player_game': player_game_insert_query,
+        'player_team': player_team_insert_query,
+        'team_game': team_game_insert_query,
+    }
+    written = {}
+    for table in table_columns:
+        if records_by_table.get(table):
+            cur.executemany(queries[table], records_by_table[table])
+            written[table] = cur.rowcount
+    rolling.stage_batch(cur, records_by_table.get('player_game'))
+    rolling.update_rolling(cur)
+    return written
+
+def count_written(written):
+    # Records the rows a committed transaction wrote, per table
+    for table, rows in written.items():
+        metrics.inc('rows_written_total', rows, table=table)
+
+def write_checkpoints(cur, checkpoints):
+    # checkpoints is a list of (date, number of games) pairs. Runs after
+    # rolling.update_rolling has taken its lock. Does not commit.
+    if checkpoints:
+        execute_values(cur, checkpoint_insert_query, checkpoints, template=checkpoint_template)
+
+def warm_dimensions():
+    # Loads the dimension cache once per process, unless it is turned off
+    if dimensions.enabled and not dimensions.warmed:
+        with get_connection() as conn:
+            dimensions.warm(conn)
+
+def completed_dates():
+    """
+    Returns the set of dates (as YYYY-MM-DD strings) already committed.
+    """
+    with get_connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute(checkpoint_select_query)
+            dates = {date.isoformat() for (date,) in cur.fetchall()}
         conn.rollback()
+    return dates
+
+def copy_insert(player_records, game_records, player_game_records, player_team_records, team_game_records, checkpoints=()):
+    records_by_table = {
+        'player': player_records,
+        'game': game_records,
+        'player_game': player_game_records,
+        'player_team': player_team_records,
+        'team_game': team_game_records,
+    }
+    with get_connection() as conn, metrics.timer('insert_seconds', method='copy'):
+        try:
+            with conn.cursor() as cur:
+                written = copy_insert_records(cur, records_by_table)
+                write_checkpoints(cur, checkpoints)
+            if dry_run:
+                conn.rollback()
+            else:
+                conn.commit()
+                count_written(written)
+            return True
+        except Exception as e:
+            print(f"Error during copy insert: {e}")
+            metrics.inc('insert_failures_total', method='copy')
+            conn.rollback()
+            return False
+
+class BulkLoader:
+    """
+    Buffers the records of several dates and flushes them together, either
+    through COPY + staging-table merges or through the executemany path.
+    """
+
+    def __init__(self, batch_size=1, method='copy'):
+        """
+        Args:
+            batch_size (int): Number of dates to buffer before flushing.
+            method (str): 'copy' for the bulk path, 'executemany' for the original one.
+        """
+        self.batch_size = max(1, batch_size)
+        self.method = method
+        self.insert = copy_insert if method == 'copy' else batch_insert
+        warm_dimensions()
+        self.reset()
+
+    def reset(self):
+        self.dates = []
+        self.seasons = set()
+        self.games = Counter()
+        self.records = {table: [] for table in table_columns}
+        # COPY text from add_columns, appended after the tuples' text
+        self.encoded = {table: [] for table in table_columns}
+        # Player and player_team rows this batch sends, None to send them all
+        self.dimensions = dimensions.batch() if dimensions.enabled else None
+
+    def add(self, date, player_records, game_records, player_game_records, player_team_records, team_game_records):
+        """
+        Buffers one date's records, flushing once batch_size dates are pending.
+
+        Returns:
+            list: The dates of a batch that failed to insert, otherwise an empty list.
+        """
+        if self.dimensions is not None:
+            player_records, player_team_records = self.dimensions.filter_records(player_records, player_team_records)
+        for table, records in zip(table_columns, (player_records, game_records, player_game_records,
+                                                  player_team_records, team_game_records)):
+            self.records[table].extend(records)
+        self.seasons.update(record[2] for record in game_records)
+        return self.added(date, len(game_records))
+
+    def add_columns(self, date, columns):
+        """
+        Buffers one date decoded by columnar.decode. On the COPY path the
+        columns are encoded straight to COPY text, skipping row tuples.
+
+        Returns:
+            list: The dates of a batch that failed to insert, otherwise an empty list.
+        """
+        if self.dimensions is not None:
+            columns = self.dimensions.filter_columns(columns, table_columns['player'])
+        for table, names in table_columns.items():
+            if self.method == 'copy':
+                self.encoded[table].append(columnar.copy_text(columns[table], names))
+            else:
+                self.records[table].extend(columnar.to_records(columns[table], names))
+        self.seasons.update(columns['game']['season'].tolist())
+        return self.added(date, len(columns['game']['game_id']))
+
+    def added(self, date, games):
+        self.dates.append(date)
+        self.games[date] += games
+        if len(self.dates) >= self.batch_size:
+            return self.flush()
+        return []
+
+    def flush(self):
+        """
+        Inserts everything buffered so far in one transaction, together with
+        checkpoints for the dates whose games are all over.
+
+        Returns:
+            list: The dates of the batch if the insert failed, otherwise an empty list.
+        """
+        if not self.dates:
+            return []
+        dates = self.dates
+        checkpoints = [(date, self.games[date]) for date in dates if is_final_date(date)]
+        if self.method == 'copy':
+            batch = [records_to_copy(self.records[table]) + ''.join(self.encoded[table]) for table in table_columns]
+        else:
+            batch = [self.records[table] for table in table_columns]
+        new_dimensions = self.dimensions
+        if new_dimensions is not None and new_dimensions.unknown_teams():
+            print(f"Teams missing from the team table (run team_scrape.py): {sorted(new_dimensions.unknown_teams())}")
+        try:
+            ensure_partitions(self.seasons)
+            ok = self.insert(*batch, checkpoints=checkpoints)
+        except psycopg2.Error as e:
+            print(f"Error creating partitions: {e}")
+            ok = False
+        # A rolled-back batch leaves the database, and so the cache, as it was
+        if ok and not dry_run and new_dimensions is not None:
+            new_dimensions.commit()
+        self.reset()
+        return [] if ok else dates
+
+def batch_insert(player_records, game_records, player_game_records, player_team_records, team_game_records, checkpoints=()):
+    records_by_table = {
+        'player': player_records,
+        'game': game_records,
+        'player_game': player_game_records,
+        'player_team': player_team_records,
+        'team_game': team_game_records,
+    }
+    with get_connection() as conn, metrics.timer('insert_seconds', method='executemany'):
+        try:
+            with conn.cursor() as cursor:
+                written = executemany_records(cursor, records_by_table)
+                write_checkpoints(cursor, checkpoints)
+            if dry_run:
+                conn.rollback()
+            else:
+                conn.commit()
+                count_written(written)
+            return True
+        except Exception as e:
+            print(f"Error during batch insert: {e}")
+            metrics.inc('insert_failures_total', method='executemany')
+            conn.rollback()
+            return False
 
 def close_connection():
-    cursor.close()
-    conn.close()
+    # Closes every pooled connection
+    global connection_pool
+    with pool_lock:
+        if connection_pool is not None:
+            connection_pool.closeall()
+            connection_pool = None
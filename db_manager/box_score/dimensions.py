@@ -0,0 +1,167 @@
+"""
+Process-wide cache of the dimension rows already in the database.
+
+Every box score carries a full player record and a player_team pair for each
+player, so over a season the same few hundred players would be sent tens of
+thousands of times only to be dropped by ON CONFLICT. The cache is warmed from
+the player, team and player_team tables, and database.BulkLoader sends only
+the player rows that are new or differ from the stored ones (a jersey number,
+height or weight change, which the merge then applies as an update) and the
+player_team pairs not seen before (a trade or signing).
+
+Each loader filters its batch against the cache plus the rows already pending
+in that batch, and adds them to the cache only once the batch has committed, so
+a failed or rolled-back batch never hides rows the database lacks.
+"""
+
+from collections import Counter
+from threading import Lock
+import numpy as np
+from metrics import metrics
+
+player_select_query = """
+SELECT player_id, first_name, last_name, position, height, weight, jersey_number, college, country,
+       draft_year, draft_round, draft_number
+FROM player;
+"""
+
+team_select_query = """
+SELECT team_id FROM team;
+"""
+
+player_team_select_query = """
+SELECT player_id, team_id FROM player_team;
+"""
+
+def normalize(row):
+    # Compares API values (str, int, NumPy scalars) with the stored ones
+    return tuple(None if value is None else str(value) for value in row)
+
+class DimensionBatch:
+    """
+    The new or changed dimension rows of one loader batch.
+    """
+
+    def __init__(self, cache):
+        self.cache = cache
+        self.players = {}
+        self.player_teams = set()
+
+    def is_new_player(self, row):
+        # row is a player record in database.table_columns['player'] order
+        player_id, values = int(row[0]), normalize(row[1:])
+        if self.players.get(player_id, self.cache.players.get(player_id)) == values:
+            return False
+        self.players[player_id] = values
+        return True
+
+    def is_new_player_team(self, player_id, team_id):
+        pair = (int(player_id), int(team_id))
+        if pair in self.player_teams or pair in self.cache.player_teams:
+            return False
+        self.player_teams.add(pair)
+        return True
+
+    def filter_records(self, player_records, player_team_records):
+        """
+        Drops the player and player_team tuples the database already has.
+
+        Returns:
+            tuple: (player records, player_team records) to send.
+        """
+        players = [record for record in player_records if self.is_new_player(record)]
+        player_teams = [record for record in player_team_records if self.is_new_player_team(*record)]
+        self.cache.count('player', len(player_records), len(players))
+        self.cache.count('player_team', len(player_team_records), len(player_teams))
+        return players, player_teams
+
+    def filter_columns(self, columns, player_names):
+        """
+        The same for a date decoded by columnar.decode.
+
+        Returns:
+            dict: columns, with the player and player_team tables reduced to the rows to send.
+        """
+        player = columns['player']
+        rows = zip(*(player[name].tolist() for name in player_names))
+        player_mask = np.fromiter((self.is_new_player(row) for row in rows), dtype=bool, count=len(player['player_id']))
+        player_team = columns['player_team']
+        pairs = zip(player_team['player_id'].tolist(), player_team['team_id'].tolist())
+        pair_mask = np.fromiter((self.is_new_player_team(*pair) for pair in pairs), dtype=bool,
+                                count=len(player_team['player_id']))
+        self.cache.count('player', len(player_mask), int(player_mask.sum()))
+        self.cache.count('player_team', len(pair_mask), int(pair_mask.sum()))
+        filtered = dict(columns)
+        filtered['player'] = {name: column[player_mask] for name, column in player.items()}
+        filtered['player_team'] = {name: column[pair_mask] for name, column in player_team.items()}
+        return filtered
+
+    def unknown_teams(self):
+        # Teams of the batch missing from the team table, which its foreign keys will reject
+        return {team_id for _, team_id in self.player_teams} - self.cache.teams if self.cache.teams else set()
+
+    def commit(self):
+        # Called once the batch is in the database
+        with self.cache.lock:
+            self.cache.players.update(self.players)
+            self.cache.player_teams.update(self.player_teams)
+
+class DimensionCache:
+    """
+    The player rows, team ids and player_team pairs known to be stored.
+    """
+
+    def __init__(self):
+        self.enabled = True
+        self.warmed = False
+        self.players = {}
+        self.teams = set()
+        self.player_teams = set()
+        self.lock = Lock()
+        # Rows seen and rows sent, per table
+        self.seen = Counter()
+        self.sent = Counter()
+
+    def warm(self, conn):
+        """
+        Loads the stored dimensions. Only the first call reads the database.
+
+        Args:
+            conn: A database connection; its transaction is rolled back afterwards.
+        """
+        with self.lock:
+            if self.warmed:
+                return
+            with conn.cursor() as cur:
+                cur.execute(player_select_query)
+                self.players = {player_id: normalize(values) for player_id, *values in cur.fetchall()}
+                cur.execute(team_select_query)
+                self.teams = {team_id for (team_id,) in cur.fetchall()}
+                cur.execute(player_team_select_query)
+                self.player_teams = set(cur.fetchall())
+            conn.rollback()
+            self.warmed = True
+
+    def batch(self):
+        return DimensionBatch(self)
+
+    def count(self, table, seen, sent):
+        with self.lock:
+            self.seen[table] += seen
+            self.sent[table] += sent
+        metrics.inc('dimension_rows_skipped_total', seen - sent, table=table)
+
+    def summary(self):
+        """
+        Returns:
+            str: How many dimension rows were sent out of those decoded, per table.
+        """
+        lines = []
+        for table in ('player', 'player_team'):
+            seen, sent = self.seen[table], self.sent[table]
+            saved = 1 - sent / seen if seen else 0
+            lines.append(f"{table:<11} sent {sent} of {seen} rows ({saved:.1%} skipped)")
+        return '\n'.join(lines)
+
+# Shared by every loader in the process
+dimensions = DimensionCache()
@@ -0,0 +1,342 @@
+"""
+Process-wide flow control for balldontlie requests.
+
+Every request, from any worker thread, the /games pagination or the asyncio
+engine, goes through one FlowController:
+
+- Requests are paced to the plan's rate limit.
+- The number of requests in flight is an AIMD window: it grows by one for
+  every window's worth of successful responses and halves on a 429 or a 5xx
+  (at most once per COOLDOWN seconds, so one burst of 429s counts once).
+- A 429's Retry-After (seconds or an HTTP date), or rate-limit headers that
+  report no requests remaining, pause every caller until the given time,
+  rather than each thread backing off on its own.
+
+A failed /box_scores date is not retried in place: the worker thread or
+asyncio fetcher reschedules it in the RetryQueue with exponential backoff and
+jitter, and moves on to other dates until it is due. Dates that fail MAX_ATTEMPTS times are given up.
+"""
+
+import asyncio
+import email.utils
+import heapq
+import itertools
+import random
+import time
+from collections import Counter, deque
+from threading import Condition
+import requests
+from metrics import metrics
+
+# Requests per minute allowed by the API plan
+RATE_LIMIT = 300
+
+# Responses that mean "slow down" or "try again later"
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+# Attempts per date or page before giving up
+MAX_ATTEMPTS = 5
+
+# Backoff without a Retry-After: MIN_BACKOFF * 2^(attempt-1), capped at MAX_BACKOFF seconds
+MIN_BACKOFF = 4
+MAX_BACKOFF = 60
+
+# Share of a delay added at random, so rescheduled requests do not collide again
+JITTER = 0.5
+
+# Multiplicative decrease of the window, and how often it may happen
+DECREASE = 0.5
+COOLDOWN = 2.0
+
+# Returned by RetryQueue.get when nothing came due before its timeout
+EMPTY = object()
+
+# Seconds a coroutine waits between looks at a RetryQueue with nothing due
+QUEUE_POLL = 0.05
+
+class RetryLater(Exception):
+    """
+    A request the API refused or could not answer. delay is the wait it asked
+    for, or None to use the backoff.
+    """
+
+    def __init__(self, message, delay=None):
+        super().__init__(message)
+        self.delay = delay
+
+def retry_after(headers, now=None):
+    """
+    The seconds to wait that a response's headers ask for, or None.
+
+    Reads Retry-After (seconds or an HTTP date), then X-RateLimit-Reset /
+    RateLimit-Reset (an epoch time or seconds) when no requests remain.
+    """
+    now = time.time() if now is None else now
+    value = headers.get('Retry-After')
+    if value:
+        try:
+            return max(0.0, float(value))
+        except ValueError:
+            try:
+                return max(0.0, email.utils.parsedate_to_datetime(value).timestamp() - now)
+            except (TypeError, ValueError):
+                pass
+    remaining = headers.get('X-RateLimit-Remaining', headers.get('RateLimit-Remaining'))
+    reset = headers.get('X-RateLimit-Reset', headers.get('RateLimit-Reset'))
+    if remaining is not None and reset is not None:
+        try:
+            if float(remaining) <= 0:
+                reset = float(reset)
+                # Large values are epoch times, small ones are seconds from now
+                return max(0.0, reset - now if reset > 10 ** 9 else reset)
+        except ValueError:
+            pass
+    return None
+
+def backoff(attempt):
+    return min(MAX_BACKOFF, MIN_BACKOFF * 2 ** (attempt - 1))
+
+def jittered(delay):
+    return delay * (1 + random.uniform(0, JITTER))
+
+class FlowController:
+    """
+    Paces requests, limits how many are in flight with an AIMD window, and
+    pauses everyone when the API says to.
+    """
+
+    def __init__(self, rate_limit=RATE_LIMIT, max_concurrency=8, min_concurrency=1):
+        self.lock = Condition()
+        self.configure(rate_limit, max_concurrency, min_concurrency)
+        self.in_flight = 0
+        self.next_start = 0.0
+        self.paused_until = 0.0
+        self.last_decrease = 0.0
+
+    def configure(self, rate_limit=RATE_LIMIT, max_concurrency=8, min_concurrency=1):
+        """
+        Args:
+            rate_limit (int): Requests per minute, the most the pacing allows.
+            max_concurrency (int): The largest the window grows.
+            min_concurrency (int): The smallest it shrinks to.
+        """
+        with self.lock:
+            self.interval = 60 / rate_limit
+            self.max_concurrency = max(1, max_concurrency)
+            self.min_concurrency = max(1, min(min_concurrency, self.max_concurrency))
+            self.window = float(max(self.min_concurrency, self.max_concurrency // 2))
+            self.lock.notify_all()
+
+    def wait_time(self, now):
+        # Seconds until a request may start, or None while the window is full
+        if self.in_flight >= int(self.window):
+            return None
+        return max(0.0, self.paused_until - now, self.next_start - now)
+
+    def try_acquire(self):
+        """
+        Takes a request slot if one is free now.
+
+        Returns:
+            float: 0 if the slot was taken, otherwise how long to wait before trying again.
+        """
+        with self.lock:
+            now = time.monotonic()
+            wait = self.wait_time(now)
+            if wait == 0:
+                self.in_flight += 1
+                self.next_start = max(now, self.next_start) + self.interval
+                return 0.0
+            return self.interval if wait is None else wait
+
+    def acquire(self):
+        # Blocks the calling thread until it may send a request
+        with metrics.timer('rate_limit_sleep_seconds'):
+            with self.lock:
+                while True:
+                    now = time.monotonic()
+                    wait = self.wait_time(now)
+                    if wait == 0:
+                        self.in_flight += 1
+                        self.next_start = max(now, self.next_start) + self.interval
+                        return
+                    self.lock.wait(wait)
+
+    async def acquire_async(self):
+        # The same, for coroutines
+        with metrics.timer('rate_limit_sleep_seconds'):
+            while True:
+                wait = self.try_acquire()
+                if wait == 0:
+                    return
+                await asyncio.sleep(wait)
+
+    def set_rate(self, rate_limit):
+        # Changes the pacing alone, e.g. when this process's share of the quota changes
+        with self.lock:
+            self.interval = 60 / rate_limit
+            self.lock.notify_all()
+
+    def release(self, status=None, headers=None):
+        """
+        Returns a request slot and adjusts the window to how the request went.
+
+        Args:
+            status (int): The response status, or None if no response arrived.
+            headers (dict): The response headers.
+        """
+        headers = headers or {}
+        with self.lock:
+            self.in_flight -= 1
+            now = time.monotonic()
+            if status is None or status in RETRY_STATUSES:
+                if now - self.last_decrease >= COOLDOWN:
+                    self.window = max(self.min_concurrency, self.window * DECREASE)
+                    self.last_decrease = now
+                    metrics.inc('flow_decreases_total')
+            else:
+                self.window = min(self.max_concurrency, self.window + 1 / self.window)
+            delay = retry_after(headers)
+            if delay is None and status == 429:
+                delay = MIN_BACKOFF
+            if delay:
+                self.paused_until = max(self.paused_until, now + delay)
+                metrics.inc('flow_pauses_total')
+            self.lock.notify_all()
+
+    def get(self, url, headers, params, endpoint):
+        """
+        One paced GET through the controller.
+
+        Returns:
+            bytes: The response body.
+
+        Raises:
+            RetryLater: On a connection error, a 429 or a 5xx.
+            requests.exceptions.HTTPError: On any other error status.
+        """
+        self.acquire()
+        status, response_headers = None, {}
+        try:
+            with metrics.timer('http_request_seconds', endpoint=endpoint):
+                response = requests.get(url, headers=headers, params=params, timeout=60)
+            status, response_headers = response.status_code, response.headers
+        except requests.exceptions.RequestException as e:
+            raise RetryLater(f"{endpoint}: {e}") from e
+        finally:
+            self.release(status, response_headers)
+        metrics.inc('http_responses_total', endpoint=endpoint, status=status)
+        if status in RETRY_STATUSES:
+            raise RetryLater(f"{endpoint}: HTTP {status}", retry_after(response_headers))
+        response.raise_for_status()
+        metrics.inc('http_bytes_total', len(response.content), endpoint=endpoint)
+        return response.content
+
+    def get_with_retries(self, url, headers, params, endpoint, max_attempts=MAX_ATTEMPTS):
+        # For callers that cannot reschedule (e.g. paging): waits and retries in place
+        for attempt in range(1, max_attempts + 1):
+            try:
+                return self.get(url, headers, params, endpoint)
+            except RetryLater as e:
+                if attempt == max_attempts:
+                    raise
+                metrics.inc('http_retries_total', endpoint=endpoint)
+                time.sleep(jittered(e.delay if e.delay is not None else backoff(attempt)))
+
+# Shared by api.py, get_dates.py and async_fetch.py; main.py configures it
+controller = FlowController()
+
+class RetryQueue:
+    """
+    The dates to ingest. New dates come out in the order they were put;
+    failed ones are rescheduled with backoff and jitter and come out first
+    once due. get() returns None only once the queue is closed and every date
+    is done, so a worker never exits while another may still reschedule.
+    """
+
+    def __init__(self, max_attempts=MAX_ATTEMPTS):
+        self.max_attempts = max_attempts
+        self.fresh = deque()
+        self.retries = []
+        self.attempts = Counter()
+        self.active = 0
+        self.closed = False
+        self.order = itertools.count()
+        self.lock = Condition()
+
+    def put(self, date):
+        with self.lock:
+            self.fresh.append(date)
+            self.lock.notify()
+
+    def close(self):
+        # No more new dates will be put
+        with self.lock:
+            self.closed = True
+            self.lock.notify_all()
+
+    def get(self, timeout=None):
+        """
+        The next date to work on, which the caller must finish with task_done().
+
+        Args:
+            timeout (float): Give up waiting after this many seconds, None to wait.
+
+        Returns:
+            The date; None once everything is done; EMPTY if the timeout passed
+            first (or nothing is left to wait for but the caller's own dates).
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self.lock:
+            while True:
+                now = time.monotonic()
+                if self.retries and self.retries[0][0] <= now:
+                    date = heapq.heappop(self.retries)[2]
+                elif self.fresh:
+                    date = self.fresh.popleft()
+                elif self.closed and not self.retries and self.active == 0:
+                    return None
+                else:
+                    waits = [self.retries[0][0] - now] if self.retries else []
+                    if deadline is not None:
+                        if now >= deadline or (self.closed and not self.retries):
+                            return EMPTY
+                        waits.append(deadline - now)
+                    self.lock.wait(min(waits) if waits else None)
+                    continue
+                self.active += 1
+                return date
+
+    async def get_async(self):
+        # The same as get(), for coroutines: polls rather than blocking the event loop
+        while True:
+            date = self.get(0)
+            if date is not EMPTY:
+                return date
+            await asyncio.sleep(QUEUE_POLL)
+
+    def retry(self, date, delay=None):
+        """
+        Reschedules a date that failed. Call before task_done() for it.
+
+        Args:
+            delay (float): The wait the API asked for, or None for the backoff.
+
+        Returns:
+            bool: False if the date has used all its attempts.
+        """
+        with self.lock:
+            self.attempts[date] += 1
+            attempt = self.attempts[date]
+            if attempt >= self.max_attempts:
+                return False
+            delay = jittered(delay if delay is not None else backoff(attempt))
+            heapq.heappush(self.retries, (time.monotonic() + delay, next(self.order), date))
+            self.lock.notify_all()
+            return True
+
+    def task_done(self, dates):
+        # Settles dates taken with get(), whether they were done or rescheduled
+        with self.lock:
+            self.active -= len(dates)
+            self.lock.notify_all()
@@ -1,27 +1,40 @@
+import datetime
+import json
 import os
 from dotenv import load_dotenv
 import requests
 from tqdm import tqdm
-from tenacity import retry, wait_exponential, stop_after_attempt, retry_if_exception_type
 import numpy as np
+from response_cache import cache, season_end, CACHE_DIR
+from metrics import metrics
+from flow import controller
 
 # Take environment variables from .env.
 load_dotenv()
 
 # API Configuration
 API_KEY = os.getenv("API_KEY")
-API_ENDPOINT = "https://api.balldontlie.io/v1/games"
+API_BASE_URL = os.getenv("API_BASE_URL", "https://api.balldontlie.io/v1")
+API_ENDPOINT = f"{API_BASE_URL}/games"
 
 # Set up the headers with the API key.
 headers = {
     'Authorization': API_KEY
 }
 
-@retry(wait=wait_exponential(multiplier=1, min=4, max=10), stop=stop_after_attempt(5), retry=retry_if_exception_type(requests.exceptions.RequestException))
+def fetch(params):
+    # Pages are fetched in order, so failures are retried in place, waiting
+    # as long as the flow controller or the API asks
+    return controller.get_with_retries(API_ENDPOINT, headers, params, 'games')
+
 def make_request(params):
-    response = requests.get(API_ENDPOINT, headers=headers, params=params)
-    response.raise_for_status()  # Raise an exception for HTTP errors
-    return response
+    # Returns the raw response body, from the on-disk cache when possible
+    body = cache.get(API_ENDPOINT, params)
+    metrics.inc('cache_requests_total', endpoint='games', result='hit' if body is not None else 'miss')
+    if body is None:
+        body = fetch(params)
+        cache.put(API_ENDPOINT, params, body)
+    return body
 
 def fetch_data(season):
     cur_cursor = None
@@ -33,9 +46,9 @@ def fetch_data(season):
         if cur_cursor:
             params["cursor"] = cur_cursor
         try:
-            response = make_request(params)
-            data = response.json()
-            yield data['data'], len(response.content)
+            body = make_request(params)
+            data = json.loads(body)
+            yield data, len(body)
             cur_cursor = data['meta'].get('next_cursor', None)
             if not cur_cursor:
                 break
@@ -46,17 +59,107 @@ def fetch_data(season):
             tqdm.write(f"Exception: {str(e)}")
             break
 
+# Native balldontlie game ids, keyed by (date, home_team_id). Box score
+# payloads carry no game id, so process.py resolves them through this map.
+game_ids = {}
+
+# Dates whose every game is in game_ids: listed by /games for the date, or by
+# a season listing that was paged to the end
+complete_dates = set()
+
+class GameNotFound(LookupError):
+    pass
+
+def remember_games(records, complete=False):
+    # records are /games records, or the trimmed ones cached by iter_season_dates
+    for record in records:
+        game_ids[(record['date'], record['home_team']['id'])] = record['id']
+    if complete:
+        complete_dates.update(record['date'] for record in records)
+
+def fetch_games_on(date):
+    # Blocking; the asyncio engine calls it in a thread before decoding the date
+    remember_games(json.loads(make_request({"dates[]": date, "per_page": 100}))['data'])
+    complete_dates.add(date)
+
+def lookup_game_id(date, home_team_id):
+    """
+    Returns the API's game id for a team's home game on a date, asking
+    /games for that date if discovery has not seen all of its games.
+
+    Raises:
+        GameNotFound: If /games does not list the game.
+    """
+    key = (date, home_team_id)
+    if key not in game_ids and date not in complete_dates:
+        fetch_games_on(date)
+    if key not in game_ids:
+        raise GameNotFound(f"/games lists no game on {date} with home team {home_team_id}")
+    return game_ids[key]
+
+def season_finished(season):
+    return datetime.datetime.now() >= season_end(season)
+
+def season_cache_path(season):
+    # Renamed when the cached records took the /games shape (home_team: {id})
+    return os.path.join(CACHE_DIR, 'dates', f"season_{season}_schedule.json")
+
+def iter_season_dates(season, progress_bar=None):
+    """
+    Yields a season's game dates page by page as /games is paginated, or from
+    the cache if the season has been fully fetched before. Game ids are
+    recorded in game_ids along the way.
+
+    Args:
+        season (int): The season to list.
+        progress_bar (tqdm): Optional bar advanced once per page.
+    """
+    path = season_cache_path(season)
+    if os.path.exists(path):
+        with open(path) as f:
+            games = json.load(f)
+        remember_games(games, complete=True)
+        yield from (game['date'] for game in games)
+        return
+
+    games = []
+    complete = False
+    for data, data_size in fetch_data(season):
+        if progress_bar is not None:
+            progress_bar.update(1)
+        page_games = [{'id': record['id'], 'date': record['date'], 'home_team': {'id': record['home_team']['id']}}
+                      for record in data['data']]
+        remember_games(page_games)
+        games.extend(page_games)
+        yield from (game['date'] for game in page_games)
+        complete = not data['meta'].get('next_cursor')
+    if complete:
+        remember_games(games, complete=True)
+
+    # Only cache seasons whose schedule can no longer change
+    if complete and season_finished(season):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'w') as f:
+            json.dump(games, f)
+
+def iter_dates(seasons):
+    """
+    Yields each distinct game date across seasons, as soon as the /games page
+    listing it arrives.
+
+    Args:
+        seasons (iterable): The seasons to list.
+    """
+    seen = set()
+    with tqdm(desc="Pages", unit="page", leave=False) as pbar:
+        for season in seasons:
+            for date in iter_season_dates(season, pbar):
+                if date not in seen:
+                    seen.add(date)
+                    yield date
+
 def fetch_and_store_data(seasons):
-    dates = np.array([])
-    total_bytes = 0 
-    for season in tqdm(seasons, desc="Seasons", unit="season"):
-        data_generator = fetch_data(season)
-        for data_page, data_size in tqdm(data_generator, desc=f"Season {season}", unit="page", leave=False):
-            total_bytes += data_size
-            for record in data_page:
-                game = record.pop('date')
-                dates = np.append(dates, game)
-    return np.unique(dates)
+    return np.array(sorted(iter_dates(seasons)))
 
 if __name__ == "__main__":
     seasons = np.arange(2014, 2023)
@@ -1,10 +1,17 @@
 import argparse
-from queue import Queue
+import asyncio
 from threading import Thread
 from tqdm import tqdm
-from get_dates import fetch_and_store_data
-from process import worker, reprocess_error_dates, error_dates
-from database import close_connection
+from get_dates import iter_dates
+from process import worker, error_dates
+import database
+from database import init_pool, close_connection, completed_dates, warm_dimensions
+from dimensions import dimensions
+from api import RATE_LIMIT
+from response_cache import cache
+from flow import controller, RetryQueue
+from work_queue import WorkQueue, LEASE
+from metrics import metrics
 
 # Function to parse command-line arguments
 def parse_args():
@@ -12,42 +19,99 @@ def parse_args():
     parser.add_argument('--start_year', type=int, required=True, help='The start year of the date range')
     parser.add_argument('--end_year', type=int, required=True, help='The end year of the date range')
     parser.add_argument('--num_workers', type=int, default=4, help='The number of worker threads')
-    return parser.parse_args()
+    parser.add_argument('--batch_size', type=int, default=10, help='The number of dates each worker flushes to the database at once')
+    parser.add_argument('--pool_size', type=int, default=None, help='The number of pooled database connections (defaults to num_workers)')
+    parser.add_argument('--loader', choices=['copy', 'executemany'], default='copy', help='COPY into staging tables, or row-by-row executemany')
+    parser.add_argument('--mode', choices=['threads', 'async'], default='threads', help='Blocking worker threads, or the asyncio fetch engine')
+    parser.add_argument('--concurrency', type=int, default=8, help='Requests in flight in async mode')
+    parser.add_argument('--rate_limit', type=int, default=RATE_LIMIT, help='API requests per minute')
+    parser.add_argument('--decoder', choices=['tuples', 'columnar'], default='columnar', help='Per-row tuples, or the NumPy columnar decoder')
+    parser.add_argument('--no_cache', action='store_true', help='Bypass the on-disk response cache')
+    parser.add_argument('--dry_run', action='store_true', help='Fetch and load everything, but roll back every insert')
+    parser.add_argument('--metrics', help='Write metrics to this file periodically (Prometheus text if it ends in .prom, else JSON)')
+    parser.add_argument('--metrics_interval', type=int, default=10, help='Seconds between metrics writes')
+    parser.add_argument('--ignore_checkpoints', action='store_true', help='Re-ingest dates that were already committed')
+    parser.add_argument('--no_dimension_cache', action='store_true', help='Send every player and player_team row, not only new or changed ones')
+    parser.add_argument('--queue', choices=['memory', 'postgres'], default='memory', help='An in-process queue, or the ingest_queue table shared with other processes (threads mode)')
+    parser.add_argument('--node_id', default=None, help='Name of this process in the shared queue (defaults to host:pid)')
+    parser.add_argument('--lease', type=int, default=LEASE, help='Seconds a claimed date stays leased without a heartbeat')
+    args = parser.parse_args()
+    if args.queue == 'postgres' and args.mode == 'async':
+        parser.error("--queue postgres requires --mode threads")
+    return args
 
 def main():
     args = parse_args()
+    # The shared queue's heartbeat and the date feed need connections of their own
+    init_pool((args.pool_size or args.num_workers) + (2 if args.queue == 'postgres' else 0))
+    cache.enabled = not args.no_cache
+    database.dry_run = args.dry_run
+    dimensions.enabled = not args.no_dimension_cache
+    warm_dimensions()
+    if dimensions.enabled:
+        print(f"Dimension cache: {len(dimensions.players)} players, {len(dimensions.player_teams)} player teams.")
+    if args.metrics:
+        metrics.start_dump(args.metrics, args.metrics_interval)
 
-    # Create a queue and add dates
-    print('Getting dates...')
-    flattened_dates = fetch_and_store_data(range(args.start_year, args.end_year + 1))
-    queue = Queue()
-    for date in flattened_dates:
-        queue.put(date)
-
-    # Create and start threads
+    # Dates are discovered page by page and ingested as they arrive,
+    # skipping those a previous run already committed
+    done = set() if args.ignore_checkpoints else completed_dates()
+    if done:
+        print(f"Skipping {len(done)} dates already ingested.")
+    dates = (date for date in iter_dates(range(args.start_year, args.end_year + 1)) if date not in done)
     num_workers = args.num_workers
-    threads = []
-    with tqdm(total=len(flattened_dates)) as pbar:
-        for _ in range(num_workers):  # Number of worker threads
-            t = Thread(target=worker, args=(queue, pbar, num_workers))
-            t.start()
-            threads.append(t)
 
-        # Wait for all tasks in the queue to be processed
-        queue.join()
+    if args.mode == 'async':
+        # Imported here so thread mode does not require aiohttp
+        from async_fetch import run
+        # Failed dates are rescheduled within the run, as in thread mode
+        asyncio.run(run(dates, args.concurrency, num_workers, args.batch_size, args.loader, args.rate_limit, args.decoder))
+    else:
+        # One flow controller paces every worker's requests; failed dates go
+        # back into the queue rather than to a second pass. With the shared
+        # queue, the pacing is this process's share of the rate limit.
+        controller.configure(args.rate_limit, num_workers)
+        if args.queue == 'postgres':
+            queue = WorkQueue(num_workers, args.rate_limit, args.node_id, args.lease, requeue=args.ignore_checkpoints)
+        else:
+            queue = RetryQueue()
+
+        # Create and start threads
+        threads = []
+        with tqdm(total=0) as pbar:
+            for _ in range(num_workers):  # Number of worker threads
+                t = Thread(target=worker, args=(queue, pbar, args.batch_size, args.loader, args.decoder))
+                t.start()
+                threads.append(t)
 
-        # Wait for all threads to finish
-        for t in threads:
-            t.join()
+            try:
+                # Feed dates to the workers while /games is still being paginated
+                for date in dates:
+                    queue.put(date)
+                    pbar.total += 1
+                    pbar.refresh()
+                queue.close()
+
+                # Wait for all threads to finish
+                for t in threads:
+                    t.join()
+            finally:
+                # Hands back anything still leased if the run was interrupted
+                if args.queue == 'postgres':
+                    queue.leave()
 
-    # Reprocess dates that encountered errors
     if error_dates:
-        print(f"Reprocessing {len(error_dates)} error dates...")
-        reprocess_error_dates(num_workers)
+        print(f"Gave up on {len(error_dates)} dates: {', '.join(sorted(error_dates))}")
 
     # Close the connection
     close_connection()
 
+    metrics.stop_dump(args.metrics)
+    print("Time spent:")
+    print(metrics.summary())
+    if dimensions.enabled:
+        print(dimensions.summary())
+
     print("------------------------------------")
     print("Done!")
 
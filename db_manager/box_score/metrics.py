@@ -0,0 +1,203 @@
+"""
+Process-wide counters and latency histograms for the ingest pipeline.
+
+api.py and get_dates.py record every HTTP request (latency, status, bytes,
+retries, cache hits); flow.py records the time spent waiting for the rate
+limit and every 429 pause; process.py records decoding and the time workers
+wait on their queue; database.py records each insert
+transaction and the rows it wrote per table. With main.py --metrics the
+registry is written to a file every few seconds, as JSON or, for a path
+ending in .prom, in the Prometheus text format (e.g. for node_exporter's
+textfile collector), and summary() tells where the time of a run went.
+"""
+
+import bisect
+import json
+import math
+import os
+import time
+from contextlib import contextmanager
+from threading import Event, Lock, Thread
+
+# Prefix of every metric name in the Prometheus output
+PREFIX = 'box_score_'
+
+# Upper bounds of the latency buckets, in seconds
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+class Histogram:
+    """
+    Counts of observations per bucket, plus their sum and maximum.
+    """
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+        self.max = max(self.max, value)
+
+    def quantile(self, q):
+        # Upper bound of the bucket holding the q-th observation
+        if not self.count:
+            return None
+        rank = q * self.count
+        seen = 0
+        for bound, count in zip(self.buckets, self.counts):
+            seen += count
+            if seen >= rank:
+                return min(bound, self.max)
+        return self.max
+
+    def to_dict(self):
+        return {'count': self.count, 'sum': round(self.sum, 6), 'max': round(self.max, 6),
+                'p50': self.quantile(0.5), 'p90': self.quantile(0.9), 'p99': self.quantile(0.99)}
+
+def label_text(labels, extra=()):
+    pairs = list(labels) + list(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{name}="{value}"' for name, value in pairs) + '}'
+
+class Metrics:
+    """
+    A thread-safe registry of labelled counters and histograms.
+    """
+
+    def __init__(self):
+        self.lock = Lock()
+        self.counters = {}
+        self.histograms = {}
+        self.started = time.time()
+        self.stop_event = None
+        self.dumper = None
+
+    def inc(self, name, value=1, **labels):
+        """
+        Adds to a counter, e.g. metrics.inc('rows_written_total', 240, table='player_game').
+        """
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def observe(self, name, value, **labels):
+        """
+        Records one observation (seconds) in a histogram.
+        """
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            if key not in self.histograms:
+                self.histograms[key] = Histogram()
+            self.histograms[key].observe(value)
+
+    @contextmanager
+    def timer(self, name, **labels):
+        # Observes how long the block took, whether or not it raised
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start, **labels)
+
+    def snapshot(self):
+        """
+        Returns:
+            dict: uptime, and every counter and histogram keyed by name and labels.
+        """
+        with self.lock:
+            counters = {f"{name}{label_text(labels)}": value for (name, labels), value in sorted(self.counters.items())}
+            histograms = {f"{name}{label_text(labels)}": histogram.to_dict()
+                          for (name, labels), histogram in sorted(self.histograms.items())}
+        return {'uptime': round(time.time() - self.started, 3), 'counters': counters, 'histograms': histograms}
+
+    def prometheus(self):
+        """
+        Returns:
+            str: Every metric in the Prometheus text exposition format.
+        """
+        lines = []
+        with self.lock:
+            typed = set()
+            for (name, labels), value in sorted(self.counters.items()):
+                if name not in typed:
+                    lines.append(f"# TYPE {PREFIX}{name} counter")
+                    typed.add(name)
+                lines.append(f"{PREFIX}{name}{label_text(labels)} {value}")
+            for (name, labels), histogram in sorted(self.histograms.items()):
+                if name not in typed:
+                    lines.append(f"# TYPE {PREFIX}{name} histogram")
+                    typed.add(name)
+                cumulative = 0
+                for bound, count in zip(histogram.buckets + (math.inf,), histogram.counts):
+                    cumulative += count
+                    le = '+Inf' if bound == math.inf else repr(bound)
+                    lines.append(f"{PREFIX}{name}_bucket{label_text(labels, [('le', le)])} {cumulative}")
+                lines.append(f"{PREFIX}{name}_sum{label_text(labels)} {histogram.sum}")
+                lines.append(f"{PREFIX}{name}_count{label_text(labels)} {histogram.count}")
+        return '\n'.join(lines) + '\n'
+
+    def write(self, path):
+        """
+        Writes the registry to path, in the Prometheus format if it ends in .prom
+        and as JSON otherwise. Readers never see a partial file.
+        """
+        text = self.prometheus() if path.endswith('.prom') else json.dumps(self.snapshot(), indent=2)
+        tmp = f"{path}.tmp"
+        with open(tmp, 'w') as f:
+            f.write(text)
+        os.replace(tmp, path)
+
+    def start_dump(self, path, interval=10):
+        """
+        Writes the registry to path every `interval` seconds until stop_dump().
+        """
+        self.stop_event = Event()
+
+        def dump():
+            while not self.stop_event.wait(interval):
+                self.write(path)
+
+        self.dumper = Thread(target=dump, daemon=True)
+        self.dumper.start()
+
+    def stop_dump(self, path=None):
+        # Stops the periodic dump and writes the final state
+        if self.stop_event is not None:
+            self.stop_event.set()
+            self.dumper.join()
+            self.stop_event = self.dumper = None
+        if path:
+            self.write(path)
+
+    def total(self, name):
+        # Sum of a histogram's observations (or a counter) over all its labels
+        with self.lock:
+            if any(key[0] == name for key in self.histograms):
+                return sum(histogram.sum for (key, _), histogram in self.histograms.items() if key == name)
+            return sum(value for (key, _), value in self.counters.items() if key == name)
+
+    def summary(self):
+        """
+        Where the workers' time went, to tell a network-, parse- or database-bound run apart.
+
+        Returns:
+            str: One line per stage with its total seconds and share.
+        """
+        stages = [('network', 'http_request_seconds'), ('decode', 'decode_seconds'),
+                  ('database', 'insert_seconds'), ('rate limit', 'rate_limit_sleep_seconds'),
+                  ('queue wait', 'queue_wait_seconds')]
+        totals = [(label, self.total(name)) for label, name in stages]
+        overall = sum(seconds for _, seconds in totals) or 1
+        lines = [f"{label:<11} {seconds:>9.1f}s {seconds / overall:>6.1%}" for label, seconds in totals]
+        lines.append(f"requests {self.total('http_responses_total'):.0f}, retries {self.total('http_retries_total'):.0f}, "
+                     f"{self.total('http_bytes_total') / 2**20:.1f} MB, rows written {self.total('rows_written_total'):.0f}")
+        return '\n'.join(lines)
+
+# Shared by the whole process
+metrics = Metrics()
@@ -0,0 +1,158 @@
+"""
+A local stand-in for the balldontlie /games and /box_scores endpoints, for
+exercising the ingest pipeline without spending API quota.
+
+/box_scores answers every date with the bundled response_2024-02-07.json, with
+the game dates rewritten to the requested date. /games pages through --days
+synthetic dates per season, starting each October 24th. With --rate_limit,
+requests beyond that many in the last minute get a 429 with Retry-After, as
+the real API does. Point the pipeline at
+it with API_BASE_URL, e.g.
+
+python mock_api.py --port 8000 --latency 0.2
+python mock_api.py --port 8000 --rate_limit 60
+API_BASE_URL=http://127.0.0.1:8000/v1 python main.py --start_year 2023 --end_year 2023 --mode async
+"""
+
+import argparse
+import copy
+import datetime
+import json
+import os
+import time
+from collections import deque
+from threading import Lock
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+
+FIXTURE = os.path.join(os.path.dirname(__file__), '..', '..', 'response_2024-02-07.json')
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Mock balldontlie API")
+    parser.add_argument('--port', type=int, default=8000, help='The port to listen on')
+    parser.add_argument('--fixture', default=FIXTURE, help='A saved /box_scores response')
+    parser.add_argument('--latency', type=float, default=0.0, help='Seconds to wait before answering')
+    parser.add_argument('--days', type=int, default=30, help='Game dates listed per season by /games')
+    parser.add_argument('--rate_limit', type=int, help='Requests per minute before answering 429')
+    return parser.parse_args()
+
+def season_games(fixture, season, days):
+    # One /games record per fixture game per synthetic date
+    start = datetime.date(season, 10, 24)
+    games = []
+    for day in range(days):
+        date = (start + datetime.timedelta(days=day)).isoformat()
+        for i, game in enumerate(fixture['data']):
+            games.append({
+                'id': season * 100000 + day * 100 + i,
+                'date': date,
+                'season': season,
+                'status': game['status'],
+                'home_team_score': game['home_team_score'],
+                'visitor_team_score': game['visitor_team_score'],
+                # Teams without their players, as the real /games nests them
+                'home_team': {key: value for key, value in game['home_team'].items() if key != 'players'},
+                'visitor_team': {key: value for key, value in game['visitor_team'].items() if key != 'players'},
+            })
+    return games
+
+def games_page(fixture, query, days):
+    seasons = [int(season) for season in query.get('seasons[]', [])]
+    dates = query.get('dates[]', [])
+    per_page = int(query.get('per_page', [25])[0])
+    offset = int(query.get('cursor', [0])[0])
+    # A date can only belong to the season starting that year or the year before
+    seasons += [int(date[:4]) - back for date in dates for back in (0, 1)]
+    games = [game for season in seasons for game in season_games(fixture, season, days)
+             if not dates or game['date'] in dates]
+    page = games[offset:offset + per_page]
+    meta = {'per_page': per_page}
+    if offset + per_page < len(games):
+        meta['next_cursor'] = offset + per_page
+    return {'data': page, 'meta': meta}
+
+def box_scores_page(fixture, query):
+    date = query.get('date', [None])[0]
+    payload = copy.deepcopy(fixture)
+    for game in payload['data']:
+        game['date'] = date or game['date']
+        # Seasons start in the fall
+        year, month = int(game['date'][:4]), int(game['date'][5:7])
+        game['season'] = year if month >= 9 else year - 1
+    return payload
+
+class RateLimiter:
+    """
+    Requests per sliding minute, like the API's per-key limit.
+    """
+
+    def __init__(self, limit):
+        self.limit = limit
+        self.times = deque()
+        self.lock = Lock()
+
+    def retry_after(self):
+        # 0 if the request is allowed, otherwise the whole seconds until it would be
+        with self.lock:
+            now = time.monotonic()
+            while self.times and self.times[0] <= now - 60:
+                self.times.popleft()
+            if len(self.times) < self.limit:
+                self.times.append(now)
+                return 0
+            return int(self.times[0] + 60 - now) + 1
+
+def make_handler(fixture, latency, days, rate_limit=None):
+    limiter = RateLimiter(rate_limit) if rate_limit else None
+
+    class MockHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            wait = limiter.retry_after() if limiter else 0
+            if wait:
+                self.send_response(429)
+                self.send_header('Retry-After', str(wait))
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+                return
+            url = urlparse(self.path)
+            query = parse_qs(url.query)
+            if url.path.endswith('/box_scores'):
+                payload = box_scores_page(fixture, query)
+            elif url.path.endswith('/games'):
+                payload = games_page(fixture, query, days)
+            else:
+                self.send_error(404)
+                return
+            body = json.dumps(payload).encode()
+            time.sleep(latency)
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    return MockHandler
+
+def serve(port=8000, fixture=FIXTURE, latency=0.0, days=30, rate_limit=None):
+    """
+    Builds the mock server; call serve_forever() on the result.
+
+    Args:
+        port (int): The port to listen on, 0 for any free port.
+        fixture (str): Path to a saved /box_scores response.
+        latency (float): Seconds to wait before answering each request.
+        days (int): Game dates listed per season by /games.
+        rate_limit (int): Requests per minute before answering 429, None for no limit.
+    """
+    with open(fixture) as f:
+        payload = json.load(f)
+    return ThreadingHTTPServer(('127.0.0.1', port), make_handler(payload, latency, days, rate_limit))
+
+if __name__ == '__main__':
+    args = parse_args()
+    server = serve(args.port, args.fixture, args.latency, args.days, args.rate_limit)
+    print(f"Serving mock API on http://127.0.0.1:{server.server_address[1]}/v1")
+    server.serve_forever()
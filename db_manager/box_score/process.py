@@ -1,117 +1,157 @@
-import time
-from queue import Queue, Empty
-from threading import Thread, Lock
+import json
 from tqdm import tqdm
-from api import make_request
-from database import batch_insert
-
+from api import make_raw_request
+from database import BulkLoader
+import columnar
+from get_dates import lookup_game_id
+from metrics import metrics
+from flow import EMPTY, RetryLater
+
+# Dates given up on after their last attempt
 error_dates = []
-game_id_counter = 1
-counter_lock = Lock()
+
+# Seconds a worker holding a partial batch waits for another date before flushing it
+FLUSH_AFTER = 2
 
 def none_to_zero(value):
     return 0 if value is None else value
 
-def none_to_missing(value):
-    return "missing" if value == '' else value
-
-def process_date(date):
-    global game_id_counter
-
+def parse_minutes(value):
+    # The API reports minutes as 'mm' or 'mm:ss'
+    if not value:
+        return 0
+    min_parts = value.split(":")
+    return int(min_parts[0]) + (int(min_parts[1]) / 60 if len(min_parts) == 2 else 0)
+
+def parse_box_scores(data):
+    # Flattens one /box_scores payload into the five record lists, keyed by
+    # the API's own game ids so reruns never duplicate a game
+    player_records = []
+    game_records = []
+    player_game_records = []
+    player_team_records = []
+    team_game_records = []
+
+    for game in data['data']:
+        local_game_id = lookup_game_id(game['date'], game['home_team']['id'])
+        game_record = (
+            local_game_id, game['date'], game['season'], game['home_team_score'], 
+            game['visitor_team_score'], game['home_team']['id'], game['visitor_team']['id']
+        )
+        game_records.append(game_record)
+
+        for team in ['home_team', 'visitor_team']:
+            for player in game[team]['players']:
+                player_record = (
+                    player['player']['id'], player['player']['first_name'], player['player']['last_name'], 
+                    player['player']['position'], player['player']['height'], player['player']['weight'], 
+                    player['player']['jersey_number'], player['player']['college'], player['player']['country'],
+                    none_to_zero(player['player']['draft_year']), none_to_zero(player['player']['draft_round']),none_to_zero(player['player']['draft_number'])
+                )
+                player_records.append(player_record)
+
+                min_played = parse_minutes(player['min'])
+
+                player_game_record = (
+                    player['player']['id'], local_game_id, min_played, 
+                    none_to_zero(player['fgm']), none_to_zero(player['fga']), none_to_zero(player['fg_pct']), none_to_zero(player['fg3m']), 
+                    none_to_zero(player['fg3a']), none_to_zero(player['fg3_pct']), none_to_zero(player['ftm']), none_to_zero(player['fta']), 
+                    none_to_zero(player['ft_pct']), none_to_zero(player['oreb']), none_to_zero(player['dreb']), none_to_zero(player['reb']), 
+                    none_to_zero(player['ast']), none_to_zero(player['stl']), none_to_zero(player['blk']), none_to_zero(player['turnover']), 
+                    none_to_zero(player['pf']), none_to_zero(player['pts']), game['season'], game['date']
+                )
+                player_game_records.append(player_game_record)
+
+                player_team_record = (player['player']['id'], game[team]['id'])
+                player_team_records.append(player_team_record)
+
+            team_game_record = (game[team]['id'], local_game_id)
+            team_game_records.append(team_game_record)
+
+    return player_records, game_records, player_game_records, player_team_records, team_game_records
+
+def load_date(date, decoder='tuples'):
+    # Fetches and decodes one date: its five record lists (or columns, with the
+    # columnar decoder). Raises flow.RetryLater when the API asks to try again.
     params = {
         "date": date,
     }
-    try:
-        data = make_request(params)
-        player_records = []
-        game_records = []
-        player_game_records = []
-        player_team_records = []
-        team_game_records = []
-
-        with counter_lock:
-            local_game_id = game_id_counter
-
-        for game in data['data']:
-            game_record = (
-                local_game_id, game['date'], game['season'], game['home_team_score'], 
-                game['visitor_team_score'], game['home_team']['id'], game['visitor_team']['id']
-            )
-            game_records.append(game_record)
-
-            for team in ['home_team', 'visitor_team']:
-                for player in game[team]['players']:
-                    player_record = (
-                        player['player']['id'], player['player']['first_name'], player['player']['last_name'], 
-                        player['player']['position'], player['player']['height'], player['player']['weight'], 
-                        player['player']['jersey_number'], player['player']['college'], player['player']['country'],
-                        none_to_zero(player['player']['draft_year']), none_to_zero(player['player']['draft_round']),none_to_zero(player['player']['draft_number'])
-                    )
-                    player_records.append(player_record)
-
-                    min_played = player['min']
-                    if min_played is None:
-                        min_played = 0
-                    else:
-                        min_parts = min_played.split(":")
-                        min_played = int(min_parts[0]) + int(min_parts[1]) / 60 if len(min_parts) == 2 else 0
-
-                    player_game_record = (
-                        player['player']['id'], local_game_id, min_played, 
-                        none_to_zero(player['fgm']), none_to_zero(player['fga']), none_to_zero(player['fg_pct']), none_to_zero(player['fg3m']), 
-                        none_to_zero(player['fg3a']), none_to_zero(player['fg3_pct']), none_to_zero(player['ftm']), none_to_zero(player['fta']), 
-                        none_to_zero(player['ft_pct']), none_to_zero(player['oreb']), none_to_zero(player['dreb']), none_to_zero(player['reb']), 
-                        none_to_zero(player['ast']), none_to_zero(player['stl']), none_to_zero(player['blk']), none_to_zero(player['turnover']), 
-                        none_to_zero(player['pf']), none_to_zero(player['pts'])
-                    )
-                    player_game_records.append(player_game_record)
-
-                    player_team_record = (player['player']['id'], game[team]['id'])
-                    player_team_records.append(player_team_record)
-
-                team_game_record = (game[team]['id'], local_game_id)
-                team_game_records.append(team_game_record)
-
-            with counter_lock:
-                game_id_counter += 1
-                local_game_id = game_id_counter
-        
-        return player_records, game_records, player_game_records, player_team_records, team_game_records
-    except Exception as e:
-        print(f"Error processing date {date}: {e}")
-        error_dates.append(date)  # Add date to the error list
-        return [], [], [], [], []
-
-def worker(queue, progress_bar, num_workers):
+    with metrics.timer('process_date_seconds'):
+        body = make_raw_request(params)
+        with metrics.timer('decode_seconds', decoder=decoder):
+            if decoder == 'columnar':
+                return columnar.decode(body)
+            return parse_box_scores(json.loads(body))
+
+def add_to_loader(loader, date, records, decoder):
+    # Returns the dates of a batch that failed to insert, if this add flushed one
+    if decoder == 'columnar':
+        return loader.add_columns(date, records)
+    return loader.add(date, *records)
+
+def reschedule(queue, date, delay=None):
+    # Puts a failed date back in the queue, or gives up on it after its last attempt
+    if queue.retry(date, delay):
+        metrics.inc('date_retries_total')
+    else:
+        tqdm.write(f"Giving up on date {date}")
+        metrics.inc('date_errors_total')
+        error_dates.append(date)
+
+def worker(queue, progress_bar, batch_size=1, method='copy', decoder='tuples'):
+    """
+    Fetches, decodes and loads dates from a flow.RetryQueue (or a
+    work_queue.WorkQueue shared with other processes) until it is done.
+
+    A date only counts as done once its batch is committed. Dates whose
+    request or insert failed are rescheduled in the queue, and a partial
+    batch is flushed whenever no date comes due for FLUSH_AFTER seconds.
+    """
+    loader = BulkLoader(batch_size, method)
+    pending = []
+
+    def finish(failed):
+        # Settles the dates of the batch that was just flushed
+        failed = set(failed)
+        for date in pending:
+            if date in failed:
+                reschedule(queue, date)
+            else:
+                progress_bar.update(1)
+                metrics.inc('dates_processed_total')
+        queue.task_done(pending)
+        pending.clear()
+
     while True:
-        try:
-            date = queue.get_nowait()
-            player_records, game_records, player_game_records, player_team_records, team_game_records = process_date(date)
-            if player_records or game_records or player_game_records or player_team_records or team_game_records:
-                batch_insert(player_records, game_records, player_game_records, player_team_records, team_game_records)
-            queue.task_done()
-            progress_bar.update(1)
-            # Add a delay to respect the rate limit
-            time.sleep(1 / ((300 / 60) / num_workers)) # Makes at most 300 requests per minute.
-        except Empty:
+        with metrics.timer('queue_wait_seconds', queue='dates'):
+            date = queue.get(FLUSH_AFTER if pending else None)
+        if date is None:
             break
+        if date is EMPTY:
+            finish(loader.flush())
+            continue
+        try:
+            records = load_date(date, decoder)
+        except RetryLater as e:
+            reschedule(queue, date, e.delay)
+            queue.task_done([date])
+            continue
+        except Exception as e:
+            tqdm.write(f"Error processing date {date}: {e}")
+            reschedule(queue, date)
+            queue.task_done([date])
+            continue
+
+        # Dates without games are still added so that they get checkpointed
+        pending.append(date)
+        try:
+            failed = add_to_loader(loader, date, records, decoder)
         except Exception as e:
-            print(f"Error in worker: {e}")
-
-# Function to reprocess error dates
-def reprocess_error_dates(num_workers):
-    queue = Queue()
-    for date in error_dates:
-        queue.put(date)
-    
-    threads = []
-    with tqdm(total=len(error_dates), desc="Reprocessing errors") as pbar:
-        for _ in range(num_workers):  # Number of worker threads
-            t = Thread(target=worker, args=(queue, pbar, num_workers))
-            t.start()
-            threads.append(t)
-        
-        queue.join()
-
-        for t in threads:
-            t.join()
+            tqdm.write(f"Error in worker: {e}")
+            pending.remove(date)
+            reschedule(queue, date)
+            queue.task_done([date])
+            continue
+        # The add flushed the batch
+        if not loader.dates:
+            finish(failed)
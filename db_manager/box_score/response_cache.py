@@ -0,0 +1,163 @@
+"""
+On-disk cache of raw balldontlie responses.
+
+Each response body is stored gzip-compressed under a name derived from a hash
+of the endpoint and its query parameters. A file's mtime records when it was
+fetched and its atime when it was last read, which is all the expiry and
+eviction rules need:
+
+- /box_scores for a date fetched after that date was over never expires;
+  anything fetched on the day itself (or for a future date) is refetched.
+- /games for a season fetched after that season ended never expires; the
+  current season's pages are kept for GAMES_TTL seconds.
+- Once the cache grows past max_bytes, the least recently read files are
+  removed first.
+"""
+
+import datetime
+import gzip
+import hashlib
+import json
+import os
+import time
+from threading import Lock
+
+CACHE_DIR = os.getenv("CACHE_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), '.cache'))
+CACHE_MAX_BYTES = int(os.getenv("CACHE_MAX_MB", "2048")) * 1024 * 1024
+
+# How long after midnight of a game date its box scores count as final.
+# Late west-coast games finish after midnight Eastern.
+FINAL_AFTER = datetime.timedelta(days=1, hours=12)
+
+# Lifetime of /games pages for a season still in progress
+GAMES_TTL = 6 * 60 * 60
+
+def season_end(season):
+    # A season starting in the fall of `season` is over by September of the next year
+    return datetime.datetime(season + 1, 9, 1)
+
+def finalized_at(params):
+    """
+    Returns the moment after which a response for these parameters can no
+    longer change, or None if it may change at any time.
+    """
+    date = params.get('date', params.get('dates[]'))
+    if date is not None:
+        date = datetime.datetime.strptime(str(date), '%Y-%m-%d')
+        return date + FINAL_AFTER
+    if 'seasons[]' in params:
+        return season_end(int(params['seasons[]']))
+    return None
+
+def is_final_date(date):
+    # Whether a date's games are all over, so its box scores can no longer change
+    return datetime.datetime.now() >= finalized_at({'date': date})
+
+class ResponseCache:
+    """
+    A size-bounded, gzip-compressed response cache keyed by endpoint and params.
+    """
+
+    def __init__(self, directory=CACHE_DIR, max_bytes=CACHE_MAX_BYTES):
+        """
+        Args:
+            directory (str): Root directory of the cache.
+            max_bytes (int): Total compressed size to stay under.
+        """
+        self.directory = os.path.join(directory, 'responses')
+        self.max_bytes = max_bytes
+        self.enabled = True
+        self.size = None
+        self.lock = Lock()
+
+    def path(self, endpoint, params):
+        key = json.dumps([endpoint, sorted((k, str(v)) for k, v in params.items())])
+        digest = hashlib.sha256(key.encode()).hexdigest()
+        return os.path.join(self.directory, digest[:2], f"{digest}.json.gz")
+
+    def is_fresh(self, params, fetched, now):
+        final = finalized_at(params)
+        if final is None:
+            return False
+        if datetime.datetime.fromtimestamp(fetched) >= final:
+            return True
+        if 'seasons[]' in params:
+            return now - fetched < GAMES_TTL
+        return False
+
+    def get(self, endpoint, params):
+        """
+        Returns the cached body, or None on a miss or an expired entry.
+        """
+        if not self.enabled:
+            return None
+        path = self.path(endpoint, params)
+        try:
+            stat = os.stat(path)
+            now = time.time()
+            if not self.is_fresh(params, stat.st_mtime, now):
+                return None
+            with gzip.open(path, 'rb') as f:
+                body = f.read()
+            # Record the read for LRU eviction, keeping the fetch time in mtime
+            os.utime(path, (now, stat.st_mtime))
+            return body
+        except (OSError, EOFError):
+            return None
+
+    def put(self, endpoint, params, body):
+        """
+        Stores a response body unless it is for a date that is not final yet.
+        """
+        if not self.enabled:
+            return
+        final = finalized_at(params)
+        if final is None or ('seasons[]' not in params and datetime.datetime.now() < final):
+            return
+        path = self.path(endpoint, params)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        data = gzip.compress(body, compresslevel=6)
+        tmp = f"{path}.{os.getpid()}.{id(data)}.tmp"
+        with open(tmp, 'wb') as f:
+            f.write(data)
+        os.replace(tmp, path)
+        with self.lock:
+            if self.size is None:
+                self.size = self.disk_usage()
+            else:
+                self.size += len(data)
+            if self.size > self.max_bytes:
+                self.evict()
+
+    def disk_usage(self):
+        total = 0
+        for root, _, files in os.walk(self.directory):
+            for name in files:
+                total += os.path.getsize(os.path.join(root, name))
+        return total
+
+    def evict(self):
+        # Removes least recently read entries until 90% of max_bytes is left
+        entries = []
+        for root, _, files in os.walk(self.directory):
+            for name in files:
+                path = os.path.join(root, name)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                entries.append((stat.st_atime, stat.st_size, path))
+        entries.sort()
+        self.size = sum(size for _, size, _ in entries)
+        target = self.max_bytes * 0.9
+        for _, size, path in entries:
+            if self.size <= target:
+                break
+            try:
+                os.remove(path)
+                self.size -= size
+            except OSError:
+                pass
+
+# Shared by api.make_request and get_dates.make_request
+cache = ResponseCache()
@@ -0,0 +1,226 @@
+"""
+Incremental maintenance of player_rolling_stats.
+
+The table holds one row per player and window: stat totals over the player's
+last 5 and last 10 games, and over their latest season (window_size 0).
+update_rolling() runs inside the ingest transaction and only touches players
+whose games were in the batch:
+
+- If all of a player's new games are later than the window's last_date, the
+  new games are added to the totals and the games that fell out of the window
+  are subtracted. For the season window, the new games must also belong to
+  the stored season.
+- Otherwise (first games of a player, a re-ingested or late date, a new
+  season), that player's window is recomputed from at most `window` games,
+  or one season of games.
+
+Averages are totals / games; player_rolling_avg does the division. To fill the
+table for a database loaded before it existed, run from db_manager/box_score:
+python rolling.py --rebuild
+"""
+
+import argparse
+from psycopg2.extras import execute_values
+
+# Window sizes maintained, in games; 0 is the player's latest season
+WINDOWS = (5, 10, 0)
+
+# player_game columns kept as totals. Percentages are derived from makes and attempts.
+STATS = ('min', 'fgm', 'fga', 'fg3m', 'fg3a', 'ftm', 'fta', 'oreb', 'dreb', 'reb', 'ast', 'stl', 'blk',
+         'turnover', 'pf', 'pts')
+
+# (player_id, game_id) of every player_game row in the batch being committed
+batch_create_query = """
+CREATE TEMP TABLE IF NOT EXISTS rolling_batch (player_id INT, game_id INT) ON COMMIT DELETE ROWS;
+"""
+
+batch_insert_query = """
+INSERT INTO rolling_batch (player_id, game_id) VALUES %s;
+"""
+
+batch_from_stage_query = """
+INSERT INTO rolling_batch (player_id, game_id) SELECT player_id, game_id FROM player_game_stage;
+"""
+
+batch_truncate_query = """
+TRUNCATE rolling_batch;
+"""
+
+# Concurrent ingest transactions touch the same players, so the updates are
+# serialized; the lock is held until commit
+rolling_lock_query = """
+SELECT pg_advisory_xact_lock(hashtext('player_rolling_stats'));
+"""
+
+def stat_list(template):
+    return ', '.join(template.format(stat=stat) for stat in STATS)
+
+# New games of players whose stored window can be extended in place. A player
+# only qualifies when every batch game is later than the window's last game.
+new_games_cte = f"""
+new_games AS (
+    SELECT b.player_id, pg.game_date AS date, pg.season, {stat_list('pg.{stat}')}
+    FROM (SELECT DISTINCT player_id, game_id FROM rolling_batch) b
+    JOIN player_game pg ON pg.player_id = b.player_id AND pg.game_id = b.game_id
+),
+appended AS (
+    SELECT n.player_id, COUNT(*) AS k, MAX(n.date) AS last_date, MAX(n.season) AS season, {stat_list('SUM(n.{stat}) AS {stat}')}
+    FROM new_games n
+    JOIN player_rolling_stats r ON r.player_id = n.player_id AND r.window_size = %(window)s
+    GROUP BY n.player_id, r.last_date, r.season
+    HAVING MIN(n.date) > r.last_date {{season_check}}
+)"""
+
+# Last-N window: add the k new games, subtract the games now ranked N+1..N+k,
+# which were the oldest k of the previous window
+window_append_query = f"""
+WITH {new_games_cte.format(season_check='')},
+dropped AS (
+    SELECT a.player_id, {stat_list('COALESCE(SUM(d.{stat}), 0) AS {stat}')}
+    FROM appended a
+    LEFT JOIN LATERAL (
+        SELECT {stat_list('pg.{stat}')}
+        FROM player_game pg
+        WHERE pg.player_id = a.player_id
+        ORDER BY pg.season DESC, pg.game_date DESC
+        OFFSET %(window)s LIMIT a.k
+    ) d ON TRUE
+    GROUP BY a.player_id
+)
+UPDATE player_rolling_stats r
+SET games = LEAST(r.games + a.k, %(window)s), last_date = a.last_date,
+    season = a.season,
+    {stat_list('{stat} = r.{stat} + a.{stat} - d.{stat}')}
+FROM appended a
+JOIN dropped d ON d.player_id = a.player_id
+WHERE r.player_id = a.player_id AND r.window_size = %(window)s
+RETURNING r.player_id;
+"""
+
+# Season window: add the new games while they are in the stored season
+season_append_query = f"""
+WITH {new_games_cte.format(season_check='AND MIN(n.season) = r.season AND MAX(n.season) = r.season')}
+UPDATE player_rolling_stats r
+SET games = r.games + a.k, last_date = a.last_date,
+    {stat_list('{stat} = r.{stat} + a.{stat}')}
+FROM appended a
+WHERE r.player_id = a.player_id AND r.window_size = %(window)s
+RETURNING r.player_id;
+"""
+
+upsert_clause = f"""
+ON CONFLICT (player_id, window_size) DO UPDATE SET
+    season = EXCLUDED.season, games = EXCLUDED.games, last_date = EXCLUDED.last_date,
+    {stat_list('{stat} = EXCLUDED.{stat}')};
+"""
+
+# Recomputes the last-N window of the batch's players not handled by the append
+window_recompute_query = f"""
+INSERT INTO player_rolling_stats (player_id, window_size, season, games, last_date, {stat_list('{stat}')})
+SELECT p.player_id, %(window)s, MAX(h.season), COUNT(*), MAX(h.date), {stat_list('SUM(h.{stat})')}
+FROM (SELECT DISTINCT player_id FROM rolling_batch WHERE player_id <> ALL(%(done)s)) p
+CROSS JOIN LATERAL (
+    SELECT pg.game_date AS date, pg.season, {stat_list('pg.{stat}')}
+    FROM player_game pg
+    WHERE pg.player_id = p.player_id
+    ORDER BY pg.season DESC, pg.game_date DESC
+    LIMIT %(window)s
+) h
+GROUP BY p.player_id
+{upsert_clause}"""
+
+# Recomputes the latest-season window of the batch's players not handled by the append
+season_recompute_query = f"""
+INSERT INTO player_rolling_stats (player_id, window_size, season, games, last_date, {stat_list('{stat}')})
+SELECT p.player_id, %(window)s, s.season, COUNT(*), MAX(pg.game_date), {stat_list('SUM(pg.{stat})')}
+FROM (SELECT DISTINCT player_id FROM rolling_batch WHERE player_id <> ALL(%(done)s)) p
+CROSS JOIN LATERAL (
+    SELECT MAX(pg.season) AS season FROM player_game pg WHERE pg.player_id = p.player_id
+) s
+JOIN player_game pg ON pg.player_id = p.player_id AND pg.season = s.season
+GROUP BY p.player_id, s.season
+{upsert_clause}"""
+
+# Per-game averages of a set of players, a primary-key lookup
+board_query = """
+SELECT * FROM player_rolling_avg WHERE player_id = ANY(%(players)s) AND window_size = %(window)s;
+"""
+
+def stage_batch(cur, records=None):
+    """
+    Records which player games the current transaction inserts. Pass the
+    player_game record tuples on the executemany path; without records the
+    rows are taken from the COPY path's player_game_stage table.
+    """
+    cur.execute(batch_create_query)
+    if records is None:
+        cur.execute(batch_from_stage_query)
+    elif records:
+        execute_values(cur, batch_insert_query, [record[:2] for record in records])
+
+def update_rolling(cur):
+    """
+    Folds the staged batch into player_rolling_stats. Must run after the
+    batch's player_game rows are in place, in the same transaction. Does not
+    commit.
+    """
+    cur.execute(batch_create_query)
+    cur.execute(rolling_lock_query)
+    for window in WINDOWS:
+        append, recompute = ((window_append_query, window_recompute_query) if window
+                             else (season_append_query, season_recompute_query))
+        cur.execute(append, {'window': window})
+        done = [player_id for (player_id,) in cur.fetchall()]
+        cur.execute(recompute, {'window': window, 'done': done})
+    cur.execute(batch_truncate_query)
+
+def rolling_averages(cur, player_ids, window=10):
+    """
+    Looks up the rolling averages of a set of players, e.g. everyone on the board.
+
+    Args:
+        cur: An open cursor.
+        player_ids (list): The players to look up.
+        window (int): 5, 10, or 0 for the latest season.
+
+    Returns:
+        dict: player_id -> row of player_rolling_avg as a dict.
+    """
+    cur.execute(board_query, {'players': list(player_ids), 'window': window})
+    names = [column.name for column in cur.description]
+    return {row[0]: dict(zip(names, row)) for row in cur.fetchall()}
+
+def rebuild_table(cur):
+    """
+    Recomputes player_rolling_stats from everything in player_game, e.g. after
+    a bulk load that bypassed ingest. Does not commit.
+
+    Returns:
+        int: The number of rolling rows.
+    """
+    cur.execute("TRUNCATE player_rolling_stats;")
+    cur.execute(batch_create_query)
+    cur.execute("INSERT INTO rolling_batch (player_id, game_id) SELECT player_id, MIN(game_id) "
+                "FROM player_game GROUP BY player_id;")
+    update_rolling(cur)
+    cur.execute("SELECT COUNT(*) FROM player_rolling_stats;")
+    return cur.fetchone()[0]
+
+def rebuild():
+    # One-off fill from everything in player_game, in a single transaction
+    from database import get_connection
+    with get_connection() as conn:
+        with conn.cursor() as cur:
+            rows = rebuild_table(cur)
+        conn.commit()
+    print(f"Rebuilt {rows} rolling rows.")
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Maintenance of player_rolling_stats")
+    parser.add_argument('--rebuild', action='store_true', help='Recompute the whole table from player_game')
+    return parser.parse_args()
+
+if __name__ == '__main__':
+    args = parse_args()
+    if args.rebuild:
+        rebuild()
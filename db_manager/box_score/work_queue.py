@@ -0,0 +1,240 @@
+"""
+A durable queue of dates to ingest, shared by any number of main.py processes
+on any number of hosts through the ingest_queue table (db_manager/create_db.py).
+
+Each process (a node) claims one date at a time with SELECT ... FOR UPDATE
+SKIP LOCKED, so nodes never wait on each other's rows, and holds it under a
+lease that a heartbeat thread renews every LEASE / 3 seconds. A date whose
+batch committed is marked done; a failed one goes back to pending with
+backoff, or is marked failed after MAX_ATTEMPTS. If a node dies, its leases
+expire and the other nodes reclaim them, counting it as an attempt. Inserts
+are idempotent, so a date that a stalled node finishes after losing its lease
+is merely loaded twice.
+
+The heartbeat also records the node in ingest_node with its worker count, and
+sets the node's pacing to its share of the API rate limit, in proportion to
+the workers of the nodes alive.
+
+WorkQueue has the interface of flow.RetryQueue, so process.worker runs on
+either. To run a node, execute the following command from db_manager/box_score
+on each host:
+python main.py --start_year 2014 --end_year 2023 --queue postgres
+"""
+
+import os
+import socket
+import time
+from threading import Event, Thread
+from database import get_connection
+from flow import EMPTY, MAX_ATTEMPTS, backoff, controller, jittered
+from metrics import metrics
+
+# Seconds a lease lasts without a heartbeat
+LEASE = 60
+
+# Seconds between claims while nothing is due
+POLL_INTERVAL = 1.0
+
+enqueue_query = """
+INSERT INTO ingest_queue (date) VALUES (%(date)s)
+ON CONFLICT (date) DO UPDATE SET status = 'pending', attempts = 0, not_before = now(), updated_at = now()
+WHERE ingest_queue.status = 'failed' OR (%(requeue)s AND ingest_queue.status = 'done');
+"""
+
+# Due retries come before new dates, as in flow.RetryQueue
+claim_query = """
+UPDATE ingest_queue q
+SET status = 'leased', lease_owner = %(node)s, lease_expires = now() + %(lease)s * interval '1 second',
+    attempts = q.attempts + (q.status = 'leased')::int, updated_at = now()
+FROM (
+    SELECT date FROM ingest_queue
+    WHERE (status = 'pending' AND not_before <= now()) OR (status = 'leased' AND lease_expires < now())
+    ORDER BY attempts DESC, not_before, date
+    LIMIT 1
+    FOR UPDATE SKIP LOCKED
+) due
+WHERE q.date = due.date
+RETURNING q.date, q.attempts;
+"""
+
+retry_query = """
+UPDATE ingest_queue
+SET status = %(status)s, attempts = attempts + 1, not_before = now() + %(delay)s * interval '1 second',
+    lease_owner = NULL, lease_expires = NULL, updated_at = now()
+WHERE date = %(date)s AND status = 'leased' AND lease_owner = %(node)s;
+"""
+
+done_query = """
+UPDATE ingest_queue SET status = 'done', lease_owner = NULL, lease_expires = NULL, updated_at = now()
+WHERE date = ANY(%(dates)s::date[]) AND status = 'leased' AND lease_owner = %(node)s;
+"""
+
+unfinished_query = """
+SELECT count(*) FROM ingest_queue WHERE status IN ('pending', 'leased');
+"""
+
+renew_query = """
+UPDATE ingest_queue SET lease_expires = now() + %(lease)s * interval '1 second'
+WHERE status = 'leased' AND lease_owner = %(node)s;
+"""
+
+heartbeat_query = """
+INSERT INTO ingest_node (node_id, workers, heartbeat_at) VALUES (%(node)s, %(workers)s, now())
+ON CONFLICT (node_id) DO UPDATE SET workers = EXCLUDED.workers, heartbeat_at = now();
+"""
+
+live_workers_query = """
+SELECT COALESCE(sum(workers), 0) FROM ingest_node WHERE heartbeat_at > now() - %(lease)s * interval '1 second';
+"""
+
+leave_query = """
+UPDATE ingest_queue SET status = 'pending', lease_owner = NULL, lease_expires = NULL, updated_at = now()
+WHERE status = 'leased' AND lease_owner = %(node)s;
+DELETE FROM ingest_node WHERE node_id = %(node)s;
+"""
+
+def execute(query, params, fetch=False):
+    # One statement in its own transaction on a pooled connection
+    with get_connection() as conn:
+        try:
+            with conn.cursor() as cur:
+                cur.execute(query, params)
+                rows = cur.fetchall() if fetch else cur.rowcount
+            conn.commit()
+            return rows
+        except Exception:
+            conn.rollback()
+            raise
+
+class WorkQueue:
+    """
+    Dates leased from the ingest_queue table, for process.worker.
+    """
+
+    def __init__(self, workers, rate_limit, node_id=None, lease=LEASE, max_attempts=MAX_ATTEMPTS, requeue=False):
+        """
+        Args:
+            workers (int): This node's worker threads, its weight in the rate limit.
+            rate_limit (int): Requests per minute allowed across all nodes.
+            node_id (str): Identifies the node's leases; defaults to host:pid.
+            lease (int): Seconds a lease lasts without a heartbeat.
+            max_attempts (int): Attempts per date before it is marked failed.
+            requeue (bool): Let put() requeue dates an earlier run marked done.
+        """
+        self.workers = workers
+        self.rate_limit = rate_limit
+        self.node_id = node_id or f"{socket.gethostname()}:{os.getpid()}"
+        self.lease = lease
+        self.max_attempts = max_attempts
+        self.requeue = requeue
+        # Attempts of the dates this node holds, as of their claim
+        self.attempts = {}
+        self.closed = False
+        self.stop_event = Event()
+        self.heartbeat()
+        self.beater = Thread(target=self.beat, daemon=True)
+        self.beater.start()
+
+    def heartbeat(self):
+        """
+        Renews this node's leases and sets its share of the rate limit.
+
+        Returns:
+            float: The requests per minute this node may make.
+        """
+        params = {'node': self.node_id, 'workers': self.workers, 'lease': self.lease}
+        execute(heartbeat_query, params)
+        execute(renew_query, params)
+        total = execute(live_workers_query, params, fetch=True)[0][0]
+        share = self.rate_limit * self.workers / max(total, self.workers)
+        controller.set_rate(share)
+        return share
+
+    def beat(self):
+        while not self.stop_event.wait(self.lease / 3):
+            try:
+                self.heartbeat()
+            except Exception as e:
+                print(f"Error renewing leases: {e}")
+                metrics.inc('lease_errors_total')
+
+    def put(self, date):
+        # Enqueues a date; dates already queued keep their state unless they failed
+        execute(enqueue_query, {'date': date, 'requeue': self.requeue})
+
+    def close(self):
+        # This node will put no more dates
+        self.closed = True
+
+    def claim(self):
+        # Leases the next due date, or returns None if none is due
+        rows = execute(claim_query, {'node': self.node_id, 'lease': self.lease}, fetch=True)
+        if not rows:
+            return None
+        date, attempts = rows[0]
+        date = date.isoformat()
+        if attempts >= self.max_attempts:
+            # A lease that expired on its last attempt
+            execute(retry_query, {'status': 'failed', 'delay': 0, 'date': date, 'node': self.node_id})
+            metrics.inc('date_errors_total', stage='lease')
+            return self.claim()
+        self.attempts[date] = attempts
+        metrics.inc('leases_claimed_total', reclaimed=str(attempts > 0).lower())
+        return date
+
+    def get(self, timeout=None):
+        """
+        The next date to work on, which the caller must finish with task_done().
+
+        Args:
+            timeout (float): Give up waiting after this many seconds, None to wait.
+
+        Returns:
+            The date; None once this node is closed and no date is pending or
+            leased on any node; EMPTY if the timeout passed first.
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            date = self.claim()
+            if date is not None:
+                return date
+            if self.closed and not execute(unfinished_query, None, fetch=True)[0][0]:
+                return None
+            now = time.monotonic()
+            if deadline is not None and now >= deadline:
+                return EMPTY
+            time.sleep(POLL_INTERVAL if deadline is None else min(POLL_INTERVAL, deadline - now))
+
+    def retry(self, date, delay=None):
+        """
+        Puts a date that failed back to pending, with backoff. Call before
+        task_done() for it.
+
+        Args:
+            delay (float): The wait the API asked for, or None for the backoff.
+
+        Returns:
+            bool: False if the date has used all its attempts and is now failed.
+        """
+        attempt = self.attempts.pop(date, 0) + 1
+        exhausted = attempt >= self.max_attempts
+        delay = jittered(delay if delay is not None else backoff(attempt))
+        execute(retry_query, {'status': 'failed' if exhausted else 'pending', 'delay': delay,
+                              'date': date, 'node': self.node_id})
+        return not exhausted
+
+    def task_done(self, dates):
+        # Marks the dates this node still holds done; rescheduled ones are no longer held
+        if dates:
+            execute(done_query, {'dates': list(dates), 'node': self.node_id})
+        for date in dates:
+            self.attempts.pop(date, None)
+
+    def leave(self):
+        """
+        Stops the heartbeat, hands back any dates still leased (e.g. after an
+        interrupt) and removes the node from the rate-limit shares.
+        """
+        self.stop_event.set()
+        self.beater.join()
+        execute(leave_query, {'node': self.node_id})
@@ -1,7 +1,10 @@
+import datetime
 import os
+import sys
 from dotenv import load_dotenv
 import psycopg2
 from psycopg2 import sql
+from psycopg2.extras import execute_values
 
 # Load environment variables from .env
 load_dotenv()
@@ -68,9 +71,9 @@ create_game_table = """
 CREATE TABLE IF NOT EXISTS game (
     game_id INT PRIMARY KEY,
     date DATE,
-    season INT,
-    home_team_score INT,
-    visitor_team_score INT,
+    season SMALLINT,
+    home_team_score SMALLINT,
+    visitor_team_score SMALLINT,
     home_team_id INT,
     visitor_team_id INT,
     FOREIGN KEY (home_team_id) REFERENCES team (team_id),
@@ -78,20 +81,84 @@ CREATE TABLE IF NOT EXISTS game (
 );
 """
 
+# player_game is range-partitioned by season, see create_season_partitions. season
+# and game_date are copied from the game so a player's history can be read in
+# date order from one index without joining game.
 create_player_game_table = """
 CREATE TABLE IF NOT EXISTS player_game (
     player_id INT,
     game_id INT,
+    min REAL,
+    fgm SMALLINT,
+    fga SMALLINT,
+    fg_pct REAL,
+    fg3m SMALLINT,
+    fg3a SMALLINT,
+    fg3_pct REAL,
+    ftm SMALLINT,
+    fta SMALLINT,
+    ft_pct REAL,
+    oreb SMALLINT,
+    dreb SMALLINT,
+    reb SMALLINT,
+    ast SMALLINT,
+    stl SMALLINT,
+    blk SMALLINT,
+    turnover SMALLINT,
+    pf SMALLINT,
+    pts SMALLINT,
+    season SMALLINT NOT NULL,
+    game_date DATE,
+    PRIMARY KEY (player_id, game_id, season),
+    FOREIGN KEY (player_id) REFERENCES player (player_id),
+    FOREIGN KEY (game_id) REFERENCES game (game_id)
+) PARTITION BY RANGE (season);
+"""
+
+create_player_team_table = """
+CREATE TABLE IF NOT EXISTS player_team (
+    player_id int,
+    team_id int,
+    PRIMARY KEY (player_id, team_id),
+    FOREIGN KEY (player_id) REFERENCES player (player_id),
+    FOREIGN KEY (team_id) REFERENCES team (team_id)
+);
+"""
+
+create_team_game_table = """
+CREATE TABLE IF NOT EXISTS team_game (
+    team_id int,
+    game_id int,
+    PRIMARY KEY (team_id, game_id),
+    FOREIGN KEY (team_id) REFERENCES team (team_id),
+    FOREIGN KEY (game_id) REFERENCES game (game_id)
+);
+"""
+
+create_ingest_checkpoint_table = """
+CREATE TABLE IF NOT EXISTS ingest_checkpoint (
+    date DATE PRIMARY KEY,
+    games INT,
+    committed_at TIMESTAMPTZ DEFAULT clock_timestamp()
+);
+"""
+
+# Stat totals over each player's last 5 and 10 games and latest season
+# (window_size 0), maintained by box_score/rolling.py during ingest
+create_player_rolling_stats_table = """
+CREATE TABLE IF NOT EXISTS player_rolling_stats (
+    player_id INT,
+    window_size INT,
+    season INT,
+    games INT,
+    last_date DATE,
     min FLOAT,
     fgm INT,
     fga INT,
-    fg_pct FLOAT,
     fg3m INT,
     fg3a INT,
-    fg3_pct FLOAT,
     ftm INT,
     fta INT,
-    ft_pct FLOAT,
     oreb INT,
     dreb INT,
     reb INT,
@@ -101,37 +168,205 @@ CREATE TABLE IF NOT EXISTS player_game (
     turnover INT,
     pf INT,
     pts INT,
-    PRIMARY KEY (player_id, game_id),
-    FOREIGN KEY (player_id) REFERENCES player (player_id),
-    FOREIGN KEY (game_id) REFERENCES game (game_id)
+    PRIMARY KEY (player_id, window_size),
+    FOREIGN KEY (player_id) REFERENCES player (player_id)
 );
 """
 
-create_player_team_table = """
-CREATE TABLE IF NOT EXISTS player_team (
-    player_id int,
-    team_id int,
-    PRIMARY KEY (player_id, team_id),
-    FOREIGN KEY (player_id) REFERENCES player (player_id),
-    FOREIGN KEY (team_id) REFERENCES team (team_id)
+# PrizePicks lines as they change (line_history.py); a NULL prop means the
+# line came off the board
+create_prop_line_history_table = """
+CREATE TABLE IF NOT EXISTS prop_line_history (
+    observed_at TIMESTAMPTZ NOT NULL,
+    name TEXT NOT NULL,
+    type TEXT NOT NULL,
+    payout TEXT NOT NULL,
+    team TEXT,
+    opponent TEXT,
+    prop REAL
 );
+CREATE INDEX IF NOT EXISTS prop_line_history_key_idx ON prop_line_history (name, type, payout, observed_at);
 """
 
-create_team_game_table = """
-CREATE TABLE IF NOT EXISTS team_game (
-    team_id int,
-    game_id int,
-    PRIMARY KEY (team_id, game_id),
-    FOREIGN KEY (team_id) REFERENCES team (team_id),
-    FOREIGN KEY (game_id) REFERENCES game (game_id)
+# Dates to ingest, leased to the main.py processes of a multi-node backfill
+# (box_score/work_queue.py), and the nodes sharing the API rate limit
+create_ingest_queue_table = """
+CREATE TABLE IF NOT EXISTS ingest_queue (
+    date DATE PRIMARY KEY,
+    status TEXT NOT NULL DEFAULT 'pending',
+    attempts INT NOT NULL DEFAULT 0,
+    not_before TIMESTAMPTZ NOT NULL DEFAULT now(),
+    lease_owner TEXT,
+    lease_expires TIMESTAMPTZ,
+    updated_at TIMESTAMPTZ DEFAULT now()
 );
+CREATE INDEX IF NOT EXISTS ingest_queue_status_idx ON ingest_queue (status, not_before);
 """
 
+create_ingest_node_table = """
+CREATE TABLE IF NOT EXISTS ingest_node (
+    node_id TEXT PRIMARY KEY,
+    workers INT NOT NULL,
+    heartbeat_at TIMESTAMPTZ NOT NULL DEFAULT now()
+);
+"""
+
+create_player_rolling_avg_view = """
+CREATE OR REPLACE VIEW player_rolling_avg AS
+SELECT
+    player_id,
+    window_size,
+    season,
+    games,
+    last_date,
+    min::FLOAT / NULLIF(games, 0) AS min,
+    fgm::FLOAT / NULLIF(games, 0) AS fgm,
+    fga::FLOAT / NULLIF(games, 0) AS fga,
+    fg3m::FLOAT / NULLIF(games, 0) AS fg3m,
+    fg3a::FLOAT / NULLIF(games, 0) AS fg3a,
+    ftm::FLOAT / NULLIF(games, 0) AS ftm,
+    fta::FLOAT / NULLIF(games, 0) AS fta,
+    oreb::FLOAT / NULLIF(games, 0) AS oreb,
+    dreb::FLOAT / NULLIF(games, 0) AS dreb,
+    reb::FLOAT / NULLIF(games, 0) AS reb,
+    ast::FLOAT / NULLIF(games, 0) AS ast,
+    stl::FLOAT / NULLIF(games, 0) AS stl,
+    blk::FLOAT / NULLIF(games, 0) AS blk,
+    turnover::FLOAT / NULLIF(games, 0) AS turnover,
+    pf::FLOAT / NULLIF(games, 0) AS pf,
+    pts::FLOAT / NULLIF(games, 0) AS pts,
+    fgm::FLOAT / NULLIF(fga, 0) AS fg_pct,
+    fg3m::FLOAT / NULLIF(fg3a, 0) AS fg3_pct,
+    ftm::FLOAT / NULLIF(fta, 0) AS ft_pct
+FROM player_rolling_stats;
+"""
+
+# Indexes for the common access patterns: a player's history newest first
+# (covering the stats the projections use), a game's box score, games by date
+# and season, and joins from game to team_game
+create_indexes = [
+    "CREATE INDEX IF NOT EXISTS player_game_history_idx ON player_game (player_id, season, game_date) "
+    "INCLUDE (min, fgm, fga, fg3m, fg3a, ftm, fta, oreb, dreb, reb, ast, stl, blk, turnover, pf, pts);",
+    "CREATE INDEX IF NOT EXISTS player_game_game_idx ON player_game (game_id);",
+    "CREATE INDEX IF NOT EXISTS game_date_idx ON game (date);",
+    "CREATE INDEX IF NOT EXISTS game_season_idx ON game (season) INCLUDE (game_id, home_team_score, visitor_team_score);",
+    "CREATE INDEX IF NOT EXISTS team_game_game_idx ON team_game (game_id, team_id);",
+]
+
+# Each partition holds a decade of seasons (player_game_1990 has 1990-1999):
+# few enough partitions that planning a query over all of them stays cheap.
+# The BAA's 1946 season is the earliest in balldontlie; later decades get their
+# partition from the loader (database.ensure_partitions) when their first
+# games arrive. There is no default partition, so a player's latest games are
+# found by reading the partitions newest first and stopping early.
+FIRST_SEASON = 1946
+LAST_SEASON = datetime.date.today().year
+SEASONS_PER_PARTITION = 10
+
+def create_season_partitions(last_season=LAST_SEASON):
+    for start in range(FIRST_SEASON - FIRST_SEASON % SEASONS_PER_PARTITION, last_season + 1, SEASONS_PER_PARTITION):
+        cursor.execute(f"CREATE TABLE IF NOT EXISTS player_game_{start} PARTITION OF player_game "
+                       f"FOR VALUES FROM ({start}) TO ({start + SEASONS_PER_PARTITION});")
+
+# Function to check if a table is partitioned
+def check_table_partitioned(table_name):
+    cursor.execute("SELECT relkind = 'p' FROM pg_class WHERE relname = %s AND relkind IN ('r', 'p');", [table_name])
+    row = cursor.fetchone()
+    return bool(row and row[0])
+
+# Moves a player_game created before partitioning into the partitioned layout,
+# filling season and game_date from game, and shrinks game's columns
+def migrate_player_game():
+    cursor.execute("ALTER TABLE player_game RENAME TO player_game_unpartitioned;")
+    cursor.execute("ALTER INDEX player_game_pkey RENAME TO player_game_unpartitioned_pkey;")
+    cursor.execute(create_player_game_table)
+    cursor.execute("SELECT COALESCE(MAX(season), 0) FROM game;")
+    create_season_partitions(max(LAST_SEASON, cursor.fetchone()[0]))
+    cursor.execute("""
+        INSERT INTO player_game (
+            player_id, game_id, min, fgm, fga, fg_pct, fg3m, fg3a, fg3_pct, ftm, fta, ft_pct, oreb, dreb, reb,
+            ast, stl, blk, turnover, pf, pts, season, game_date
+        )
+        SELECT
+            pg.player_id, pg.game_id, pg.min, pg.fgm, pg.fga, pg.fg_pct, pg.fg3m, pg.fg3a, pg.fg3_pct, pg.ftm,
+            pg.fta, pg.ft_pct, pg.oreb, pg.dreb, pg.reb, pg.ast, pg.stl, pg.blk, pg.turnover, pg.pf, pg.pts,
+            g.season, g.date
+        FROM player_game_unpartitioned pg
+        JOIN game g ON g.game_id = pg.game_id;
+    """)
+    migrated = cursor.rowcount
+    cursor.execute("DROP TABLE player_game_unpartitioned;")
+    cursor.execute("ANALYZE player_game;")
+    cursor.execute("ALTER TABLE game ALTER COLUMN season TYPE SMALLINT, "
+                   "ALTER COLUMN home_team_score TYPE SMALLINT, ALTER COLUMN visitor_team_score TYPE SMALLINT;")
+    return migrated
+
 # Function to check if table exists
 def check_table_exists(table_name):
     cursor.execute(f"SELECT EXISTS (SELECT FROM information_schema.tables WHERE table_name = '{table_name}');")
     return cursor.fetchone()[0]
 
+player_game_columns = ('player_id', 'game_id', 'min', 'fgm', 'fga', 'fg_pct', 'fg3m', 'fg3a', 'fg3_pct', 'ftm', 'fta',
+                       'ft_pct', 'oreb', 'dreb', 'reb', 'ast', 'stl', 'blk', 'turnover', 'pf', 'pts', 'season', 'game_date')
+
+# Games loaded before ingest_checkpoint existed were keyed by a per-run counter
+# rather than the API's ids, so a re-ingest would store each of them again.
+# Looks every game up in /games by (date, home team), as the loader does, and
+# moves it with its player_game and team_game rows to its native id. Where a
+# re-ingest already stored the game under that id, its copy is kept. Returns
+# the number of games moved and the number /games does not list.
+def remap_game_ids():
+    # Imported here so a fresh database needs no API access
+    sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'box_score'))
+    import get_dates
+    import rolling
+
+    # Listing whole seasons first takes a request per 100 games, not one per date
+    cursor.execute("SELECT DISTINCT season FROM game ORDER BY season;")
+    for (season,) in cursor.fetchall():
+        for _ in get_dates.iter_season_dates(season):
+            pass
+
+    cursor.execute("SELECT game_id, date, home_team_id FROM game;")
+    moves, missing = [], 0
+    for game_id, date, home_team_id in cursor.fetchall():
+        try:
+            native_id = get_dates.lookup_game_id(date.isoformat(), home_team_id)
+        except get_dates.GameNotFound:
+            missing += 1
+            continue
+        if native_id != game_id:
+            moves.append((game_id, native_id))
+    if not moves:
+        return 0, missing
+
+    cursor.execute("CREATE TEMP TABLE game_id_map (old_id INT PRIMARY KEY, new_id INT) ON COMMIT DROP;")
+    execute_values(cursor, "INSERT INTO game_id_map (old_id, new_id) VALUES %s;", moves)
+    # Everything that moves is set aside and deleted before any of it is put
+    # back, since an old counter id can be another game's native id
+    for table in ('player_game', 'team_game', 'game'):
+        cursor.execute(f"CREATE TEMP TABLE moved_{table} ON COMMIT DROP AS "
+                       f"SELECT t.*, m.new_id FROM {table} t JOIN game_id_map m ON m.old_id = t.game_id;")
+        cursor.execute(f"DELETE FROM {table} t USING game_id_map m WHERE t.game_id = m.old_id;")
+    cursor.execute("""
+        INSERT INTO game (game_id, date, season, home_team_score, visitor_team_score, home_team_id, visitor_team_id)
+        SELECT new_id, date, season, home_team_score, visitor_team_score, home_team_id, visitor_team_id
+        FROM moved_game
+        ON CONFLICT (game_id) DO NOTHING;
+    """)
+    cursor.execute("INSERT INTO team_game (team_id, game_id) SELECT team_id, new_id FROM moved_team_game "
+                   "ON CONFLICT (team_id, game_id) DO NOTHING;")
+    cursor.execute(f"INSERT INTO player_game ({', '.join(player_game_columns)}) "
+                   f"SELECT {', '.join('new_id' if column == 'game_id' else column for column in player_game_columns)} "
+                   f"FROM moved_player_game ON CONFLICT (player_id, game_id, season) DO NOTHING;")
+    cursor.execute("ANALYZE game; ANALYZE player_game;")
+    # Duplicates dropped from player_game were counted in the rolling windows
+    rolling.rebuild_table(cursor)
+    return len(moves), missing
+
+# Whether the game rows, if any, predate native game ids
+games_predate_native_ids = check_table_exists('game') and not check_table_exists('ingest_checkpoint')
+
 # Create tables and print messages
 if not check_table_exists('team'):
     cursor.execute(create_team_table)
@@ -153,8 +388,13 @@ else:
 
 if not check_table_exists('player_game'):
     cursor.execute(create_player_game_table)
+    create_season_partitions()
     print("Table 'player_game' created successfully.")
+elif not check_table_partitioned('player_game'):
+    rows = migrate_player_game()
+    print(f"Table 'player_game' migrated to season partitions ({rows} rows).")
 else:
+    create_season_partitions()
     print("Table 'player_game' already exists.")
 
 if not check_table_exists('player_team'):
@@ -169,6 +409,47 @@ if not check_table_exists('team_game'):
 else:
     print("Table 'team_game' already exists.")
 
+if not check_table_exists('ingest_checkpoint'):
+    cursor.execute(create_ingest_checkpoint_table)
+    print("Table 'ingest_checkpoint' created successfully.")
+else:
+    print("Table 'ingest_checkpoint' already exists.")
+
+if not check_table_exists('player_rolling_stats'):
+    cursor.execute(create_player_rolling_stats_table)
+    print("Table 'player_rolling_stats' created successfully.")
+else:
+    print("Table 'player_rolling_stats' already exists.")
+
+if not check_table_exists('prop_line_history'):
+    cursor.execute(create_prop_line_history_table)
+    print("Table 'prop_line_history' created successfully.")
+else:
+    print("Table 'prop_line_history' already exists.")
+
+if not check_table_exists('ingest_queue'):
+    cursor.execute(create_ingest_queue_table)
+    print("Table 'ingest_queue' created successfully.")
+else:
+    print("Table 'ingest_queue' already exists.")
+
+if not check_table_exists('ingest_node'):
+    cursor.execute(create_ingest_node_table)
+    print("Table 'ingest_node' created successfully.")
+else:
+    print("Table 'ingest_node' already exists.")
+
+if games_predate_native_ids:
+    moved, missing = remap_game_ids()
+    print(f"Table 'game' moved to native game ids ({moved} games moved, {missing} not listed by /games).")
+
+for create_index in create_indexes:
+    cursor.execute(create_index)
+print("Indexes created successfully.")
+
+cursor.execute(create_player_rolling_avg_view)
+print("View 'player_rolling_avg' created successfully.")
+
 # Commit the transaction
 conn.commit()
 
@@ -15,9 +15,15 @@ execute_psql() {
 
 # Drop tables if they exist
 echo "Dropping existing tables..."
+execute_psql "DROP VIEW IF EXISTS player_rolling_avg;"
+execute_psql "DROP TABLE IF EXISTS player_rolling_stats CASCADE;"
 execute_psql "DROP TABLE IF EXISTS team CASCADE;"
 execute_psql "DROP TABLE IF EXISTS game CASCADE;"
 execute_psql "DROP TABLE IF EXISTS player_game CASCADE;"
 execute_psql "DROP TABLE IF EXISTS player_team CASCADE;"
 execute_psql "DROP TABLE IF EXISTS team_game CASCADE;"
 execute_psql "DROP TABLE IF EXISTS player CASCADE;"
+execute_psql "DROP TABLE IF EXISTS ingest_checkpoint CASCADE;"
+execute_psql "DROP TABLE IF EXISTS prop_line_history CASCADE;"
+execute_psql "DROP TABLE IF EXISTS ingest_queue CASCADE;"
+execute_psql "DROP TABLE IF EXISTS ingest_node CASCADE;"
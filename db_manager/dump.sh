@@ -1,4 +1,7 @@
 #!/bin/bash
+#
+# Plain-SQL dump of the whole database. For a compact, season-partitioned
+# export that can be updated incrementally, see parquet_dump.py.
 
 # Load .env file
 set -a
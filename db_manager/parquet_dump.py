@@ -0,0 +1,253 @@
+"""
+Exports the box_scores database to Parquet and loads it back, as a faster and
+far smaller alternative to the plain-SQL pg_dump in dump.sh.
+
+game, player_game and team_game are partitioned by season
+(data/parquet/<table>/season=<season>/part-0.parquet); team, player and
+player_team are written as single files. A manifest records a fingerprint of
+every exported season and of each dimension table, so an incremental export
+only rewrites what changed. An import rebuilds what ingest would have
+maintained: player_rolling_stats, and an ingest_checkpoint row for every
+imported game date. Readers can memory-map a season's columns with pyarrow without
+running Postgres, e.g. pq.read_table(path, columns=['pts'], memory_map=True).
+
+To run this script, execute one of the following commands from db_manager:
+python parquet_dump.py export
+python parquet_dump.py export --full
+python parquet_dump.py import --seasons 2022 2023
+"""
+
+import argparse
+import io
+import json
+import os
+import sys
+import pyarrow as pa
+import pyarrow.csv as pa_csv
+import pyarrow.parquet as pq
+import psycopg2
+from dotenv import load_dotenv
+
+# box_score/rolling.py maintains player_rolling_stats; an import rebuilds it the same way
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'box_score'))
+import rolling
+
+# Load environment variables from .env
+load_dotenv()
+
+# PostgreSQL connection details
+conn_str = (f"dbname=box_scores user={os.getenv('DB_USER')} " +
+            f"password={os.getenv('DB_PASSWORD')} host={os.getenv('DB_HOST')} " +
+            f"port={os.getenv('DB_PORT')}")
+
+OUTPUT_DIR = os.path.join('data', 'parquet')
+MANIFEST = '_manifest.json'
+COMPRESSION = 'zstd'
+
+# Arrow schema of every exported table, in database column order
+schemas = {
+    'team': pa.schema([
+        ('team_id', pa.int32()), ('conference', pa.string()), ('division', pa.string()), ('city', pa.string()),
+        ('name', pa.string()), ('full_name', pa.string()), ('abbreviation', pa.string()),
+    ]),
+    'player': pa.schema([
+        ('player_id', pa.int32()), ('first_name', pa.string()), ('last_name', pa.string()),
+        ('position', pa.string()), ('height', pa.string()), ('weight', pa.string()),
+        ('jersey_number', pa.string()), ('college', pa.string()), ('country', pa.string()),
+        ('draft_year', pa.int32()), ('draft_round', pa.int32()), ('draft_number', pa.int32()),
+    ]),
+    'player_team': pa.schema([('player_id', pa.int32()), ('team_id', pa.int32())]),
+    'game': pa.schema([
+        ('game_id', pa.int32()), ('date', pa.date32()), ('season', pa.int16()),
+        ('home_team_score', pa.int16()), ('visitor_team_score', pa.int16()),
+        ('home_team_id', pa.int32()), ('visitor_team_id', pa.int32()),
+    ]),
+    'player_game': pa.schema(
+        [('player_id', pa.int32()), ('game_id', pa.int32()), ('min', pa.float32())] +
+        [(name, pa.float32() if name.endswith('_pct') else pa.int16()) for name in (
+            'fgm', 'fga', 'fg_pct', 'fg3m', 'fg3a', 'fg3_pct', 'ftm', 'fta', 'ft_pct', 'oreb', 'dreb',
+            'reb', 'ast', 'stl', 'blk', 'turnover', 'pf', 'pts')] +
+        [('season', pa.int16()), ('game_date', pa.date32())]
+    ),
+    'team_game': pa.schema([('team_id', pa.int32()), ('game_id', pa.int32())]),
+}
+
+table_keys = {
+    'team': ('team_id',),
+    'player': ('player_id',),
+    'player_team': ('player_id', 'team_id'),
+    'game': ('game_id',),
+    'player_game': ('player_id', 'game_id', 'season'),
+    'team_game': ('team_id', 'game_id'),
+}
+
+# player_game partitions span a decade of seasons, as in create_db.py
+SEASONS_PER_PARTITION = 10
+
+dimension_tables = ('team', 'player', 'player_team')
+season_tables = ('game', 'player_game', 'team_game')
+
+# Seasons' contents, cheap to compare between runs
+fingerprint_query = """
+SELECT g.season, COUNT(DISTINCT g.game_id), COUNT(pg.game_id), COALESCE(SUM(pg.pts), 0), MAX(c.committed_at)::text
+FROM game g
+LEFT JOIN player_game pg ON pg.game_id = g.game_id
+LEFT JOIN ingest_checkpoint c ON c.date = g.date
+GROUP BY g.season;
+"""
+
+# Dimension tables' contents. They are small, so each is hashed whole.
+dimension_fingerprint_query = {
+    table: f"SELECT COUNT(*), md5(COALESCE(string_agg(t::text, ',' ORDER BY {', '.join(f't.{key}' for key in keys)}), '')) "
+           f"FROM {table} t;"
+    for table, keys in table_keys.items() if table in dimension_tables
+}
+
+# A checkpoint for every imported game date, as ingest writes once a date is stored
+checkpoint_import_query = """
+INSERT INTO ingest_checkpoint (date, games)
+SELECT date, COUNT(*) FROM game WHERE season = ANY(%(seasons)s) GROUP BY date
+ON CONFLICT (date) DO NOTHING;
+"""
+
+def season_query(table, columns):
+    # Selects one season of a season-partitioned table. player_game carries
+    # its own season, so only its partition for that season is read.
+    if table in ('game', 'player_game'):
+        return f"SELECT {', '.join(columns)} FROM {table} WHERE season = %(season)s"
+    select = ', '.join(f"t.{column}" for column in columns)
+    return f"SELECT {select} FROM {table} t JOIN game g ON g.game_id = t.game_id WHERE g.season = %(season)s"
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Parquet export/import of box_scores")
+    parser.add_argument('command', choices=['export', 'import'], help='Export to Parquet or load Parquet into Postgres')
+    parser.add_argument('--dir', default=OUTPUT_DIR, help='The Parquet dataset directory')
+    parser.add_argument('--seasons', type=int, nargs='+', help='Only these seasons (default: all)')
+    parser.add_argument('--full', action='store_true', help='Export every season, even unchanged ones')
+    return parser.parse_args()
+
+def read_query(cursor, query, schema, params=None):
+    # Streams a query out of Postgres as CSV and parses it into an Arrow table
+    buffer = io.BytesIO()
+    cursor.copy_expert(f"COPY ({cursor.mogrify(query, params).decode()}) TO STDOUT WITH (FORMAT csv, HEADER true)", buffer)
+    buffer.seek(0)
+    convert = pa_csv.ConvertOptions(column_types=schema, strings_can_be_null=True, quoted_strings_can_be_null=False)
+    return pa_csv.read_csv(buffer, convert_options=convert).select(schema.names).cast(schema)
+
+def write_table(table, path):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp = f"{path}.tmp"
+    pq.write_table(table, tmp, compression=COMPRESSION)
+    os.replace(tmp, path)
+
+def season_path(directory, table, season):
+    return os.path.join(directory, table, f"season={season}", 'part-0.parquet')
+
+def load_manifest(directory):
+    path = os.path.join(directory, MANIFEST)
+    if not os.path.exists(path):
+        return {}
+    with open(path) as f:
+        return json.load(f)
+
+def export(directory, seasons=None, full=False):
+    """
+    Writes changed seasons (or every season with full=True) and the dimension
+    tables to Parquet.
+    """
+    conn = psycopg2.connect(conn_str)
+    cursor = conn.cursor()
+    manifest = load_manifest(directory)
+
+    cursor.execute(fingerprint_query)
+    fingerprints = {str(row[0]): list(row[1:]) for row in cursor.fetchall()}
+    changed = [season for season, fingerprint in sorted(fingerprints.items())
+               if (seasons is None or int(season) in seasons)
+               and (full or manifest.get(season) != fingerprint)]
+    dimensions = {}
+    for table, query in dimension_fingerprint_query.items():
+        cursor.execute(query)
+        dimensions[table] = list(cursor.fetchone())
+
+    for season in changed:
+        for table in season_tables:
+            schema = schemas[table]
+            data = read_query(cursor, season_query(table, schema.names), schema, {'season': int(season)})
+            write_table(data, season_path(directory, table, season))
+        manifest[season] = fingerprints[season]
+        print(f"Season {season} exported.")
+
+    # Under a key no season can take
+    exported = manifest.setdefault('dimensions', {})
+    for table in dimension_tables:
+        path = os.path.join(directory, f"{table}.parquet")
+        if full or exported.get(table) != dimensions[table] or not os.path.exists(path):
+            schema = schemas[table]
+            data = read_query(cursor, f"SELECT {', '.join(schema.names)} FROM {table}", schema)
+            write_table(data, path)
+            exported[table] = dimensions[table]
+            print(f"Table {table} exported.")
+
+    with open(os.path.join(directory, MANIFEST), 'w') as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+
+    cursor.close()
+    conn.close()
+    print(f"{len(changed)} season(s) exported, {len(fingerprints) - len(changed)} unchanged.")
+
+def copy_into(cursor, name, data):
+    # COPYs an Arrow table into a staging table and merges it, keeping existing rows
+    columns = ', '.join(data.schema.names)
+    buffer = io.BytesIO()
+    pa_csv.write_csv(data, buffer)
+    buffer.seek(0)
+    cursor.execute(f"CREATE TEMP TABLE IF NOT EXISTS {name}_import (LIKE {name}) ON COMMIT DROP;")
+    cursor.copy_expert(f"COPY {name}_import ({columns}) FROM STDIN WITH (FORMAT csv, HEADER true)", buffer)
+    cursor.execute(f"INSERT INTO {name} ({columns}) SELECT {columns} FROM {name}_import "
+                   f"ON CONFLICT ({', '.join(table_keys[name])}) DO NOTHING;")
+    cursor.execute(f"TRUNCATE {name}_import;")
+
+def create_partition(cursor, season):
+    start = season - season % SEASONS_PER_PARTITION
+    cursor.execute(f"CREATE TABLE IF NOT EXISTS player_game_{start} PARTITION OF player_game "
+                   f"FOR VALUES FROM ({start}) TO ({start + SEASONS_PER_PARTITION});")
+
+def import_dataset(directory, seasons=None):
+    """
+    Loads a Parquet dataset into Postgres in one transaction. Rows that
+    already exist are left untouched. Checkpoints are added for the imported
+    game dates, and player_rolling_stats is rebuilt.
+    """
+    conn = psycopg2.connect(conn_str)
+    cursor = conn.cursor()
+    for table in dimension_tables:
+        copy_into(cursor, table, pq.read_table(os.path.join(directory, f"{table}.parquet")))
+
+    available = sorted(name.split('=')[1] for name in os.listdir(os.path.join(directory, 'game')))
+    imported = []
+    for season in available:
+        if seasons is not None and int(season) not in seasons:
+            continue
+        create_partition(cursor, int(season))
+        for table in season_tables:
+            copy_into(cursor, table, pq.read_table(season_path(directory, table, season), memory_map=True))
+        imported.append(int(season))
+        print(f"Season {season} imported.")
+
+    cursor.execute(checkpoint_import_query, {'seasons': imported})
+    print(f"{cursor.rowcount} checkpoints added.")
+    print(f"Rebuilt {rolling.rebuild_table(cursor)} rolling rows.")
+    conn.commit()
+    cursor.close()
+    conn.close()
+
+def main():
+    args = parse_args()
+    seasons = set(args.seasons) if args.seasons else None
+    if args.command == 'export':
+        export(args.dir, seasons, args.full)
+    else:
+        import_dataset(args.dir, seasons)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,225 @@
+"""
+Keeps the history of PrizePicks lines as a log of changes rather than of boards.
+
+Each projection is identified by KEY (player, stat type and payout). When a
+board is recorded it is compared with the last state seen, and only the lines
+that are new, have moved or have come off the board are appended, with the time
+they were observed; a removed line is stored with an empty Prop. Polling more
+often therefore adds rows only when the board actually changes.
+
+The log is kept either in Postgres (the prop_line_history table created by
+db_manager/create_db.py) or as Parquet files, one per poll with changes, under
+a directory partitioned by day. Either store rebuilds the last state from the
+log on startup, so a restarted watcher does not re-record the whole board.
+
+See PrizePicksScraper.watch, or to replay saved boards into a store:
+python line_history.py players_projections.csv --parquet data/line_history
+"""
+
+import abc
+import argparse
+import datetime
+import glob
+import os
+from dotenv import load_dotenv
+import pandas as pd
+import psycopg2
+from psycopg2.extras import execute_values
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+# Load environment variables from .env
+load_dotenv()
+
+# PostgreSQL connection details
+conn_str = (f"dbname=box_scores user={os.getenv('DB_USER')} " +
+            f"password={os.getenv('DB_PASSWORD')} host={os.getenv('DB_HOST')} " +
+            f"port={os.getenv('DB_PORT')}")
+
+# What identifies a line across polls
+KEY = ['Name', 'Type', 'Payout']
+
+HISTORY_COLUMNS = ['observed_at', 'Name', 'Type', 'Payout', 'Team', 'Opponent', 'Prop']
+
+HISTORY_SCHEMA = pa.schema([
+    ('observed_at', pa.timestamp('ms', tz='UTC')),
+    ('Name', pa.dictionary(pa.int16(), pa.string())),
+    ('Type', pa.dictionary(pa.int8(), pa.string())),
+    ('Payout', pa.dictionary(pa.int8(), pa.string())),
+    ('Team', pa.dictionary(pa.int8(), pa.string())),
+    ('Opponent', pa.dictionary(pa.int8(), pa.string())),
+    ('Prop', pa.float32()),
+])
+
+def diff_board(state, board, observed_at):
+    """
+    Compares a board with the last known lines.
+
+    Args:
+        state (dict): KEY tuple -> (Team, Opponent, Prop) of the lines on the board last time.
+        board (pd.DataFrame): The board just scraped.
+        observed_at (datetime.datetime): When it was scraped.
+
+    Returns:
+        tuple: (the changes as a DataFrame with HISTORY_COLUMNS, the new state).
+    """
+    current = {}
+    for name, proj_type, payout, team, opponent, prop in board[KEY + ['Team', 'Opponent', 'Prop']].itertuples(index=False):
+        current[(name, proj_type, payout)] = (team, opponent, float(prop))
+
+    changes = [(observed_at,) + key + value for key, value in current.items() if state.get(key) != value]
+    changes += [(observed_at,) + key + state[key][:2] + (None,) for key in state.keys() - current.keys()]
+    return pd.DataFrame(changes, columns=HISTORY_COLUMNS), current
+
+class LineHistory(abc.ABC):
+    """
+    An append-only log of line changes. Subclasses store it.
+    """
+
+    def __init__(self):
+        self.state = self.latest()
+
+    def latest(self):
+        # The lines on the board as of the last change recorded
+        return {}
+
+    @abc.abstractmethod
+    def append(self, changes):
+        # Stores the changes (a DataFrame with HISTORY_COLUMNS)
+        pass
+
+    def record(self, board, observed_at=None):
+        """
+        Appends the lines of a board that differ from the last one recorded.
+
+        Args:
+            board (pd.DataFrame): A board as scraped (Name, Prop, Type, Payout, Team, Opponent).
+            observed_at (datetime.datetime): When it was scraped; defaults to now.
+
+        Returns:
+            int: The number of rows appended.
+        """
+        observed_at = observed_at or datetime.datetime.now(datetime.timezone.utc)
+        # Both stores keep milliseconds; flooring here keeps them and the state identical
+        observed_at = pd.Timestamp(observed_at).floor('ms').to_pydatetime()
+        changes, state = diff_board(self.state, board, observed_at)
+        if len(changes):
+            self.append(changes)
+        self.state = state
+        return len(changes)
+
+    @staticmethod
+    def state_from(history):
+        # Replays a log into the state after its last row per line
+        last = history.sort_values('observed_at', kind='stable').drop_duplicates(KEY, keep='last')
+        last = last[last['Prop'].notna()]
+        return {(name, proj_type, payout): (team, opponent, float(prop))
+                for name, proj_type, payout, team, opponent, prop
+                in last[KEY + ['Team', 'Opponent', 'Prop']].itertuples(index=False)}
+
+class ParquetHistory(LineHistory):
+    """
+    Line changes as Parquet files under directory/date=YYYY-MM-DD/.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        super().__init__()
+
+    def read(self):
+        """
+        Loads the whole log.
+
+        Returns:
+            pd.DataFrame: Every row ever appended, oldest first.
+        """
+        paths = sorted(glob.glob(os.path.join(self.directory, 'date=*', '*.parquet')))
+        if not paths:
+            return pd.DataFrame(columns=HISTORY_COLUMNS)
+        frames = [pq.read_table(path).to_pandas() for path in paths]
+        history = pd.concat(frames, ignore_index=True)
+        for column in ('Name', 'Type', 'Payout', 'Team', 'Opponent'):
+            history[column] = history[column].astype(object)
+        return history
+
+    def latest(self):
+        return self.state_from(self.read())
+
+    def append(self, changes):
+        observed_at = changes['observed_at'].iloc[0]
+        directory = os.path.join(self.directory, f"date={observed_at:%Y-%m-%d}")
+        os.makedirs(directory, exist_ok=True)
+        table = pa.Table.from_pandas(changes, schema=HISTORY_SCHEMA, preserve_index=False)
+        path = os.path.join(directory, f"{observed_at:%H%M%S%f}.parquet")
+        pq.write_table(table, f"{path}.tmp", compression='zstd')
+        os.replace(f"{path}.tmp", path)
+
+    def compact(self, day):
+        """
+        Merges a day's files into one.
+
+        Args:
+            day (str): The day, as YYYY-MM-DD.
+        """
+        directory = os.path.join(self.directory, f"date={day}")
+        paths = sorted(glob.glob(os.path.join(directory, '*.parquet')))
+        if len(paths) < 2:
+            return
+        table = pa.concat_tables([pq.read_table(path).cast(HISTORY_SCHEMA) for path in paths])
+        merged = os.path.join(directory, 'compacted.parquet')
+        pq.write_table(table, f"{merged}.tmp", compression='zstd')
+        for path in paths:
+            os.remove(path)
+        # The merged file sorts before any file appended later the same day
+        os.replace(f"{merged}.tmp", os.path.join(directory, '000000000000.parquet'))
+
+latest_query = """
+SELECT DISTINCT ON (name, type, payout) name, type, payout, team, opponent, prop
+FROM prop_line_history
+ORDER BY name, type, payout, observed_at DESC;
+"""
+
+class PostgresHistory(LineHistory):
+    """
+    Line changes in the prop_line_history table.
+    """
+
+    def __init__(self, conn_str=conn_str):
+        self.conn = psycopg2.connect(conn_str)
+        super().__init__()
+
+    def latest(self):
+        with self.conn.cursor() as cursor:
+            cursor.execute(latest_query)
+            rows = cursor.fetchall()
+        self.conn.commit()
+        return {(name, proj_type, payout): (team, opponent, float(prop))
+                for name, proj_type, payout, team, opponent, prop in rows if prop is not None}
+
+    def append(self, changes):
+        rows = [(observed_at.to_pydatetime(), name, proj_type, payout, team, opponent,
+                 None if pd.isna(prop) else float(prop))
+                for observed_at, name, proj_type, payout, team, opponent, prop
+                in changes[HISTORY_COLUMNS].itertuples(index=False)]
+        with self.conn.cursor() as cursor:
+            execute_values(cursor, "INSERT INTO prop_line_history (observed_at, name, type, payout, team, opponent, prop) "
+                                   "VALUES %s", rows)
+        self.conn.commit()
+
+    def close(self):
+        self.conn.close()
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Record boards into the line history")
+    parser.add_argument('boards', nargs='+', help='Board CSVs, recorded in the order given')
+    store = parser.add_mutually_exclusive_group(required=True)
+    store.add_argument('--parquet', help='Directory of the Parquet log')
+    store.add_argument('--postgres', action='store_true', help='Use the prop_line_history table')
+    return parser.parse_args()
+
+if __name__ == '__main__':
+    args = parse_args()
+    history = ParquetHistory(args.parquet) if args.parquet else PostgresHistory()
+    for path in args.boards:
+        board = pd.read_csv(path)
+        print(f"{path}: {history.record(board)} of {len(board)} lines changed.")
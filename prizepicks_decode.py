@@ -0,0 +1,108 @@
+"""
+Decodes the projection JSON the PrizePicks app loads (api.prizepicks.com/projections)
+into the same table PrizePicksScraper.scrape builds from the page:
+Name, Prop, Type, Payout, Team, Opponent.
+
+The responses follow JSON:API: projections in 'data', with their players and
+leagues in 'included'. prizepicks_scrape.py --mode network --dump saves the
+captured responses, so they can be decoded again later without a browser:
+python prizepicks_decode.py data/projections_raw.json --output players_projections.csv
+
+data/projections_fixture.json is a recorded response pair (a repeated
+projection, demon and goblin lines, another league, a first-half line).
+--check compares the decoded board with the expected rows and exits non-zero
+on any difference:
+python prizepicks_decode.py data/projections_fixture.json --check data/projections_fixture.csv
+"""
+
+import argparse
+import json
+import sys
+import pandas as pd
+
+COLUMNS = ['Name', 'Prop', 'Type', 'Payout', 'Team', 'Opponent']
+
+# odds_type as shown on the board
+PAYOUTS = {'standard': 'Standard', 'demon': 'Demon', 'goblin': 'Goblin'}
+
+def related_id(item, name):
+    # The id a JSON:API relationship points to, or None
+    data = (item.get('relationships', {}).get(name) or {}).get('data')
+    return data.get('id') if data else None
+
+def decode_projections(payloads, league='NBA'):
+    """
+    Turns captured /projections responses into the board table.
+
+    Args:
+        payloads (list): Parsed response bodies. Projections repeated across
+            responses are kept once.
+        league (str): The league to keep, or None for every league.
+
+    Returns:
+        pd.DataFrame: One row per projection, with the columns in COLUMNS.
+    """
+    included = {}
+    projections = {}
+    for payload in payloads:
+        for item in payload.get('included', []):
+            included[(item['type'], item['id'])] = item.get('attributes', {})
+        for item in payload.get('data', []):
+            if item.get('type') == 'projection':
+                projections[item['id']] = item
+
+    rows = []
+    for item in projections.values():
+        attributes = item.get('attributes', {})
+        player = included.get(('new_player', related_id(item, 'new_player')), {})
+        league_name = included.get(('league', related_id(item, 'league')), {}).get('name', player.get('league'))
+        if league is not None and league_name != league:
+            continue
+        rows.append({
+            'Name': player.get('display_name') or player.get('name'),
+            'Prop': float(attributes['line_score']),
+            'Type': attributes.get('stat_type'),
+            'Payout': PAYOUTS.get(attributes.get('odds_type', 'standard'), 'Standard'),
+            'Team': player.get('team'),
+            'Opponent': (attributes.get('description') or '').split(' ')[0],
+        })
+    return pd.DataFrame(rows, columns=COLUMNS)
+
+def load_dump(path):
+    # A file written by PrizePicksScraper.save_raw: a list of response bodies
+    with open(path) as f:
+        payloads = json.load(f)
+    return payloads if isinstance(payloads, list) else [payloads]
+
+def check(board, expected_path):
+    """
+    Compares a decoded board with a CSV of the expected rows, in order.
+
+    Returns:
+        bool: True if they match.
+    """
+    expected = pd.read_csv(expected_path)
+    try:
+        pd.testing.assert_frame_equal(board.reset_index(drop=True), expected, check_dtype=False)
+    except AssertionError as e:
+        print(f"Decoded board differs from {expected_path}:\n{e}")
+        return False
+    print(f"Decoded board matches {expected_path} ({len(expected)} rows).")
+    return True
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Decode captured PrizePicks projection responses")
+    parser.add_argument('dump', help='JSON file of captured responses')
+    parser.add_argument('--league', default='NBA', help='League to keep')
+    parser.add_argument('--output', help='Write the board to this CSV')
+    parser.add_argument('--check', help='CSV of the rows the dump must decode to')
+    return parser.parse_args()
+
+if __name__ == '__main__':
+    args = parse_args()
+    board = decode_projections(load_dump(args.dump), args.league)
+    print(f"Decoded {len(board)} projections.")
+    if args.output:
+        board.to_csv(args.output, index=False)
+    if args.check and not check(board, args.check):
+        sys.exit(1)
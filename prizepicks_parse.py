@@ -0,0 +1,127 @@
+"""
+Extracts the projections from the HTML of the PrizePicks board, with one of
+several parser backends:
+
+- bs4: BeautifulSoup with html.parser and a find() call per field, as the
+  scraper always did. Needs only the pure-Python standard parser.
+- lxml: libxml2's HTML parser.
+- selectolax: the lexbor HTML5 parser.
+
+The lxml and selectolax backends visit each projection's elements once and
+pick the fields out by (tag, id) or (tag, class) with a dictionary lookup, so
+the work per projection is one walk over its subtree. Every backend returns the
+same rows. bench_parse.py compares them on saved board snapshots.
+"""
+
+try:
+    import bs4
+except ImportError:
+    bs4 = None
+try:
+    import lxml.html
+    from lxml import etree
+except ImportError:
+    lxml = None
+try:
+    from selectolax.lexbor import LexborHTMLParser
+except ImportError:
+    LexborHTMLParser = None
+
+COLUMNS = ['Name', 'Prop', 'Type', 'Payout', 'Team', 'Opponent']
+
+# Field elements of a projection, by (tag, id) and (tag, class). Prop, Type, Team
+# and Opponent hold the raw text here; row() cleans it up.
+FIELDS_BY_ID = {
+    ('h3', 'test-player-name'): 'Name',
+    ('div', 'test-team-position'): 'Team',
+}
+FIELDS_BY_CLASS = {
+    ('div', 'flex flex-1 items-center pr-2'): 'Prop',
+    ('div', 'text-soClean-140 max-w-[100px] self-center text-left text-xs leading-[14px]'): 'Type',
+    ('time', 'text-soClean-140 text-xs'): 'Opponent',
+}
+
+# Demon and goblin projections carry an image inside this div, named in its alt text
+PAYOUT_CLASS = 'absolute -right-4 left-1/2 top-12'
+
+def row(fields):
+    # A board row from the raw text of a projection's fields
+    return {'Name': fields['Name'],
+            'Prop': float(fields['Prop']),
+            'Type': fields['Type'].strip(),
+            'Payout': fields.get('Payout', 'Standard'),
+            'Team': fields['Team'].split()[0].strip(),
+            'Opponent': fields['Opponent'].split()[1].strip()}
+
+def parse_bs4(html):
+    soup = bs4.BeautifulSoup(html, 'html.parser')
+    rows = []
+    for projection in soup.find_all('li', {'id': 'test-projection-li'}):
+        fields = {'Name': projection.find('h3', {'id': 'test-player-name'}).text,
+                  'Prop': projection.find('div', {'class': 'flex flex-1 items-center pr-2'}).text,
+                  'Type': projection.find('div', {'class': 'text-soClean-140 max-w-[100px] self-center text-left text-xs leading-[14px]'}).text,
+                  'Team': projection.find('div', {'id': 'test-team-position'}).text,
+                  'Opponent': projection.find('time', {'class': 'text-soClean-140 text-xs'}).text}
+        # try getting demon/goblin projection
+        try:
+            fields['Payout'] = projection.find('div', {'class': PAYOUT_CLASS}).find('img').get('alt')
+        except AttributeError:
+            pass
+        rows.append(row(fields))
+    return rows
+
+if lxml is not None:
+    PROJECTIONS_XPATH = etree.XPath("//li[@id='test-projection-li']")
+
+def parse_lxml(html):
+    rows = []
+    for projection in PROJECTIONS_XPATH(lxml.html.fromstring(html)):
+        fields = {}
+        for element in projection.iter():
+            tag = element.tag
+            field = FIELDS_BY_ID.get((tag, element.get('id'))) or FIELDS_BY_CLASS.get((tag, element.get('class')))
+            if field is not None:
+                fields[field] = element.text_content()
+            elif tag == 'img' and element.getparent().get('class') == PAYOUT_CLASS:
+                fields['Payout'] = element.get('alt')
+        rows.append(row(fields))
+    return rows
+
+def parse_selectolax(html):
+    rows = []
+    for projection in LexborHTMLParser(html).css('li#test-projection-li'):
+        fields = {}
+        for node in projection.traverse():
+            tag = node.tag
+            attributes = node.attributes
+            field = (FIELDS_BY_ID.get((tag, attributes.get('id'))) or
+                     FIELDS_BY_CLASS.get((tag, attributes.get('class'))))
+            if field is not None:
+                fields[field] = node.text()
+            elif tag == 'img' and node.parent.attributes.get('class') == PAYOUT_CLASS:
+                fields['Payout'] = attributes.get('alt')
+        rows.append(row(fields))
+    return rows
+
+# Backends whose libraries are installed, fastest first
+PARSERS = {name: parse for name, parse, module in (('selectolax', parse_selectolax, LexborHTMLParser),
+                                                   ('lxml', parse_lxml, lxml),
+                                                   ('bs4', parse_bs4, bs4))
+           if module is not None}
+
+DEFAULT_PARSER = next(iter(PARSERS), None)
+
+def parse_board(html, parser=DEFAULT_PARSER):
+    """
+    Extracts every projection on a board page.
+
+    Args:
+        html (str): The page source.
+        parser (str): A key of PARSERS.
+
+    Returns:
+        list: One dict per projection, with the keys in COLUMNS.
+    """
+    if parser not in PARSERS:
+        raise ValueError(f"Parser {parser!r} is not available; installed: {', '.join(PARSERS) or 'none'}")
+    return PARSERS[parser](html)
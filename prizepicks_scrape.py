@@ -3,11 +3,23 @@ This script scrapes player projections from the 'Today’s Board' section of the
 It navigates through the NBA tab, collects player names, projected points, projection types,
 and payout types, and exports the collected data to a CSV file named 'players_projections.csv'.
 
+In network mode the scraper does not click through the stat categories. It reads the
+projection JSON the app requests when the NBA tab opens, from Chrome's performance log
+through the CDP session, and decodes every category at once with prizepicks_decode.py.
+
+The scraper waits for the elements it needs rather than for fixed times, keeps one
+browser across retries, and prints how long each phase took. With --watch it polls the
+board and appends only the lines that moved to a history (line_history.py).
+
 Please ensure that you have Selenium, pandas, and BeautifulSoup installed in your Python environment to run this script.
+With lxml or selectolax installed the page is parsed with it instead (--parser), which is much faster.
 Also, make sure you have the Chrome WebDriver installed and in your system's PATH.
 
-To run this script, execute the following command in your terminal:
+To run this script, execute one of the following commands in your terminal:
 python prizepicks_scrape.py
+python prizepicks_scrape.py --mode network --dump data/projections_raw.json
+python prizepicks_scrape.py --headless --base_url file://$PWD/data/board_fixture.html
+python prizepicks_scrape.py --headless --watch 120 --history data/line_history
 
 ----------------------------------------------------------------------------------
     By: Minchan Kim
@@ -15,35 +27,161 @@ python prizepicks_scrape.py
     Last Updated: 2024-03-31
 """
 
+import argparse
+import json
+import os
+import re
 import time
+from contextlib import contextmanager
 import pandas as pd
 from selenium import webdriver
+from selenium.common.exceptions import StaleElementReferenceException, TimeoutException, WebDriverException
 from selenium.webdriver.common.by import By
-import bs4
+from selenium.webdriver.support import expected_conditions as EC
+from selenium.webdriver.support.ui import WebDriverWait
+from prizepicks_decode import decode_projections
+from prizepicks_parse import DEFAULT_PARSER, PARSERS, parse_board
+
+# Where the scraper starts; a saved board (file://...) works as well
+BASE_URL = 'https://www.prizepicks.com/'
+
+# Longest wait for any one element, in seconds
+TIMEOUT = 30
+
+# Longest wait for the list to change after a category click. A category's
+# list usually replaces the last one well within this; only the category that
+# is already showing never changes, and this bounds that case.
+SETTLE_TIMEOUT = 1
+
+# Requests whose responses hold the board's projections
+PROJECTIONS_URL = 'api.prizepicks.com/projections'
+
+# Elements the scraper waits on
+BOARD_LINK = (By.LINK_TEXT, 'Today’s Board')
+SOUNDS_GOOD = (By.XPATH, '/html/body/div[3]/div[3]/div/div/div[2]/button')
+NBA_TAB = (By.XPATH, "//div[@class='name' and text()='NBA']")
+STAT_CONTAINER = (By.CSS_SELECTOR, '.stat-container')
+PROJECTION = (By.CSS_SELECTOR, 'li#test-projection-li')
+
+def projections_changed(previous):
+    """
+    A wait condition: true once the projection list differs from the one seen
+    before a click. The page either replaces the list, so the old elements go
+    stale, or reuses its elements, so their number or text changes.
+
+    Args:
+        previous (list): The projection elements before the click, at least one.
+    """
+    first, count = previous[0], len(previous)
+    text = first.text
+
+    def changed(driver):
+        try:
+            if first.text != text:
+                return True
+        except StaleElementReferenceException:
+            return True
+        return len(driver.find_elements(*PROJECTION)) != count
+    return changed
 
 class PrizePicksScraper:
     """
     A class to scrape player projections from the PrizePicks website.
     """
 
-    def __init__(self):
+    def __init__(self, mode='dom', headless=False, base_url=BASE_URL, timeout=TIMEOUT,
+                 parser=DEFAULT_PARSER, snapshots=None):
         """
-        Initializes the PrizePicksScraper class.
+        Initializes the PrizePicksScraper class. Chrome is started on first use and
+        kept open across retries until close() is called.
+
+        Args:
+            mode (str): 'dom' to parse the page for each category, 'network' to decode
+                the projection responses the page loads.
+            headless (bool): Run Chrome without a window.
+            base_url (str): The page to start from, e.g. a saved board for testing.
+            timeout (int): Longest wait for any one element, in seconds.
+            parser (str): HTML parser backend for the DOM mode, see prizepicks_parse.py.
+            snapshots (str): Directory to save each category's page source to, or None.
         """
-        self.driver = webdriver.Chrome()
+        self.mode = mode
+        self.headless = headless
+        self.base_url = base_url
+        self.timeout = timeout
+        self.parser = parser
+        self.snapshots = snapshots
+        self.driver = None
+        self.wait = None
         self.players_projections = pd.DataFrame()
+        self.raw_projections = []
+        self.timings = {}
 
-
-    def scrape(self) -> pd.DataFrame:
+    def new_driver(self):
         """
-        Navigates to the PrizePicks website, interacts with it to find NBA player projections, 
-        and collects data into a pandas DataFrame which is stored in self.player_projections.
+        Starts Chrome, with the performance log (network events) enabled in network mode.
+        """
+        options = webdriver.ChromeOptions()
+        if self.headless:
+            options.add_argument('--headless=new')
+            options.add_argument('--window-size=1920,1080')
+        if self.mode == 'network':
+            options.set_capability('goog:loggingPrefs', {'performance': 'ALL'})
+        return webdriver.Chrome(options=options)
 
-        This method should be run within the retry method to handle potential transient errors.
+    def start(self):
+        # Starts Chrome unless a session is already open
+        if self.driver is None:
+            with self.phase('launch'):
+                self.driver = self.new_driver()
+                self.wait = WebDriverWait(self.driver, self.timeout)
+        return self.driver
+
+    def alive(self):
+        # Whether the browser session still answers
+        if self.driver is None:
+            return False
+        try:
+            self.driver.current_url
+            return True
+        except WebDriverException:
+            return False
 
-        This method closes the WebDriver instance upon completion or error.
+    def close(self):
         """
+        Quits Chrome, if it is running.
+        """
+        if self.driver is not None:
+            try:
+                self.driver.quit()
+            except WebDriverException:
+                pass
+            self.driver = None
+            self.wait = None
+
+    @contextmanager
+    def phase(self, name):
+        # Adds the time spent in the block to self.timings[name]
+        start = time.perf_counter()
         try:
+            yield
+        finally:
+            self.timings[name] = self.timings.get(name, 0) + time.perf_counter() - start
+
+    def log_timings(self):
+        print(', '.join(f"{name} {seconds:.2f}s" for name, seconds in self.timings.items()))
+
+    def open_board(self):
+        """
+        Opens Today's Board, past the location prompt, and waits for the NBA tab.
+        A reused browser is taken back to base_url in a single tab.
+        """
+        self.start()
+        with self.phase('open'):
+            for handle in self.driver.window_handles[1:]:
+                self.driver.switch_to.window(handle)
+                self.driver.close()
+            self.driver.switch_to.window(self.driver.window_handles[0])
+
             # Allows Geolocation for browser
             self.driver.execute_cdp_cmd (
                 "Browser.grantPermissions",
@@ -52,76 +190,144 @@ class PrizePicksScraper:
                     "permissions": ["geolocation"],
                 },
             )
-            
-            # Opens PrizePicks URL and goes to Today's Board
-            self.driver.get('https://www.prizepicks.com/')
-            self.driver.find_element(By.LINK_TEXT, 'Today’s Board').click()
 
-            # Lets app.prizepicks.com load, then switches to the tab
-            time.sleep(20)
-            self.driver.switch_to.window(self.driver.window_handles[-1])
+            # Opens the PrizePicks URL; the landing page links to the board in a new tab,
+            # a saved board is the board itself
+            self.driver.get(self.base_url)
+            self.wait.until(EC.any_of(EC.element_to_be_clickable(BOARD_LINK),
+                                      EC.presence_of_element_located(NBA_TAB)))
+            links = self.driver.find_elements(*BOARD_LINK)
+            if links:
+                windows = len(self.driver.window_handles)
+                links[0].click()
+                self.wait.until(EC.number_of_windows_to_be(windows + 1))
+                self.driver.switch_to.window(self.driver.window_handles[-1])
+
+        with self.phase('board'):
+            # Clicks on 'Sounds Good' button to proceed to the site, if it asks
+            self.wait.until(EC.any_of(EC.element_to_be_clickable(SOUNDS_GOOD),
+                                      EC.element_to_be_clickable(NBA_TAB)))
+            buttons = self.driver.find_elements(*SOUNDS_GOOD)
+            if buttons:
+                buttons[0].click()
+                self.driver.refresh()
+            self.wait.until(EC.element_to_be_clickable(NBA_TAB))
 
-            # Clicks on 'Sounds Good' button to proceed to the site
-            self.driver.find_element(By.XPATH, '/html/body/div[3]/div[3]/div/div/div[2]/button').click()
-            self.driver.refresh()
-            time.sleep(5)
+    def open_nba(self):
+        # Clicks on NBA tab and returns its stat categories once they are shown
+        self.driver.find_element(*NBA_TAB).click()
+        self.wait.until(lambda driver: driver.find_element(*STAT_CONTAINER).text.strip())
+        return self.driver.find_element(*STAT_CONTAINER).text.split('\n')
+
+    def wait_for_projections(self, changed):
+        """
+        Waits for the projection list of a category that was just clicked.
 
-            # Clicks on NBA tab
-            self.driver.find_element(By.XPATH, "//div[@class='name' and text()='NBA']").click()
-            time.sleep(10)
+        Args:
+            changed: projections_changed for the list before the click, or None if it was empty.
+        """
+        if changed is None:
+            self.wait.until(EC.presence_of_element_located(PROJECTION))
+            return
+        try:
+            WebDriverWait(self.driver, SETTLE_TIMEOUT, poll_frequency=0.05).until(changed)
+        except TimeoutException:
+            # The category was already showing
+            pass
 
+    def scrape(self) -> pd.DataFrame:
+        """
+        Navigates to the PrizePicks website, interacts with it to find NBA player projections, 
+        and collects data into a pandas DataFrame which is stored in self.player_projections.
+
+        This method should be run within the retry method to handle potential transient errors.
+
+        The browser is left open; call close() when done.
+        """
+        self.open_board()
+
+        with self.phase('categories'):
             # Find all stat elements within the stat-container
             # i.e. categories is the list ['Points','Rebounds',...,'Turnovers']
-            categories = self.driver.find_element(By.CSS_SELECTOR, '.stat-container').text.split('\n')
-            nbaPlayers = []
+            categories = self.open_nba()
+            self.wait.until(EC.presence_of_element_located(PROJECTION))
+        nbaPlayers = []
 
-            for category in categories:
+        for category in categories:
+            with self.phase('categories'):
                 # Click on the category to get the player projections
+                previous = self.driver.find_elements(*PROJECTION)
+                changed = projections_changed(previous) if previous else None
                 self.driver.find_element(By.XPATH, f"//div[text()='{category}']").click()
-                time.sleep(5)
+                self.wait_for_projections(changed)
 
-                # Get the page source and parse it
+                # Get the page source
                 html = self.driver.page_source
-                soup = bs4.BeautifulSoup(html, 'html.parser')
-
-                # Find all player projections
-                projections = soup.find_all('li', {'id': 'test-projection-li'})
-
-                for projection in projections:
-                    # get player name, projection, and type of projection
-                    name = projection.find('h3', {'id': 'test-player-name'}).text
-                    point = projection.find('div', {'class': 'flex flex-1 items-center pr-2'}).text
-                    proj_type = projection.find('div', {'class': 'text-soClean-140 max-w-[100px] self-center text-left text-xs leading-[14px]'}).text.strip()
-                    team = projection.find('div', {'id': 'test-team-position'}).text.split()[0].strip()
-                    opponent = projection.find('time', {'class': 'text-soClean-140 text-xs'}).text.split()[1].strip()
-
-                    # try getting demon/goblin projection
-                    try:
-                        payout = projection.find('div', {'class': 'absolute -right-4 left-1/2 top-12'}).find('img').get('alt')
-                    except AttributeError:
-                        payout = 'Standard'
-
-                    # convert point to float
-                    point = float(point)
-
-                    # append player data to list
-                    players = {'Name': name, 
-                               'Prop': point,
-                               'Type': proj_type, 
-                               'Payout': payout, 
-                               'Team': team, 
-                               'Opponent': opponent}
-                    nbaPlayers.append(players)
-
-            # Updates self.players_projections from the list of player data
-            self.players_projections = pd.DataFrame(nbaPlayers)
-        finally:
-            self.driver.quit()
+
+            if self.snapshots:
+                self.save_snapshot(category, html)
+
+            with self.phase('parse'):
+                nbaPlayers.extend(parse_board(html, self.parser))
+
+        # Updates self.players_projections from the list of player data
+        self.players_projections = pd.DataFrame(nbaPlayers)
     
 
+    def captured_responses(self, quiet=2):
+        """
+        Collects the bodies of the projection responses in the performance log.
+
+        Waits until at least one has arrived and no projection request has been
+        pending for `quiet` seconds, or until the timeout has passed.
+
+        Returns:
+            list: The parsed response bodies.
+        """
+        pending = set()
+        bodies = []
+        deadline = time.time() + self.timeout
+        last_seen = time.time()
+        while time.time() < deadline:
+            for entry in self.driver.get_log('performance'):
+                message = json.loads(entry['message'])['message']
+                params = message.get('params', {})
+                if message['method'] == 'Network.responseReceived' and PROJECTIONS_URL in params['response']['url']:
+                    pending.add(params['requestId'])
+                    last_seen = time.time()
+                elif message['method'] == 'Network.loadingFinished' and params.get('requestId') in pending:
+                    pending.discard(params['requestId'])
+                    body = self.driver.execute_cdp_cmd('Network.getResponseBody', {'requestId': params['requestId']})
+                    bodies.append(json.loads(body['body']))
+                    last_seen = time.time()
+            if bodies and not pending and time.time() - last_seen >= quiet:
+                break
+            time.sleep(0.25)
+        return bodies
+
+    def scrape_network(self) -> pd.DataFrame:
+        """
+        Opens the NBA board once and decodes every category from the projection
+        responses the page loads, instead of clicking through each one.
+
+        The browser is left open; call close() when done.
+        """
+        self.open_board()
+        with self.phase('responses'):
+            self.driver.execute_cdp_cmd('Network.enable', {})
+            # Drops the log of the page loads so far; the NBA tab triggers its own request
+            self.driver.get_log('performance')
+            self.driver.find_element(*NBA_TAB).click()
+            self.raw_projections = self.captured_responses()
+            if not self.raw_projections:
+                raise RuntimeError('No projection responses were captured.')
+        with self.phase('parse'):
+            self.players_projections = decode_projections(self.raw_projections)
+
     def retry(self, max_attempts = 5):
         """
-        Retries the function if an error occurs.
+        Retries the function if an error occurs. Each attempt reloads the board in
+        the same browser; Chrome is only restarted if its session has died.
 
         Args:
             max_attempts (int): The maximum number of times to retry the function.
@@ -131,17 +337,44 @@ class PrizePicksScraper:
         """
         attempt = 0
         while attempt < max_attempts:
+            self.timings = {}
             try:
-                self.driver = webdriver.Chrome()
-                self.scrape()
+                if self.mode == 'network':
+                    self.scrape_network()
+                else:
+                    self.scrape()
+                self.log_timings()
                 return self.players_projections
             except Exception as e:
-                print('An error occurred. Retrying...')
+                print(f'An error occurred ({type(e).__name__}). Retrying...')
+                self.log_timings()
+                if not self.alive():
+                    self.close()
                 time.sleep(5)
                 attempt += 1
         print('Failed to scrape data after maximum attempts.')
         return None
         
+    def watch(self, history, interval=300, polls=None):
+        """
+        Scrapes the board every `interval` seconds in the same browser and records
+        the lines that changed since the last poll.
+
+        Args:
+            history (LineHistory): Where changes are appended, see line_history.py.
+            interval (int): Seconds from the start of one poll to the next.
+            polls (int): Polls to run, or None to run until interrupted.
+        """
+        poll = 0
+        while polls is None or poll < polls:
+            start = time.time()
+            if self.retry() is not None:
+                changed = history.record(self.players_projections)
+                print(f"{time.strftime('%H:%M:%S')}: {changed} of {len(self.players_projections)} lines changed.")
+            poll += 1
+            if polls is None or poll < polls:
+                time.sleep(max(0, interval - (time.time() - start)))
+
     def save_to_csv(self, filename):
         """
         Saves the player projections to a CSV file.
@@ -151,13 +384,63 @@ class PrizePicksScraper:
         """
         self.players_projections.to_csv(filename, index=False)
 
+    def save_snapshot(self, category, html):
+        # Keeps a category's page source, e.g. for bench_parse.py
+        os.makedirs(self.snapshots, exist_ok=True)
+        name = re.sub(r'[^A-Za-z0-9]+', '_', category).strip('_')
+        with open(os.path.join(self.snapshots, f"{time.strftime('%Y%m%d_%H%M%S')}_{name}.html"), 'w', encoding='utf-8') as f:
+            f.write(html)
+
+    def save_raw(self, filename):
+        """
+        Saves the captured projection responses as JSON, for prizepicks_decode.py.
+
+        Args:
+            filename (str): The name of the JSON file to save the responses to.
+        """
+        with open(filename, 'w') as f:
+            json.dump(self.raw_projections, f)
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Scrape the PrizePicks NBA board")
+    parser.add_argument('--mode', choices=['dom', 'network'], default='dom', help='Parse the page or decode its JSON')
+    parser.add_argument('--dump', help='In network mode, also save the captured responses to this file')
+    parser.add_argument('--headless', action='store_true', help='Run Chrome without a window')
+    parser.add_argument('--base_url', default=BASE_URL, help='Page to start from, e.g. file://.../data/board_fixture.html')
+    parser.add_argument('--parser', choices=list(PARSERS), default=DEFAULT_PARSER, help='HTML parser backend')
+    parser.add_argument('--snapshots', help='Save each category page to this directory')
+    parser.add_argument('--timeout', type=int, default=TIMEOUT, help='Longest wait for any one element, in seconds')
+    parser.add_argument('--watch', type=int, metavar='SECONDS', help='Poll the board at this interval and record line changes')
+    parser.add_argument('--history', default='data/line_history', help='Parquet directory of line changes, or "postgres"')
+    return parser.parse_args()
+
 if __name__ == '__main__':
+    args = parse_args()
+
     # Create an instance of the PrizePicksScraper class.
-    scraper = PrizePicksScraper()
+    scraper = PrizePicksScraper(args.mode, args.headless, args.base_url, args.timeout,
+                                args.parser, args.snapshots)
 
-    # Attempt to scrape player projections and save to CSV file.
-    data = scraper.retry()
+    if args.watch:
+        # Poll until interrupted, recording only the lines that change. Imported
+        # here so a one-shot scrape needs neither pyarrow nor a database.
+        from line_history import ParquetHistory, PostgresHistory
+        history = PostgresHistory() if args.history == 'postgres' else ParquetHistory(args.history)
+        try:
+            scraper.watch(history, args.watch)
+        except KeyboardInterrupt:
+            pass
+        finally:
+            scraper.close()
+    else:
+        # Attempt to scrape player projections and save to CSV file.
+        try:
+            data = scraper.retry()
+        finally:
+            scraper.close()
 
-    if data is not None:
-        scraper.save_to_csv('players_projections.csv')
-        print("Data scraped and saved to players_projections.csv successfully.")
\ No newline at end of file
+        if data is not None:
+            scraper.save_to_csv('players_projections.csv')
+            if args.dump and scraper.raw_projections:
+                scraper.save_raw(args.dump)
+            print("Data scraped and saved to players_projections.csv successfully.")